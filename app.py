@@ -1,12 +1,31 @@
 import streamlit as st
-from typing import Dict
+from typing import Dict, Optional
 import requests
+import json
 import logging
-from backend.app.api.routes import analyze_dosha
-from backend.app.api.routes import get_personal_consultation
+import uuid
+from backend.app.config import get_app_cache_settings, get_backend_settings
+from backend.app.models.questionnaire import QUESTIONNAIRE
+from backend.app.services.job_queue import FAILED, JOB_EVENT, QUEUED
+from backend.app.services.knowledge_base import INSTANT_EVENT
+from backend.app.services.metrics import RENDER, get_metrics
+from backend.app.services.response_cache import ResponseCache, make_payload_key
+from backend.app.services.response_parser import is_fallback, section_events
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
+# With BACKEND_URL set the services run in the ASGI backend and this process
+# only serves the UI; otherwise they run in-process
+BACKEND_URL = get_backend_settings()["url"]
+if BACKEND_URL:
+    from backend.app.api.client import (
+        analyze_dosha_answers, get_job, get_metrics_text, stream_job, submit_consultation_job
+    )
+else:
+    from backend.app.api.routes import (
+        analyze_dosha_answers, get_job, stream_job, submit_consultation_job, warm_up_services
+    )
+
 # Page config
 st.set_page_config(
     page_title="Ayurvedic Consultation Platform",
@@ -14,82 +33,79 @@ st.set_page_config(
     layout="wide"
 )
 
+# Streamlit reruns this script on every interaction. Finished results live
+# in process-wide caches instead, so reruns only re-render and identical
+# inputs from other sessions are answered without recomputation. Fallback
+# results are shown but never cached. The services themselves are the
+# process-wide singletons in backend/app/api/routes.py.
+APP_CACHE = get_app_cache_settings()
+
+@st.cache_resource(show_spinner=False)
+def _consultation_results() -> ResponseCache:
+    # Finished consultations as JSON, keyed on the canonical consultation payload
+    return ResponseCache(max_entries=APP_CACHE["max_entries"], ttl_seconds=APP_CACHE["ttl_seconds"])
+
+@st.cache_resource(show_spinner=False)
+def _dosha_results() -> ResponseCache:
+    # Finished dosha analyses as JSON, keyed on the questionnaire answers only
+    return ResponseCache(max_entries=APP_CACHE["max_entries"], ttl_seconds=APP_CACHE["ttl_seconds"])
+
+def _cacheable_dosha_results(results: Optional[Dict]) -> bool:
+    recommendations = results.get("recommendations") if results else None
+    return recommendations is not None and not is_fallback(recommendations)
+
+def _analyze_dosha(answers: Dict[str, str]) -> Dict:
+    results_key = make_payload_key(answers)
+    cached = _dosha_results().get(results_key)
+    if cached is not None:
+        return json.loads(cached)
+    results = analyze_dosha_answers(answers, session_id=_session_id())
+    if _cacheable_dosha_results(results):
+        _dosha_results().set(results_key, json.dumps(results))
+    return results
+
+def _cached_consultation(results_key: str) -> Optional[Dict]:
+    cached = _consultation_results().get(results_key)
+    return json.loads(cached) if cached is not None else None
+
+@st.cache_data(show_spinner=False, max_entries=APP_CACHE["max_entries"], ttl=APP_CACHE["ttl_seconds"])
+def _download_report(results_key: str, _results: Dict) -> str:
+    # Rendered once per consultation rather than on every rerun
+    return _format_recommendations_for_download(_results)
+
 def dosha_analysis():
     st.title("Dosha Analysis")
     
     with st.form("dosha_questionnaire"):
-        st.subheader("Physical Characteristics")
-        
-        body_frame = st.select_slider(
-            "Body Frame",
-            options=["Very Slim", "Medium", "Large"],
-            help="Select your natural body frame type"
-        )
-        
-        skin_type = st.select_slider(
-            "Skin Type",
-            options=["Dry/Rough", "Warm/Sensitive", "Thick/Oily"],
-            help="Select your natural skin type"
-        )
-        
-        st.subheader("Behavioral Patterns")
-        
-        sleep_pattern = st.select_slider(
-            "Sleep Pattern",
-            options=["Light/Irregular", "Moderate", "Deep/Heavy"],
-            help="Select your typical sleep pattern"
-        )
-        
-        digestion = st.select_slider(
-            "Digestion",
-            options=["Irregular", "Strong/Sharp", "Slow/Steady"],
-            help="Select your typical digestion pattern"
-        )
-        
-        stress_response = st.select_slider(
-            "Response to Stress",
-            options=["Anxiety/Worry", "Irritation/Anger", "Withdrawal/Calm"],
-            help="Select how you typically respond to stress"
-        )
+        answers = {}
+        current_section = None
+        for trait in QUESTIONNAIRE.traits:
+            if trait.section != current_section:
+                current_section = trait.section
+                st.subheader(current_section)
+            
+            answers[trait.trait_name] = st.select_slider(
+                trait.label,
+                options=[option.label for option in trait.options],
+                help=trait.help
+            )
         
         submitted = st.form_submit_button("Analyze My Dosha")
         
         if submitted:
             with st.spinner("Analyzing your Dosha..."):
                 try:
-                    # Convert responses to API format
-                    user_responses = {
-                        "body_frame": {
-                            "trait_name": "body_frame",
-                            **map_response_to_dosha_scores(body_frame)
-                        },
-                        "skin_type": {
-                            "trait_name": "skin_type",
-                            **map_response_to_dosha_scores(skin_type)
-                        },
-                        "sleep_pattern": {
-                            "trait_name": "sleep_pattern",
-                            **map_response_to_dosha_scores(sleep_pattern)
-                        },
-                        "digestion": {
-                            "trait_name": "digestion",
-                            **map_response_to_dosha_scores(digestion)
-                        },
-                        "stress_response": {
-                            "trait_name": "stress_response",
-                            **map_response_to_dosha_scores(stress_response)
-                        }
-                    }
                     # # Call API
                     # response = requests.post(
                     #     "https://dva-x7pg.onrender.com/analyze-dosha",
                     #     json=user_responses,
                     #     timeout=30
                     # )
-                    results = analyze_dosha(user_responses)
+                    results = _analyze_dosha(answers)
                     st.session_state.dosha_profile = results
                     if results:
-                        display_dosha_results(results)
+                        with get_metrics().timed(RENDER, route="recommendations"):
+                            display_dosha_results(results)
                     else:
                         st.error(f"Unable to analyze dosha")
                 except requests.exceptions.RequestException as e:
@@ -97,31 +113,6 @@ def dosha_analysis():
                 except Exception as e:
                     st.error(f"An error occurred: {str(e)}")
 
-def map_response_to_dosha_scores(response: str) -> Dict[str, int]:
-    mappings = {
-        # Body Frame
-        "Very Slim": {"vata_score": 3, "pitta_score": 1, "kapha_score": 0},
-        "Medium": {"vata_score": 1, "pitta_score": 3, "kapha_score": 1},
-        "Large": {"vata_score": 0, "pitta_score": 1, "kapha_score": 3},
-        # Skin Type
-        "Dry/Rough": {"vata_score": 3, "pitta_score": 1, "kapha_score": 0},
-        "Warm/Sensitive": {"vata_score": 1, "pitta_score": 3, "kapha_score": 0},
-        "Thick/Oily": {"vata_score": 0, "pitta_score": 1, "kapha_score": 3},
-        # Sleep Pattern
-        "Light/Irregular": {"vata_score": 3, "pitta_score": 1, "kapha_score": 0},
-        "Moderate": {"vata_score": 1, "pitta_score": 3, "kapha_score": 1},
-        "Deep/Heavy": {"vata_score": 0, "pitta_score": 1, "kapha_score": 3},
-        # Digestion
-        "Irregular": {"vata_score": 3, "pitta_score": 0, "kapha_score": 1},
-        "Strong/Sharp": {"vata_score": 1, "pitta_score": 3, "kapha_score": 0},
-        "Slow/Steady": {"vata_score": 0, "pitta_score": 1, "kapha_score": 3},
-        # Stress Response
-        "Anxiety/Worry": {"vata_score": 3, "pitta_score": 1, "kapha_score": 0},
-        "Irritation/Anger": {"vata_score": 1, "pitta_score": 3, "kapha_score": 0},
-        "Withdrawal/Calm": {"vata_score": 0, "pitta_score": 1, "kapha_score": 3},
-    }
-    return mappings.get(response, {"vata_score": 1, "pitta_score": 1, "kapha_score": 1})
-
 def display_dosha_results(results):
     st.success("✨ Dosha Analysis Complete!")
     
@@ -202,6 +193,12 @@ def personal_consultation():
     # Store form results in session state
     if 'consultation_results' not in st.session_state:
         st.session_state.consultation_results = None
+
+    # The job id in the URL survives reloads and dropped connections, so the
+    # consultation is picked up again from the persisted job
+    job_id = st.query_params.get("job")
+    if job_id and not st.session_state.consultation_results:
+        _resume_consultation_job(job_id)
     
     with st.form("consultation_form"):
         # Basic Information
@@ -297,9 +294,21 @@ def personal_consultation():
                     if 'dosha_profile' in st.session_state:
                         consultation_data["dosha_profile"] = st.session_state.dosha_profile
                     
-                    cons_result = get_personal_consultation(consultation_data)
+                    results_key = make_payload_key(consultation_data)
+                    cons_result = _cached_consultation(results_key)
+                    if cons_result is None:
+                        job_id = submit_consultation_job(consultation_data, session_id=_session_id())
+                        st.query_params["job"] = job_id
+                        cons_result = _follow_consultation_job(job_id)
+                        if cons_result and not is_fallback(cons_result):
+                            _consultation_results().set(results_key, json.dumps(cons_result))
+                    else:
+                        # A cached answer has no job; a previous run's job left in the
+                        # URL would otherwise be re-attached on reload
+                        st.query_params.pop("job", None)
                     if cons_result:
                         st.session_state.consultation_results = cons_result
+                        st.session_state.consultation_key = results_key
                     else:
                         st.error(f"Unable to get personal recommendations")
                         
@@ -310,9 +319,76 @@ def personal_consultation():
     
     # Display results outside the form
     if st.session_state.consultation_results:
-        display_consultation_results(st.session_state.consultation_results)
+        with get_metrics().timed(RENDER, route="consultation"):
+            display_consultation_results(
+                st.session_state.consultation_results, st.session_state.get('consultation_key')
+            )
+
+# Titles for sections rendered while the consultation is still streaming
+STREAMED_SECTION_TITLES = {
+    "overview.condition_analysis": "🔍 Current Health Status",
+    "overview.dosha_impact": "🔍 Dosha Analysis",
+    "recommendations.dietary": "🍽️ Dietary Guidelines",
+    "recommendations.lifestyle": "🌅 Lifestyle Modifications",
+    "recommendations.exercise": "🧘‍♀️ Exercise & Movement",
+    "recommendations.herbal": "🌿 Herbal Remedies",
+    "recommendations.therapeutic": "💆‍♂️ Therapeutic Treatments",
+    "warnings": "⚠️ Important Considerations"
+}
+
+def _session_id() -> str:
+    # Lets the LLM scheduler share capacity fairly between browser sessions
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+def _resume_consultation_job(job_id: str):
+    try:
+        if get_job(job_id) is None:
+            del st.query_params["job"]
+            return
+        with st.spinner("Resuming your consultation..."):
+            result = _follow_consultation_job(job_id)
+    except requests.exceptions.RequestException as e:
+        st.error(f"Failed to connect to the server: {str(e)}")
+        return
+    if result:
+        st.session_state.consultation_results = result
+        st.session_state.consultation_key = f"job:{job_id}"
 
-def display_consultation_results(results):
+def _follow_consultation_job(job_id: str):
+    """Render the job's sections as they arrive; returns the complete result, or None if it failed"""
+    progress = st.empty()
+    rendered = {}
+    # General guidance from the offline knowledge base, shown until the first generated section arrives
+    instant = {}
+    for section_key, items in stream_job(job_id):
+        if section_key is None:
+            # The full tabbed view replaces the progressive one
+            progress.empty()
+            return items
+        if section_key == JOB_EVENT:
+            if items["status"] == QUEUED:
+                progress.info(f"⏳ High demand right now: you are number {items['position']} in the queue")
+            elif items["status"] == FAILED:
+                progress.empty()
+                st.error(f"Your consultation could not be completed: {items['error']}")
+                del st.query_params["job"]
+                return None
+            continue
+        if section_key == INSTANT_EVENT:
+            instant = dict(section_events(items))
+        else:
+            rendered[section_key] = items
+        shown = rendered or instant
+        progress.markdown(("" if rendered else "_General guidance while your consultation is prepared:_\n\n") + "\n\n".join(
+            f"#### {STREAMED_SECTION_TITLES[key]}\n" + "\n".join(f"• {item}" for item in shown[key])
+            for key in STREAMED_SECTION_TITLES if key in shown
+        ))
+    progress.empty()
+    return None
+
+def display_consultation_results(results, results_key: Optional[str] = None):
     st.success("✨ Your Personalized Ayurvedic Consultation Analysis")
     
     # Display Condition Overview and Dosha Impact
@@ -436,7 +512,10 @@ def display_consultation_results(results):
             - Reference the suggestions offline
         """)
     with col2:
-        recommendations_text = _format_recommendations_for_download(results)
+        if results_key:
+            recommendations_text = _download_report(results_key, results)
+        else:
+            recommendations_text = _format_recommendations_for_download(results)
         st.download_button(
             label="Download Report",
             data=recommendations_text,
@@ -528,7 +607,25 @@ def home_page():
     Get started by selecting "Dosha Analysis" from the sidebar!
     """)
 
+def diagnostics_page():
+    """Prometheus metrics of this process and, with BACKEND_URL, of the backend worker that answers.
+    Not linked from the navigation; open the app with ?diagnostics=1"""
+    st.title("Diagnostics")
+    st.caption("Stage latencies, token usage, fallbacks and upstream errors since the process started")
+    st.markdown("#### This app")
+    st.code(get_metrics().exposition(), language="text")
+    if BACKEND_URL:
+        st.markdown("#### Backend")
+        try:
+            st.code(get_metrics_text(), language="text")
+        except requests.exceptions.RequestException as e:
+            st.error(f"Failed to connect to the server: {str(e)}")
+
 def main():
+    if st.query_params.get("diagnostics"):
+        diagnostics_page()
+        return
+
     with st.sidebar:
         st.title("Navigation")
         choice = st.radio("Go to", ["Home", "Dosha Analysis", "Personal Consultation"])
@@ -546,6 +643,10 @@ def main():
         dosha_analysis()
     else:
         personal_consultation()
+    
+    # After the page is drawn, so only the very first run waits for it
+    if not BACKEND_URL:
+        warm_up_services()
 
 if __name__ == "__main__":
     main() 
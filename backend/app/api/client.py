@@ -0,0 +1,100 @@
+from typing import Dict, Iterator, Optional
+import json
+import threading
+import requests
+from ..config import get_backend_settings
+from ..services.response_parser import SectionEvent
+
+# HTTP counterparts of the sync entry points in routes.py, calling the ASGI
+# backend (backend/app/main.py) at BACKEND_URL. Signatures and results match
+# routes.py so app.py can use either; failures raise requests exceptions.
+
+_http_session = None
+_http_lock = threading.Lock()
+
+
+def _http() -> requests.Session:
+    # One keep-alive pool shared by every Streamlit script thread
+    global _http_session
+    if _http_session is None:
+        with _http_lock:
+            if _http_session is None:
+                _http_session = requests.Session()
+    return _http_session
+
+
+def _request(method: str, path: str, session_id: Optional[str], fan_out: Optional[bool] = None,
+             stream: bool = False, params: Optional[Dict] = None, **kwargs) -> requests.Response:
+    settings = get_backend_settings()
+    if not settings["url"]:
+        raise ValueError("BACKEND_URL is not set")
+    params = dict(params or {})
+    if fan_out is not None:
+        params["fan_out"] = str(fan_out).lower()
+    response = _http().request(
+        method,
+        settings["url"] + path,
+        headers={"X-Session-ID": session_id} if session_id else None,
+        params=params or None,
+        timeout=settings["timeout"],
+        stream=stream,
+        **kwargs
+    )
+    if not response.ok:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        response.close()
+        raise requests.HTTPError(f"Backend answered {response.status_code}: {detail}", response=response)
+    return response
+
+
+def _events(response: requests.Response) -> Iterator[SectionEvent]:
+    # Job streams also carry "seq", which only matters for resuming
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                event = json.loads(line)
+                yield event["section"], event["data"]
+
+
+def analyze_dosha(user_responses: Dict[str, Dict], session_id: Optional[str] = None):
+    return _request("POST", "/analyze-dosha", session_id, json=user_responses).json()
+
+def analyze_dosha_answers(answers: Dict[str, str], session_id: Optional[str] = None):
+    return _request("POST", "/analyze-dosha/answers", session_id, json=answers).json()
+
+def get_recommendations(dosha_type: str, fan_out: Optional[bool] = None, session_id: Optional[str] = None):
+    return _request("GET", f"/recommendations/{dosha_type}", session_id, fan_out).json()
+
+def get_personal_consultation(consultation_data: Dict, fan_out: Optional[bool] = None,
+                              session_id: Optional[str] = None):
+    return _request("POST", "/consultation", session_id, fan_out, json=consultation_data).json()
+
+def stream_recommendations(dosha_type: str, fan_out: Optional[bool] = None,
+                           session_id: Optional[str] = None) -> Iterator[SectionEvent]:
+    return _events(_request("GET", f"/recommendations/{dosha_type}/stream", session_id, fan_out, stream=True))
+
+def stream_personal_consultation(consultation_data: Dict, fan_out: Optional[bool] = None,
+                                 session_id: Optional[str] = None) -> Iterator[SectionEvent]:
+    return _events(_request("POST", "/consultation/stream", session_id, fan_out, stream=True,
+                            json=consultation_data))
+
+def submit_consultation_job(consultation_data: Dict, fan_out: Optional[bool] = None,
+                            session_id: Optional[str] = None) -> str:
+    return _request("POST", "/jobs/consultation", session_id, fan_out, json=consultation_data).json()["job_id"]
+
+def get_job(job_id: str) -> Optional[Dict]:
+    try:
+        return _request("GET", f"/jobs/{job_id}", None).json()
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+def stream_job(job_id: str, after: int = 0) -> Iterator[SectionEvent]:
+    return _events(_request("GET", f"/jobs/{job_id}/stream", None, stream=True, params={"after": after}))
+
+def get_metrics_text() -> str:
+    return _request("GET", "/metrics", None).text
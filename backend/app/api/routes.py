@@ -1,23 +1,191 @@
-from typing import Dict
+from typing import Callable, Dict, Optional, TypeVar
+import atexit
+import logging
+import threading
+from ..config import MissingAPIKeyError, get_fan_out_routes, get_job_settings, get_llm_settings, get_request_deadlines
 from ..models.dosha import DoshaProfile, DoshaCharacteristic
 from ..models.consultation import ConsultationRequest
+from ..services.background_loop import iterate_async, run_coroutine
 from ..services.dosha_analyzer import DoshaAnalyzer
-from ..services.recommendation_engine import RecommendationEngine
-from ..services.consultation_service import ConsultationService
+from ..services.llm_scheduler import current_session, get_llm_scheduler
+from ..services.metrics import current_route, get_metrics
+from ..services.recommendation_artifacts import RecommendationArtifactStore, bucket_profile
+from ..services.deadline import set_deadline
+from ..services.response_parser import section_events
 
+logger = logging.getLogger(__name__)
 
-dosha_analyzer = DoshaAnalyzer()
-recommendation_engine = RecommendationEngine()
-consultation_service = ConsultationService()
+T = TypeVar("T")
 
+# Services are built on first use rather than at import, so the app starts
+# without loading the HTTP clients or reading GROQ_API_KEY, and the dosha
+# questionnaire works without an API key at all.
+_singletons: Dict[str, object] = {}
+_singletons_lock = threading.RLock()
 
-def analyze_dosha(user_responses: Dict[str, DoshaCharacteristic]):
+
+def _lazy(name: str, factory: Callable[[], T]) -> T:
+    instance = _singletons.get(name)
+    if instance is None:
+        with _singletons_lock:
+            instance = _singletons.get(name)
+            if instance is None:
+                instance = _singletons[name] = factory()
+    return instance
+
+
+def _start_llm_client():
+    # The first LLM-backed service warms the connection pool in the background
+    from ..services.llm_client import get_llm_client, prewarm_in_background
+
+    client = get_llm_client()
+    prewarm_in_background(client)
+    return client
+
+
+def _create_recommendation_engine():
+    from ..services.recommendation_engine import AsyncRecommendationEngine
+
+    _lazy("llm_client", _start_llm_client)
+    return AsyncRecommendationEngine()
+
+
+def _create_consultation_service():
+    from ..services.consultation_service import AsyncConsultationService
+
+    _lazy("llm_client", _start_llm_client)
+    return AsyncConsultationService()
+
+
+def _create_artifact_store():
+    from ..services.recommendation_engine import AsyncRecommendationEngine
+
+    return RecommendationArtifactStore(
+        prompt_template_version=AsyncRecommendationEngine.prompt_template_version, model=get_llm_settings()["model"]
+    )
+
+
+def _create_job_queue():
+    from ..services.job_queue import JobQueue, JobStore
+
+    settings = get_job_settings()
+    queue = JobQueue(
+        JobStore(settings["db_path"], settings["retention_seconds"]),
+        stream_personal_consultation_async,
+        workers=settings["workers"],
+        max_queued=settings["max_queued"],
+        drain_seconds=settings["drain_seconds"],
+        # A job whose process died is picked up again once it has been silent
+        # for longer than a consultation may take
+        lease_seconds=max(180.0, 2 * _request_deadline("consultation"))
+    )
+    queue.start()
+    atexit.register(queue.shutdown)
+    return queue
+
+
+def get_dosha_analyzer() -> DoshaAnalyzer:
+    return _lazy("dosha_analyzer", DoshaAnalyzer)
+
+def get_recommendation_engine():
+    """AsyncRecommendationEngine; raises MissingAPIKeyError without GROQ_API_KEY"""
+    return _lazy("recommendation_engine", _create_recommendation_engine)
+
+def get_consultation_service():
+    """AsyncConsultationService; raises MissingAPIKeyError without GROQ_API_KEY"""
+    return _lazy("consultation_service", _create_consultation_service)
+
+def get_artifact_store() -> RecommendationArtifactStore:
+    return _lazy("artifact_store", _create_artifact_store)
+
+def get_job_queue():
+    """JobQueue running consultations; its workers start on first use"""
+    return _lazy("job_queue", _create_job_queue)
+
+def _warm_up() -> bool:
+    get_dosha_analyzer()
+    try:
+        get_consultation_service()
+    except MissingAPIKeyError as e:
+        logger.warning(f"Personal consultations are unavailable: {str(e)}")
+    return True
+
+def warm_up_services():
+    """Build the services ahead of the first request that needs them; only
+    the first call in a process does any work"""
+    _lazy("warmed_up", _warm_up)
+
+def _fan_out_routes():
+    return _lazy("fan_out_routes", get_fan_out_routes)
+
+def _request_deadline(route: str) -> float:
+    return _lazy("request_deadlines", get_request_deadlines)[route]
+
+
+def _use_fan_out(route: str, fan_out: Optional[bool]) -> bool:
+    # An explicit argument wins; otherwise LLM_FAN_OUT_ROUTES decides per route
+    return route in _fan_out_routes() if fan_out is None else fan_out
+
+
+# Sync entry points used by the Streamlit app; each one runs its async
+# counterpart on the shared background event loop. session_id identifies
+# the user to the LLM scheduler, which serves sessions round-robin, and
+# the route labels the request's metrics (see metrics.py). Each
+# async route starts the request's deadline (RECOMMENDATION_DEADLINE_SECONDS
+# / CONSULTATION_DEADLINE_SECONDS); everything below it shares that budget.
+
+def analyze_dosha(user_responses: Dict[str, DoshaCharacteristic], session_id: Optional[str] = None):
+    return run_coroutine(analyze_dosha_async(user_responses, session_id))
+
+def analyze_dosha_answers(answers: Dict[str, str], session_id: Optional[str] = None):
+    return run_coroutine(analyze_dosha_answers_async(answers, session_id))
+
+def get_recommendations(dosha_type: str, fan_out: Optional[bool] = None, session_id: Optional[str] = None):
+    return run_coroutine(get_recommendations_async(dosha_type, fan_out, session_id))
+
+def get_personal_consultation(consultation_data: ConsultationRequest, fan_out: Optional[bool] = None,
+                              session_id: Optional[str] = None):
+    return run_coroutine(get_personal_consultation_async(consultation_data, fan_out, session_id))
+
+def stream_recommendations(dosha_type: str, fan_out: Optional[bool] = None, session_id: Optional[str] = None):
+    return iterate_async(stream_recommendations_async(dosha_type, fan_out, session_id))
+
+def stream_personal_consultation(consultation_data: ConsultationRequest, fan_out: Optional[bool] = None,
+                                 session_id: Optional[str] = None):
+    return iterate_async(stream_personal_consultation_async(consultation_data, fan_out, session_id))
+
+
+async def analyze_dosha_async(user_responses: Dict[str, DoshaCharacteristic], session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("recommendations")
+    set_deadline(_request_deadline("recommendations"))
     try:
         # Get dosha analysis
-        dosha_results = dosha_analyzer.analyze_dosha(user_responses)
-        
+        dosha_results = get_dosha_analyzer().analyze_dosha(user_responses)
+        return await _with_recommendations(dosha_results)
+    except Exception as e:
+        raise e
+
+async def analyze_dosha_answers_async(answers: Dict[str, str], session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("recommendations")
+    set_deadline(_request_deadline("recommendations"))
+    try:
+        # Questionnaire answers resolve through the precomputed result table
+        dosha_results = get_dosha_analyzer().analyze_answers(answers)
+        return await _with_recommendations(dosha_results)
+    except Exception as e:
+        raise e
+
+async def _with_recommendations(dosha_results: Dict):
+    try:
         # Get recommendations using the dosha results
-        recommendations = recommendation_engine.get_recommendations(dosha_results)
+        try:
+            recommendations = await _get_dosha_recommendations(dosha_results)
+        except MissingAPIKeyError as e:
+            # The analysis itself needs no API; only buckets missing from the artifact do
+            logger.warning(f"Returning dosha analysis without recommendations: {str(e)}")
+            recommendations = None
         
         # Combine results
         response = {
@@ -29,28 +197,156 @@ def analyze_dosha(user_responses: Dict[str, DoshaCharacteristic]):
     except Exception as e:
         raise e
 
-def get_recommendations(dosha_type: str):
+async def get_recommendations_async(dosha_type: str, fan_out: Optional[bool] = None,
+                                    session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("recommendations")
+    set_deadline(_request_deadline("recommendations"))
     try:
-        # Create a mock dosha profile for the specific dosha type
-        dosha_profile = {
-            "primary_dosha": dosha_type,
-            "secondary_dosha": None,
-            "vata_percentage": 100 if dosha_type == "vata" else 0,
-            "pitta_percentage": 100 if dosha_type == "pitta" else 0,
-            "kapha_percentage": 100 if dosha_type == "kapha" else 0
-        }
-        
-        recommendations = recommendation_engine.get_recommendations(dosha_profile)
+        recommendations = await _get_dosha_recommendations(_pure_dosha_profile(dosha_type), fan_out)
         return recommendations
     except Exception as e:
         raise e
 
+def _pure_dosha_profile(dosha_type: str) -> Dict:
+    # Create a mock dosha profile for the specific dosha type
+    return {
+        "primary_dosha": dosha_type,
+        "secondary_dosha": None,
+        "vata_percentage": 100 if dosha_type == "vata" else 0,
+        "pitta_percentage": 100 if dosha_type == "pitta" else 0,
+        "kapha_percentage": 100 if dosha_type == "kapha" else 0
+    }
+
+async def _get_dosha_recommendations(dosha_profile: Dict, fan_out: Optional[bool] = None):
+    # Dosha-only requests are served from the pre-generated artifact; only
+    # buckets missing from it go to the LLM, using the same bucketed profile
+    artifact_store = get_artifact_store()
+    recommendations = artifact_store.get(dosha_profile)
+    if recommendations is None:
+        recommendations = await get_recommendation_engine().get_recommendations(
+            {"dosha_profile": bucket_profile(dosha_profile, artifact_store.bucket_size)},
+            _use_fan_out("recommendations", fan_out)
+        )
+    return recommendations
 
-def get_personal_consultation(consultation_data: ConsultationRequest):
+
+async def get_personal_consultation_async(consultation_data: ConsultationRequest, fan_out: Optional[bool] = None,
+                                          session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("consultation")
+    set_deadline(_request_deadline("consultation"))
     try:
-        recommendations = consultation_service.get_personalized_recommendations(
-            consultation_data
+        recommendations = await get_consultation_service().get_personalized_recommendations(
+            consultation_data, _use_fan_out("consultation", fan_out)
         )
         return recommendations
     except Exception as e:
-        raise e 
\ No newline at end of file
+        raise e
+
+
+# Streaming routes yield (section_key, items) per finished section and end
+# with (None, result), where result matches the non-streaming route. While
+# the request waits for the LLM scheduler they yield ("queue", status) with
+# its position and estimated wait. Before waiting for the LLM at all they
+# yield ("instant", result) with the offline knowledge base's answer.
+
+async def stream_recommendations_async(dosha_type: str, fan_out: Optional[bool] = None,
+                                       session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("recommendations")
+    set_deadline(_request_deadline("recommendations"))
+    dosha_profile = _pure_dosha_profile(dosha_type)
+    artifact_store = get_artifact_store()
+    recommendations = artifact_store.get(dosha_profile)
+    if recommendations is not None:
+        for event in section_events(recommendations):
+            yield event
+        return
+    
+    async for event in get_recommendation_engine().stream_recommendations(
+        {"dosha_profile": bucket_profile(dosha_profile, artifact_store.bucket_size)},
+        _use_fan_out("recommendations", fan_out)
+    ):
+        yield event
+
+async def stream_personal_consultation_async(consultation_data: ConsultationRequest, fan_out: Optional[bool] = None,
+                                             session_id: Optional[str] = None):
+    current_session.set(session_id)
+    current_route.set("consultation")
+    set_deadline(_request_deadline("consultation"))
+    async for event in get_consultation_service().stream_personalized_recommendations(
+        consultation_data, _use_fan_out("consultation", fan_out)
+    ):
+        yield event
+
+
+# Consultation jobs: submitting stores the request and returns a job id at
+# once; a bounded worker pool (JOB_WORKERS) runs it through the streaming
+# consultation route. Results and section events persist in JOB_DB_PATH, so
+# a client can poll the job or replay its stream after reconnecting.
+
+def submit_consultation_job(consultation_data: ConsultationRequest, fan_out: Optional[bool] = None,
+                            session_id: Optional[str] = None) -> str:
+    """Queue a consultation; raises JobQueueFullError at JOB_MAX_QUEUED waiting jobs"""
+    # Fails here without an API key rather than queueing a job that cannot run
+    get_consultation_service()
+    return get_job_queue().submit(consultation_data, fan_out, session_id)
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Status, queue position and result of a job; None if unknown"""
+    return get_job_queue().get(job_id)
+
+def stream_job(job_id: str, after: int = 0):
+    """Section events of a job as stream_personal_consultation yields them,
+    plus (JOB_EVENT, status) while it waits or if it fails"""
+    return iterate_async(stream_job_async(job_id, after))
+
+async def stream_job_async(job_id: str, after: int = 0):
+    async for _, section, data in get_job_queue().events(job_id, after):
+        yield section, data
+
+def shutdown_jobs(timeout: Optional[float] = None):
+    """Drain running jobs (JOB_DRAIN_SECONDS); a no-op if no job was ever submitted"""
+    queue = _singletons.get("job_queue")
+    if queue is not None:
+        queue.shutdown(timeout)
+
+def get_job_stats():
+    return get_job_queue().stats()
+
+
+def get_cache_stats():
+    from ..services.response_cache import get_response_cache
+
+    return get_response_cache().stats()
+
+def get_similarity_cache_stats():
+    """Near-duplicate consultation cache lookups and hit rates per similarity band"""
+    from ..services.similarity_cache import get_similar_consultation_cache
+
+    cache = get_similar_consultation_cache()
+    return cache.stats() if cache is not None else None
+
+def get_coalescing_stats():
+    """Leaders, waiters and in-flight LLM calls per service; waiters are requests served by another's call"""
+    return {
+        "recommendations": get_recommendation_engine().coalescing_stats(),
+        "consultations": get_consultation_service().coalescing_stats(),
+    }
+
+def get_prompt_stats():
+    """Estimated input tokens per prompt and the tokens saved by compaction and trimming"""
+    from ..services.prompt_builder import get_prompt_stats as prompt_stats
+
+    return prompt_stats().stats()
+
+def get_metrics_text() -> str:
+    """Stage latency and token histograms, fallbacks and upstream errors in Prometheus text format"""
+    return get_metrics().exposition()
+
+def get_scheduler_stats():
+    return get_llm_scheduler().stats()
+
+def get_circuit_stats():
+    return _lazy("llm_client", _start_llm_client).breaker.stats()
@@ -1,16 +1,186 @@
-from dotenv import load_dotenv
 import os
+import threading
 from pathlib import Path
 
 # Get the root directory of the project
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 
-# Load environment variables from .env file
-load_dotenv(ROOT_DIR / ".env")
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+class MissingAPIKeyError(ValueError):
+    """Raised when a service that calls the LLM API is used without GROQ_API_KEY"""
+
+
+# Load environment variables from .env file, once, on the first settings lookup
+# rather than at import time
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        with _env_lock:
+            if not _env_loaded:
+                from dotenv import load_dotenv
+                load_dotenv(ROOT_DIR / ".env")
+                _env_loaded = True
 
 # Get Groq API key with error handling
 def get_groq_api_key():
+    load_env()
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
-        raise ValueError("GROQ_API_KEY not found in environment variables")
-    return api_key 
\ No newline at end of file
+        raise MissingAPIKeyError("GROQ_API_KEY not found in environment variables")
+    return api_key
+
+# Response cache settings; LLM_CACHE_PATH enables the shared on-disk tier,
+# bounded by LLM_CACHE_DB_MAX_ENTRIES rows (0 for no limit)
+def get_cache_settings():
+    load_env()
+    return {
+        "max_entries": int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+        "max_chars": int(os.getenv("LLM_CACHE_MAX_CHARS", "16000000")),
+        "ttl_seconds": float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400")),
+        "db_path": os.getenv("LLM_CACHE_PATH") or None,
+        "db_max_entries": int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "100000"))
+    }
+
+# Near-duplicate tier of ConsultationService: consultations whose free text
+# is at least this similar, with identical other fields, share a completion.
+# 0 entries disables it.
+def get_similarity_cache_settings():
+    load_env()
+    return {
+        "threshold": float(os.getenv("CONSULTATION_SIMILARITY_THRESHOLD", "0.8")),
+        "max_entries": int(os.getenv("CONSULTATION_SIMILARITY_CACHE_ENTRIES", "1024")),
+        "ttl_seconds": float(os.getenv("CONSULTATION_SIMILARITY_TTL_SECONDS", "86400"))
+    }
+
+# Estimated input tokens per prompt; longer prompts get their free-text
+# fields trimmed to fit. 0 disables trimming. Output budgets are sized per
+# consultation, with headroom, up to LLM_MAX_OUTPUT_TOKENS; 0 sends no
+# max_tokens and no length hints. LLM_STRUCTURED_OUTPUT=1 asks for JSON
+# answers instead of markdown.
+def get_prompt_settings():
+    load_env()
+    return {
+        "input_token_budget": int(os.getenv("LLM_INPUT_TOKEN_BUDGET", "1500")),
+        "max_output_tokens": int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "2048")),
+        "output_token_headroom": float(os.getenv("LLM_OUTPUT_TOKEN_HEADROOM", "1.25")),
+        "structured_output": os.getenv("LLM_STRUCTURED_OUTPUT", "").strip().lower() in ("1", "true", "yes")
+    }
+
+# Pre-generated recommendations for dosha-only requests
+def get_artifact_path():
+    load_env()
+    return Path(os.getenv(
+        "RECOMMENDATION_ARTIFACT_PATH",
+        ROOT_DIR / "backend" / "app" / "data" / "recommendation_artifacts.json"
+    ))
+
+# Offline recommendations used for fallbacks and instant results; compiled
+# next to it as a .kb file on first load
+def get_knowledge_base_path():
+    load_env()
+    return Path(os.getenv(
+        "KNOWLEDGE_BASE_PATH",
+        ROOT_DIR / "backend" / "app" / "data" / "knowledge_base.json"
+    ))
+
+# Synonym dictionary of the conditions and medications recognized in the
+# consultation's free-text fields
+def get_medical_terms_path():
+    load_env()
+    return Path(os.getenv(
+        "MEDICAL_TERMS_PATH",
+        ROOT_DIR / "backend" / "app" / "data" / "medical_terms.json"
+    ))
+
+# Groq transport shared by all services
+def get_llm_settings():
+    load_env()
+    return {
+        "api_url": os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions"),
+        "model": os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
+        "timeout": float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+        "max_connections": int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        "max_keepalive_connections": int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        "prewarm_connections": int(os.getenv("LLM_PREWARM_CONNECTIONS", "2"))
+    }
+
+# Routes that generate each section with its own concurrent request instead of
+# one long completion, e.g. LLM_FAN_OUT_ROUTES=consultation,recommendations
+def get_fan_out_routes():
+    load_env()
+    routes = os.getenv("LLM_FAN_OUT_ROUTES", "")
+    return {route.strip() for route in routes.split(",") if route.strip()}
+
+# Groq account limits enforced by the shared LLM scheduler; 0 disables a limit.
+# Every API worker process schedules its own share of them.
+def get_rate_limit_settings():
+    load_env()
+    workers = get_api_settings()["workers"]
+    return {
+        "requests_per_minute": float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30")) / workers,
+        "tokens_per_minute": float(os.getenv("LLM_TOKENS_PER_MINUTE", "12000")) / workers,
+        "max_queue": int(os.getenv("LLM_MAX_QUEUE", "100")),
+        "max_wait_seconds": float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "120"))
+    }
+
+# Circuit breaker around the Groq transport
+def get_circuit_breaker_settings():
+    load_env()
+    return {
+        "failure_rate": float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+        "slow_call_seconds": float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "15")),
+        "slow_call_rate": float(os.getenv("LLM_BREAKER_SLOW_CALL_RATE", "0.8")),
+        "min_calls": int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+        "window_seconds": float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60")),
+        "open_seconds": float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30")),
+        "half_open_probes": int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1"))
+    }
+
+# End-to-end budget of each route, from the route call to the parsed result
+def get_request_deadlines():
+    load_env()
+    return {
+        "recommendations": float(os.getenv("RECOMMENDATION_DEADLINE_SECONDS", "60")),
+        "consultation": float(os.getenv("CONSULTATION_DEADLINE_SECONDS", "90"))
+    }
+
+# Streamlit-level caches of finished results, shared by every browser session
+def get_app_cache_settings():
+    load_env()
+    return {
+        "max_entries": int(os.getenv("APP_CACHE_MAX_ENTRIES", "256")),
+        "ttl_seconds": float(os.getenv("APP_CACHE_TTL_SECONDS", "3600"))
+    }
+
+# ASGI backend (backend/app/main.py). WEB_CONCURRENCY is also uvicorn's default
+# worker count, so the scheduler's per-worker share matches the processes started
+def get_api_settings():
+    load_env()
+    return {
+        "host": os.getenv("API_HOST", "0.0.0.0"),
+        "port": int(os.getenv("API_PORT", "8000")),
+        "workers": max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    }
+
+# Set BACKEND_URL to make the Streamlit app call the ASGI backend instead of
+# running the services in-process
+def get_backend_settings():
+    load_env()
+    return {
+        "url": (os.getenv("BACKEND_URL") or "").rstrip("/") or None,
+        "timeout": float(os.getenv("BACKEND_TIMEOUT_SECONDS", "120"))
+    }
+
+# Background consultation jobs, persisted in SQLite so results survive reconnects
+def get_job_settings():
+    load_env()
+    return {
+        "db_path": os.getenv("JOB_DB_PATH", str(ROOT_DIR / "backend" / "app" / "data" / "jobs.sqlite3")),
+        "workers": int(os.getenv("JOB_WORKERS", "4")),
+        "max_queued": int(os.getenv("JOB_MAX_QUEUED", "200")),
+        "retention_seconds": float(os.getenv("JOB_RETENTION_SECONDS", "86400")),
+        "drain_seconds": float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+    }
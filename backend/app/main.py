@@ -0,0 +1,179 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import json
+import logging
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from .api import routes
+from .config import MissingAPIKeyError, get_api_settings
+from .models.consultation import ConsultationRequest
+from .models.dosha import DoshaCharacteristic, DoshaType
+from .services.job_queue import JobQueueFullError
+from .services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .services.response_parser import SectionEvent
+
+logger = logging.getLogger(__name__)
+
+# ASGI service exposing the route functions over HTTP, so the Streamlit UI
+# (BACKEND_URL, see api/client.py) and the LLM backend scale independently.
+# Each worker process has its own services, scheduler share and memory
+# cache; LLM_CACHE_PATH lets the workers share cached completions, and
+# JOB_DB_PATH their consultation jobs.
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Finish in-flight consultation jobs before the worker exits
+    await asyncio.to_thread(routes.shutdown_jobs)
+
+
+app = FastAPI(
+    title="Ayurvedic Consultation API",
+    description="Dosha analysis and LLM-generated Ayurvedic recommendations",
+    lifespan=lifespan
+)
+
+# Streaming endpoints answer with one JSON object per line:
+# {"section": <section key, "queue" or null>, "data": <items, queue status or full result>}
+# Job streams add "seq", and use the section "job" for job status.
+STREAM_MEDIA_TYPE = "application/x-ndjson"
+
+
+@app.exception_handler(JobQueueFullError)
+async def job_queue_full_handler(request: Request, exc: JobQueueFullError):
+    logger.warning(f"Refused consultation job: {str(exc)}")
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
+@app.exception_handler(MissingAPIKeyError)
+async def missing_api_key_handler(request: Request, exc: MissingAPIKeyError):
+    logger.error(f"Request needs the LLM API: {str(exc)}")
+    return JSONResponse(status_code=503, content={"detail": "LLM backend is not configured"})
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/analyze-dosha")
+async def analyze_dosha(user_responses: Dict[str, DoshaCharacteristic],
+                        x_session_id: Optional[str] = Header(None)):
+    responses = {trait: response.model_dump() for trait, response in user_responses.items()}
+    if not responses:
+        raise HTTPException(status_code=422, detail="At least one trait is required")
+    try:
+        return await routes.analyze_dosha_async(responses, x_session_id)
+    except ZeroDivisionError:
+        raise HTTPException(status_code=422, detail="Trait scores must not all be zero")
+
+
+@app.post("/analyze-dosha/answers")
+async def analyze_dosha_answers(answers: Dict[str, str], x_session_id: Optional[str] = Header(None)):
+    """Questionnaire answers as {trait_name: option label}"""
+    try:
+        return await routes.analyze_dosha_answers_async(answers, x_session_id)
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=f"Missing answer for trait {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get("/recommendations/{dosha_type}")
+async def get_recommendations(dosha_type: DoshaType, fan_out: Optional[bool] = None,
+                              x_session_id: Optional[str] = Header(None)):
+    return await routes.get_recommendations_async(dosha_type.value, fan_out, x_session_id)
+
+
+@app.get("/recommendations/{dosha_type}/stream")
+async def stream_recommendations(dosha_type: DoshaType, fan_out: Optional[bool] = None,
+                                 x_session_id: Optional[str] = Header(None)):
+    return _stream_response(routes.stream_recommendations_async(dosha_type.value, fan_out, x_session_id))
+
+
+@app.post("/consultation")
+async def get_personal_consultation(consultation: ConsultationRequest, fan_out: Optional[bool] = None,
+                                    x_session_id: Optional[str] = Header(None)):
+    return await routes.get_personal_consultation_async(consultation.model_dump(), fan_out, x_session_id)
+
+
+@app.post("/consultation/stream")
+async def stream_personal_consultation(consultation: ConsultationRequest, fan_out: Optional[bool] = None,
+                                       x_session_id: Optional[str] = Header(None)):
+    # Built before streaming starts so a missing API key still answers 503
+    routes.get_consultation_service()
+    return _stream_response(
+        routes.stream_personal_consultation_async(consultation.model_dump(), fan_out, x_session_id)
+    )
+
+
+@app.post("/jobs/consultation", status_code=202)
+async def submit_consultation_job(consultation: ConsultationRequest, fan_out: Optional[bool] = None,
+                                  x_session_id: Optional[str] = Header(None)):
+    job_id = await asyncio.to_thread(
+        routes.submit_consultation_job, consultation.model_dump(), fan_out, x_session_id
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(routes.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, after: int = 0):
+    """Replays the job's events after seq `after`, then follows it to the end"""
+    queue = routes.get_job_queue()
+    if await asyncio.to_thread(queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def lines():
+        async for seq, section, data in queue.events(job_id, after):
+            yield json.dumps({"seq": seq, "section": section, "data": data}) + "\n"
+
+    return StreamingResponse(lines(), media_type=STREAM_MEDIA_TYPE)
+
+
+@app.get("/stats")
+async def stats():
+    """Cache, similarity cache, coalescing, scheduler, prompt token, circuit breaker and job counters of this worker"""
+    result = {
+        "cache": routes.get_cache_stats(),
+        "similarity_cache": routes.get_similarity_cache_stats(),
+        "scheduler": routes.get_scheduler_stats(),
+        "prompts": routes.get_prompt_stats(),
+        "jobs": await asyncio.to_thread(routes.get_job_stats)
+    }
+    try:
+        result["coalescing"] = routes.get_coalescing_stats()
+        result["circuit"] = routes.get_circuit_stats()
+    except MissingAPIKeyError:
+        pass
+    return result
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency, token usage, fallback and error metrics of this worker, for Prometheus"""
+    return PlainTextResponse(routes.get_metrics_text(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _stream_response(events: AsyncIterator[SectionEvent]) -> StreamingResponse:
+    async def lines():
+        async for section, data in events:
+            yield json.dumps({"section": section, "data": data}) + "\n"
+
+    return StreamingResponse(lines(), media_type=STREAM_MEDIA_TYPE)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    settings = get_api_settings()
+    uvicorn.run("backend.app.main:app", host=settings["host"], port=settings["port"], workers=settings["workers"])
@@ -0,0 +1,100 @@
+from typing import Dict, Tuple
+from pydantic import BaseModel, ConfigDict
+
+class QuestionOption(BaseModel):
+    label: str
+    vata_score: int
+    pitta_score: int
+    kapha_score: int
+
+    model_config = ConfigDict(frozen=True)
+
+    def scores(self) -> Dict[str, int]:
+        return {
+            "vata_score": self.vata_score,
+            "pitta_score": self.pitta_score,
+            "kapha_score": self.kapha_score
+        }
+
+class QuestionnaireTrait(BaseModel):
+    trait_name: str
+    label: str
+    section: str
+    help: str
+    options: Tuple[QuestionOption, ...]
+
+    model_config = ConfigDict(frozen=True)
+
+class Questionnaire(BaseModel):
+    version: int
+    traits: Tuple[QuestionnaireTrait, ...]
+
+    model_config = ConfigDict(frozen=True)
+
+
+def _option(label: str, vata: int, pitta: int, kapha: int) -> QuestionOption:
+    return QuestionOption(label=label, vata_score=vata, pitta_score=pitta, kapha_score=kapha)
+
+
+# Single source of truth for the dosha questionnaire, shared by the Streamlit
+# form and DoshaAnalyzer. Trait order is the order answers are scored in.
+QUESTIONNAIRE = Questionnaire(
+    version=1,
+    traits=(
+        QuestionnaireTrait(
+            trait_name="body_frame",
+            label="Body Frame",
+            section="Physical Characteristics",
+            help="Select your natural body frame type",
+            options=(
+                _option("Very Slim", 3, 1, 0),
+                _option("Medium", 1, 3, 1),
+                _option("Large", 0, 1, 3),
+            ),
+        ),
+        QuestionnaireTrait(
+            trait_name="skin_type",
+            label="Skin Type",
+            section="Physical Characteristics",
+            help="Select your natural skin type",
+            options=(
+                _option("Dry/Rough", 3, 1, 0),
+                _option("Warm/Sensitive", 1, 3, 0),
+                _option("Thick/Oily", 0, 1, 3),
+            ),
+        ),
+        QuestionnaireTrait(
+            trait_name="sleep_pattern",
+            label="Sleep Pattern",
+            section="Behavioral Patterns",
+            help="Select your typical sleep pattern",
+            options=(
+                _option("Light/Irregular", 3, 1, 0),
+                _option("Moderate", 1, 3, 1),
+                _option("Deep/Heavy", 0, 1, 3),
+            ),
+        ),
+        QuestionnaireTrait(
+            trait_name="digestion",
+            label="Digestion",
+            section="Behavioral Patterns",
+            help="Select your typical digestion pattern",
+            options=(
+                _option("Irregular", 3, 0, 1),
+                _option("Strong/Sharp", 1, 3, 0),
+                _option("Slow/Steady", 0, 1, 3),
+            ),
+        ),
+        QuestionnaireTrait(
+            trait_name="stress_response",
+            label="Response to Stress",
+            section="Behavioral Patterns",
+            help="Select how you typically respond to stress",
+            options=(
+                _option("Anxiety/Worry", 3, 1, 0),
+                _option("Irritation/Anger", 1, 3, 0),
+                _option("Withdrawal/Calm", 0, 1, 3),
+            ),
+        ),
+    ),
+)
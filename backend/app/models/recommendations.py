@@ -0,0 +1,54 @@
+from typing import List
+from pydantic import BaseModel, Field, field_validator
+
+# Shape of a structured (JSON mode) LLM answer; it mirrors the sections dict
+# of response_parser.empty_sections(). Sections the model leaves out are
+# empty and unknown keys are ignored.
+
+
+def _as_list(value):
+    # Models sometimes answer a one-item section with a bare string, or null
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return value
+
+
+class StructuredOverview(BaseModel):
+    condition_analysis: List[str] = Field(default_factory=list)
+    dosha_impact: List[str] = Field(default_factory=list)
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def as_list(cls, value):
+        return _as_list(value)
+
+
+class StructuredRecommendations(BaseModel):
+    dietary: List[str] = Field(default_factory=list)
+    lifestyle: List[str] = Field(default_factory=list)
+    herbal: List[str] = Field(default_factory=list)
+    therapeutic: List[str] = Field(default_factory=list)
+    exercise: List[str] = Field(default_factory=list)
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def as_list(cls, value):
+        return _as_list(value)
+
+
+class StructuredSections(BaseModel):
+    overview: StructuredOverview = Field(default_factory=StructuredOverview)
+    recommendations: StructuredRecommendations = Field(default_factory=StructuredRecommendations)
+    warnings: List[str] = Field(default_factory=list)
+
+    @field_validator("overview", "recommendations", mode="before")
+    @classmethod
+    def as_group(cls, value):
+        return {} if value is None else value
+
+    @field_validator("warnings", mode="before")
+    @classmethod
+    def as_list(cls, value):
+        return _as_list(value)
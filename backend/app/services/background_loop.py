@@ -0,0 +1,67 @@
+from typing import AsyncIterator, Awaitable, Iterator, TypeVar
+import asyncio
+import queue
+import threading
+
+T = TypeVar("T")
+
+
+_background_loop = None
+_background_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    if _background_loop is None:
+        with _background_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                thread.start()
+                _background_loop = loop
+    return _background_loop
+
+
+def run_coroutine(coro: Awaitable[T]) -> T:
+    """Run a coroutine on the shared background loop from sync code.
+
+    All sync callers share one event loop and therefore one connection pool,
+    so concurrent consultations are multiplexed on a single thread instead
+    of each holding a socket and a worker thread of their own.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result()
+
+
+_STREAM_END = object()
+
+
+def iterate_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """Consume an async generator running on the background loop from sync code.
+
+    Closing the sync iterator early (a consumer that stops reading) cancels
+    the async generator too, so it stops making upstream calls and its
+    cleanup runs.
+    """
+    items: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+        finally:
+            items.put(_STREAM_END)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_background_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Cancels the task on the loop, which raises CancelledError inside agen
+        future.cancel()
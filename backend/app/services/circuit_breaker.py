@@ -0,0 +1,131 @@
+from collections import deque
+from typing import Deque, Dict, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream API while the circuit is open"""
+
+
+class CircuitBreaker:
+    """Stops calling an unhealthy upstream and probes it until it recovers.
+
+    Outcomes of the calls made in the last `window_seconds` are kept; once
+    there are at least `min_calls` of them the circuit opens when the share
+    of failures reaches `failure_rate` or the share of calls slower than
+    `slow_call_seconds` reaches `slow_call_rate`. While open every call is
+    refused at once. After `open_seconds` it turns half-open and lets
+    `half_open_probes` calls through: a healthy probe closes the circuit, a
+    failed or slow one opens it again.
+    """
+
+    def __init__(self, failure_rate: float = 0.5, slow_call_seconds: float = 15.0, slow_call_rate: float = 0.8,
+                 min_calls: int = 5, window_seconds: float = 60.0, open_seconds: float = 30.0,
+                 half_open_probes: int = 1):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (finished at, failed, slow)
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._state
+
+    def is_open(self) -> bool:
+        """Whether a call made now would be refused; does not take a half-open probe"""
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._state == OPEN or (self._state == HALF_OPEN and self._probes >= self.half_open_probes)
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError; pair with record_success, record_failure or release"""
+        with self._lock:
+            self._advance(time.monotonic())
+            if self._state == OPEN or (self._state == HALF_OPEN and self._probes >= self.half_open_probes):
+                self._stats["rejected"] += 1
+                raise CircuitOpenError("LLM API circuit is open; serving fallback")
+            if self._state == HALF_OPEN:
+                self._probes += 1
+
+    def record_success(self, latency: float):
+        self._record(failed=False, slow=latency >= self.slow_call_seconds)
+
+    def record_failure(self):
+        self._record(failed=True, slow=False)
+
+    def release(self):
+        """End a call whose outcome says nothing about upstream health (e.g. 429 or 4xx)"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            self._trim(now)
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            stats["window_calls"] = len(self._calls)
+            stats["window_failures"] = sum(1 for _, failed, _ in self._calls if failed)
+            stats["window_slow_calls"] = sum(1 for _, _, slow in self._calls if slow)
+        return stats
+
+    def _record(self, failed: bool, slow: bool):
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._open(now)
+                else:
+                    logger.info("LLM API circuit closed after a healthy probe")
+                    self._state = CLOSED
+                    self._calls.clear()
+                return
+            self._calls.append((now, failed, slow))
+            self._trim(now)
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+                slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+                if (failures / len(self._calls) >= self.failure_rate
+                        or slow_calls / len(self._calls) >= self.slow_call_rate):
+                    self._open(now)
+
+    def _open(self, now: float):
+        logger.warning(f"LLM API circuit opened; failing fast for {self.open_seconds:.0f}s")
+        self._state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        self._calls.clear()
+        self._stats["opened"] += 1
+
+    def _advance(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
@@ -0,0 +1,38 @@
+from contextvars import ContextVar
+from typing import Optional
+import time
+
+# Absolute time.monotonic() by which the current request must be answered
+current_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when the request's deadline passes before a stage could run"""
+
+
+def set_deadline(seconds: Optional[float]):
+    """Start the current request's budget; None or 0 means no deadline.
+
+    Tasks and copied contexts created afterwards inherit it, so concurrent
+    sub-requests (fan-out sections) share the caller's budget.
+    """
+    current_deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(stage: str):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededError(f"Request deadline exceeded before {stage}")
+
+
+def call_timeout(default: float, stage: str) -> float:
+    """Timeout for a blocking step: `default`, shortened to whatever the deadline leaves"""
+    check_deadline(stage)
+    left = remaining()
+    return default if left is None else min(default, left)
@@ -1,9 +1,17 @@
-from typing import Dict
-import numpy as np
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+from itertools import product
 from ..models.dosha import DoshaProfile, DoshaType, DoshaCharacteristic
+from ..models.questionnaire import QUESTIONNAIRE, Questionnaire
+
+# NumPy is only needed for batch scoring, so it is imported there rather than
+# on every app start
+if TYPE_CHECKING:
+    import numpy as np
+
+DOSHAS = ("vata", "pitta", "kapha")
 
 class DoshaAnalyzer:
-    def __init__(self):
+    def __init__(self, questionnaire: Questionnaire = QUESTIONNAIRE):
         self.characteristic_weights = {
             "body_frame": 2.0,
             "skin_type": 1.5,
@@ -11,6 +19,12 @@ class DoshaAnalyzer:
             "sleep_pattern": 1.5,
             "stress_response": 1.8,
         }
+        self.questionnaire = questionnaire
+        self._table_key = None
+        self._option_index: List[Dict[str, int]] = []
+        self._strides: List[int] = []
+        self._result_table: List[Dict] = []
+        self._ensure_result_table()
     
     def analyze_dosha(self, user_responses: Dict[str, DoshaCharacteristic]) -> Dict:
         scores = {
@@ -50,4 +64,126 @@ class DoshaAnalyzer:
             "kapha_percentage": percentages["kapha"]
         }
         
-        return response 
\ No newline at end of file
+        return response
+
+    def analyze_dosha_batch(self, scores: "np.ndarray", traits: Optional[Sequence[str]] = None) -> Dict[str, "np.ndarray"]:
+        """Score many users at once.
+
+        `scores` has shape (N users, traits, 3) with the last axis ordered
+        vata, pitta, kapha; `traits` names the trait axis and defaults to the
+        order of `characteristic_weights`. Returns the same keys as
+        `analyze_dosha`, each holding an array of length N. Results match the
+        scalar path exactly, including tie-breaking and the 25% threshold for
+        the secondary dosha.
+        """
+        import numpy as np
+
+        scores = np.asarray(scores, dtype=np.float64)
+        if traits is None:
+            traits = list(self.characteristic_weights)
+        if scores.ndim != 3 or scores.shape[1] != len(traits) or scores.shape[2] != len(DOSHAS):
+            raise ValueError(
+                f"Expected scores of shape (N, {len(traits)}, {len(DOSHAS)}), got {scores.shape}"
+            )
+
+        # Accumulate trait by trait so the floating point order matches analyze_dosha
+        totals = np.zeros((scores.shape[0], len(DOSHAS)), dtype=np.float64)
+        for index, trait in enumerate(traits):
+            totals += scores[:, index, :] * self.characteristic_weights.get(trait, 1.0)
+
+        total_score = (totals[:, 0] + totals[:, 1]) + totals[:, 2]
+        if np.any(total_score == 0):
+            raise ValueError(f"{int(np.count_nonzero(total_score == 0))} rows have a total score of zero")
+        percentages = (totals / total_score[:, None]) * 100
+
+        # argmax returns the first maximum, matching the stable sort in analyze_dosha
+        rows = np.arange(scores.shape[0])
+        primary = np.argmax(percentages, axis=1)
+        remaining = percentages.copy()
+        remaining[rows, primary] = -np.inf
+        secondary = np.argmax(remaining, axis=1)
+
+        names = np.array(DOSHAS, dtype=object)
+        secondary_names = names[secondary]
+        secondary_names[remaining[rows, secondary] <= 25] = None
+
+        return {
+            "primary_dosha": names[primary],
+            "secondary_dosha": secondary_names,
+            "vata_percentage": percentages[:, 0],
+            "pitta_percentage": percentages[:, 1],
+            "kapha_percentage": percentages[:, 2]
+        }
+
+    def build_score_array(self, responses: Sequence[Dict[str, DoshaCharacteristic]], traits: Optional[Sequence[str]] = None) -> Tuple["np.ndarray", List[str]]:
+        """Stack stored questionnaire responses for analyze_dosha_batch.
+
+        Traits default to the key order of the first response, which is the
+        order analyze_dosha accumulates in, so passing the returned traits on
+        to analyze_dosha_batch reproduces the scalar results bit for bit.
+        """
+        import numpy as np
+
+        if traits is None:
+            traits = list(responses[0]) if responses else list(self.characteristic_weights)
+        traits = list(traits)
+        scores = np.zeros((len(responses), len(traits), len(DOSHAS)), dtype=np.float64)
+        for row, user_responses in enumerate(responses):
+            for index, trait in enumerate(traits):
+                response = user_responses.get(trait)
+                if response is not None:
+                    scores[row, index] = [response[f"{dosha}_score"] for dosha in DOSHAS]
+        return scores, traits
+
+    def responses_from_answers(self, answers: Dict[str, str]) -> Dict[str, Dict]:
+        """Turn {trait_name: option label} answers into analyze_dosha input"""
+        responses = {}
+        for trait in self.questionnaire.traits:
+            label = answers[trait.trait_name]
+            option = next((option for option in trait.options if option.label == label), None)
+            if option is None:
+                raise ValueError(f"Unknown answer {label!r} for trait {trait.trait_name!r}")
+            responses[trait.trait_name] = {"trait_name": trait.trait_name, **option.scores()}
+        return responses
+
+    def analyze_answers(self, answers: Dict[str, str]) -> Dict:
+        """Look up the analyze_dosha result for a full set of questionnaire answers.
+
+        Every answer combination is precomputed, so this is a constant-time
+        table lookup. The table is rebuilt on first use after the weights or
+        the questionnaire change.
+        """
+        self._ensure_result_table()
+        index = 0
+        for trait, option_index, stride in zip(self.questionnaire.traits, self._option_index, self._strides):
+            label = answers[trait.trait_name]
+            if label not in option_index:
+                raise ValueError(f"Unknown answer {label!r} for trait {trait.trait_name!r}")
+            index += option_index[label] * stride
+        return dict(self._result_table[index])
+
+    def _ensure_result_table(self):
+        key = (self.questionnaire, tuple(self.characteristic_weights.items()))
+        if self._table_key is not None and self._table_key[0] is key[0] and self._table_key[1] == key[1]:
+            return
+
+        traits = self.questionnaire.traits
+        self._option_index = [
+            {option.label: index for index, option in enumerate(trait.options)}
+            for trait in traits
+        ]
+        # Mixed-radix strides; the last trait varies fastest, matching itertools.product
+        self._strides = []
+        stride = 1
+        for trait in reversed(traits):
+            self._strides.insert(0, stride)
+            stride *= len(trait.options)
+
+        self._result_table = [
+            self.analyze_dosha({
+                trait.trait_name: {"trait_name": trait.trait_name, **option.scores()}
+                for trait, option in zip(traits, combination)
+            })
+            for combination in product(*(trait.options for trait in traits))
+        ]
+        self._table_key = key
@@ -0,0 +1,364 @@
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from .background_loop import get_background_loop
+from .llm_scheduler import QUEUE_EVENT
+from .response_parser import SectionEvent
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+# Stream event key carrying {"status", "position"} (and "error" once failed)
+# while a job waits or when it fails
+JOB_EVENT = "job"
+
+# runner(payload, fan_out, session_id) streams the job's section events and
+# ends with (None, result), like the streaming routes
+JobRunner = Callable[[Dict, Optional[bool], Optional[str]], AsyncIterator[SectionEvent]]
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at JOB_MAX_QUEUED"""
+
+
+class JobStore:
+    """SQLite persistence of jobs and of the section events they produced.
+
+    Runs in WAL mode with one connection per thread, so several processes
+    (e.g. API workers) can share the file. Jobs are added and claimed
+    atomically; a running job whose heartbeat is older than the lease is
+    presumed orphaned by a dead process and can be claimed again. Every
+    call blocks on SQLite, so async callers run them in a thread.
+    """
+
+    def __init__(self, db_path: str, retention_seconds: float = 86400):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, fan_out INTEGER, "
+            "session TEXT, result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, "
+            "heartbeat_at REAL, finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            "job_id TEXT NOT NULL, seq INTEGER NOT NULL, section TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, seq))"
+        )
+        self.purge()
+
+    def add(self, payload: Dict, fan_out: Optional[bool], session: Optional[str],
+            max_queued: Optional[int] = None) -> Optional[str]:
+        """Queue a job and return its id; None if `max_queued` jobs are already waiting"""
+        job_id = uuid.uuid4().hex
+        # Counted and inserted in one write transaction, so concurrent
+        # submissions from any process cannot overshoot max_queued
+        with self._immediate() as conn:
+            if max_queued is not None:
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if queued >= max_queued:
+                    return None
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, fan_out, session, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), None if fan_out is None else int(fan_out), session, time.time())
+            )
+        return job_id
+
+    def claim(self, lease_seconds: float) -> Optional[Dict]:
+        """Mark the oldest runnable job as running and return it"""
+        now = time.time()
+        with self._immediate() as conn:
+            row = conn.execute(
+                "SELECT id, payload, fan_out, session FROM jobs "
+                "WHERE status = ? OR (status = ? AND heartbeat_at < ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now - lease_seconds)
+            ).fetchone()
+            if row is not None:
+                # A reclaimed job starts over
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (row[0],))
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (RUNNING, now, now, row[0])
+                )
+        if row is None:
+            return None
+        job_id, payload, fan_out, session = row
+        return {"id": job_id, "payload": json.loads(payload),
+                "fan_out": None if fan_out is None else bool(fan_out), "session": session}
+
+    def add_event(self, job_id: str, section: str, data) -> int:
+        conn = self._connection()
+        now = time.time()
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, section, data) VALUES (?, ?, ?, ?)",
+            (job_id, seq, section, json.dumps(data))
+        )
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (now, job_id))
+        return seq
+
+    def heartbeat(self, job_id: str):
+        self._connection().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: Dict):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+
+    def requeue(self, job_id: str):
+        conn = self._connection()
+        conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL WHERE id = ? AND status = ?",
+            (QUEUED, job_id, RUNNING)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, result, error, created_at, started_at, finished_at = row
+        position = 0
+        if status == QUEUED:
+            position = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?", (QUEUED, created_at)
+            ).fetchone()[0]
+        return {
+            "job_id": job_id,
+            "status": status,
+            "position": position,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at
+        }
+
+    def events_after(self, job_id: str, after: int) -> List[Tuple[int, str, object]]:
+        rows = self._connection().execute(
+            "SELECT seq, section, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)
+        ).fetchall()
+        return [(seq, section, json.loads(data)) for seq, section, data in rows]
+
+    def count(self, status: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def purge(self):
+        """Drop finished jobs older than the retention period"""
+        conn = self._connection()
+        cutoff = time.time() - self.retention_seconds
+        conn.execute(
+            "DELETE FROM job_events WHERE job_id IN "
+            "(SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?)", (*FINISHED, cutoff)
+        )
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED, cutoff))
+
+    @contextmanager
+    def _immediate(self) -> Iterator[sqlite3.Connection]:
+        # Write transaction taken up front, so reads inside it see no concurrent writer
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; add() and claim() manage their own transactions
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class JobQueue:
+    """Bounded pool of workers running persisted jobs on the background loop.
+
+    `submit` stores the job and returns its id at once; `workers` tasks
+    claim jobs in submission order and feed every section event into the
+    store, so any process sharing the database can poll the job (`get`) or
+    replay and follow its events (`events`). Submissions beyond
+    `max_queued` waiting jobs are refused. `shutdown` stops claiming,
+    lets running jobs finish for up to `drain_seconds` and puts the rest
+    back in the queue for the next start.
+
+    The workers share the background loop with every async LLM call, so
+    their store calls run in threads: a worker waiting on another
+    process's SQLite write lock must not stall the loop.
+    """
+
+    def __init__(self, store: JobStore, runner: JobRunner, workers: int = 4, max_queued: int = 200,
+                 drain_seconds: float = 30.0, lease_seconds: float = 180.0, poll_interval: float = 0.25):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.drain_seconds = drain_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._loop = get_background_loop()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._futures = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "requeued": 0}
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        asyncio.run_coroutine_threadsafe(self._create_wakeup(), self._loop).result()
+        self._futures = [
+            asyncio.run_coroutine_threadsafe(self._work(), self._loop) for _ in range(self.workers)
+        ]
+
+    def submit(self, payload: Dict, fan_out: Optional[bool] = None, session: Optional[str] = None) -> str:
+        if self._stopping:
+            raise JobQueueFullError("Job queue is shutting down")
+        job_id = self.store.add(payload, fan_out, session, self.max_queued)
+        if job_id is None:
+            self._count("rejected")
+            raise JobQueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+        self._count("submitted")
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    async def events(self, job_id: str, after: int = 0) -> AsyncIterator[Tuple[int, Optional[str], object]]:
+        """Replay the job's events after `after`, then follow it until it finishes.
+
+        Yields (seq, section, items) per section, (seq, JOB_EVENT, status)
+        while it waits or if it fails, and finally (seq, None, result).
+        Raises KeyError for an unknown job.
+        """
+        last_status = None
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                raise KeyError(job_id)
+            for seq, section, data in await asyncio.to_thread(self.store.events_after, job_id, after):
+                after = seq
+                yield seq, section, data
+            if job["status"] == DONE:
+                yield after, None, job["result"]
+                return
+            status = {"status": job["status"], "position": job["position"]}
+            if job["status"] == FAILED:
+                yield after, JOB_EVENT, {**status, "error": job["error"]}
+                return
+            if status != last_status:
+                last_status = status
+                yield after, JOB_EVENT, status
+            await asyncio.sleep(self.poll_interval)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Stop taking jobs and drain the running ones; blocks up to `timeout` (drain_seconds)"""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        deadline = time.monotonic() + (self.drain_seconds if timeout is None else timeout)
+        for future in self._futures:
+            try:
+                future.result(max(0.0, deadline - time.monotonic()))
+            except Exception:
+                pass
+        running = list(self._running.values())
+        if running:
+            logger.warning(f"Requeueing {len(running)} jobs still running after the drain period")
+            for task in running:
+                self._loop.call_soon_threadsafe(task.cancel)
+            for future in self._futures:
+                try:
+                    future.result(5)
+                except BaseException:
+                    pass
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queued"] = self.store.count(QUEUED)
+        stats["running"] = len(self._running)
+        return stats
+
+    async def _create_wakeup(self):
+        self._wakeup = asyncio.Event()
+
+    async def _work(self):
+        while not self._stopping:
+            job = await asyncio.to_thread(self.store.claim, self.lease_seconds)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # Jobs submitted by other processes are only seen by polling
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval * 4)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.ensure_future(self._run(job))
+            self._running[job["id"]] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.store.requeue, job["id"])
+                self._count("requeued")
+            finally:
+                self._running.pop(job["id"], None)
+
+    async def _run(self, job: Dict):
+        job_id = job["id"]
+        result = None
+        try:
+            async for section, data in self.runner(job["payload"], job["fan_out"], job["session"]):
+                if section is None:
+                    result = data
+                elif section == QUEUE_EVENT:
+                    # Transient scheduler status; only keeps the lease alive
+                    await asyncio.to_thread(self.store.heartbeat, job_id)
+                else:
+                    await asyncio.to_thread(self.store.add_event, job_id, section, data)
+            if result is None:
+                raise RuntimeError("Job finished without a result")
+            await asyncio.to_thread(self.store.finish, job_id, result)
+            self._count("done")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e) or type(e).__name__}")
+            await asyncio.to_thread(self.store.fail, job_id, str(e) or type(e).__name__)
+            self._count("failed")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
@@ -0,0 +1,213 @@
+from typing import Dict, Iterable, List, Optional, Union
+import hashlib
+import json
+import logging
+import mmap
+import struct
+import threading
+from pathlib import Path
+from ..config import get_knowledge_base_path
+from .response_parser import SECTION_PATHS, empty_sections, section_items
+
+logger = logging.getLogger(__name__)
+
+# Streaming event carrying the knowledge-base answer, sent before the LLM's
+# sections so there is something to show while they are generated
+INSTANT_EVENT = "instant"
+
+# Compiled layout, little-endian:
+#   header   magic, format version, knowledge base version, sha256 of the
+#            source JSON, number of conditions, number of items, meta length
+#   meta     JSON with the condition names (in index order) and descriptions
+#   slots    (first item, item count) per dosha x condition x section, where
+#            dosha and condition index 0 mean "any"
+#   offsets  byte offset of every item in the text blob, plus its end
+#   text     UTF-8 item texts, back to back
+MAGIC = b"AYKB"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sII32sIII")
+_SLOT = struct.Struct("<II")
+_OFFSET = struct.Struct("<I")
+
+DOSHAS = ("any", "vata", "pitta", "kapha")
+SECTIONS = tuple(SECTION_PATHS)
+_DOSHA_INDEX = {dosha: index for index, dosha in enumerate(DOSHAS)}
+_SECTION_INDEX = {section: index for index, section in enumerate(SECTIONS)}
+# Warnings are never cut; other sections keep the most specific items first
+MAX_ITEMS_PER_SECTION = 6
+
+
+def compile_knowledge_base(source: Dict, digest: bytes = b"\0" * 32) -> bytes:
+    """Pack the source JSON (see backend/app/data/knowledge_base.json) into
+    the compiled layout. Each condition's description becomes its first
+    condition_analysis item."""
+    names = sorted(source.get("conditions", {}))
+    cells: Dict[tuple, List[str]] = {}
+
+    def add(dosha: str, condition: int, sections: Dict[str, List[str]]):
+        for section, items in sections.items():
+            cells.setdefault((_DOSHA_INDEX[dosha], condition, _SECTION_INDEX[section]), []).extend(items)
+
+    add("any", 0, source.get("general", {}))
+    for dosha, sections in source.get("doshas", {}).items():
+        add(dosha, 0, sections)
+    descriptions = {}
+    for index, name in enumerate(names, 1):
+        entry = source["conditions"][name]
+        if entry.get("description"):
+            descriptions[name] = entry["description"]
+            add("any", index, {"condition_analysis": [f"{name}: {entry['description']}"]})
+        for dosha in DOSHAS:
+            add(dosha, index, entry.get(dosha, {}))
+
+    slots, offsets, texts, position = [], [], [], 0
+    for dosha in range(len(DOSHAS)):
+        for condition in range(len(names) + 1):
+            for section in range(len(SECTIONS)):
+                items = cells.get((dosha, condition, section), [])
+                slots.append(_SLOT.pack(len(offsets), len(items)))
+                for item in items:
+                    encoded = item.encode("utf-8")
+                    offsets.append(position)
+                    texts.append(encoded)
+                    position += len(encoded)
+    offsets.append(position)
+
+    meta = json.dumps({"conditions": names, "descriptions": descriptions}, ensure_ascii=False).encode("utf-8")
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, int(source.get("version", 0)), digest, len(names), len(offsets) - 1, len(meta)
+    )
+    return b"".join([header, meta, *slots, *(_OFFSET.pack(offset) for offset in offsets), *texts])
+
+
+class KnowledgeBase:
+    """Offline Ayurvedic recommendations indexed by dosha x condition x section.
+
+    The compiled form (compile_knowledge_base) is read in place, from an
+    mmap of the .kb file next to the source or from bytes, so loading costs
+    one header parse and every lookup is a few struct reads into fixed
+    tables. It backs the services' fallback results, the instant answer
+    streamed before the LLM's sections, and the condition descriptions used
+    in prompts.
+    """
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]):
+        self._buffer = buffer
+        magic, fmt, version, digest, conditions, items, meta_length = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError("Not a compiled knowledge base of this format")
+        self.version = version
+        self.digest = digest
+        meta = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + meta_length]))
+        self.conditions: List[str] = meta["conditions"]
+        self.descriptions: Dict[str, str] = meta["descriptions"]
+        self._condition_index = {name: index for index, name in enumerate(self.conditions, 1)}
+        self._slots_at = _HEADER.size + meta_length
+        self._offsets_at = self._slots_at + len(DOSHAS) * (conditions + 1) * len(SECTIONS) * _SLOT.size
+        self._text_at = self._offsets_at + (items + 1) * _OFFSET.size
+
+    @classmethod
+    def load(cls, source_path: Path) -> "KnowledgeBase":
+        """Map the compiled file next to the source, recompiling it when the source changed"""
+        source_path = Path(source_path)
+        compiled_path = source_path.with_suffix(".kb")
+        source = source_path.read_bytes() if source_path.exists() else None
+        digest = hashlib.sha256(source).digest() if source is not None else None
+
+        if compiled_path.exists():
+            knowledge_base = cls._map(compiled_path)
+            if knowledge_base is not None and (digest is None or knowledge_base.digest == digest):
+                return knowledge_base
+        if source is None:
+            raise FileNotFoundError(f"No knowledge base at {source_path}")
+
+        data = compile_knowledge_base(json.loads(source), digest)
+        try:
+            tmp_path = compiled_path.with_suffix(".kb.tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(compiled_path)
+        except OSError as e:
+            # A read-only install still works, from memory
+            logger.warning(f"Could not write compiled knowledge base to {compiled_path}: {str(e)}")
+            return cls(data)
+        return cls._map(compiled_path) or cls(data)
+
+    @classmethod
+    def _map(cls, path: Path) -> Optional["KnowledgeBase"]:
+        try:
+            with open(path, "rb") as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Ignoring compiled knowledge base at {path}: {str(e)}")
+            return None
+
+    def items(self, dosha: str, condition: Optional[str], section: str) -> List[str]:
+        """Items stored for exactly this cell; dosha "any" and condition None are the general ones"""
+        condition_index = self._condition_index.get(condition, -1) if condition is not None else 0
+        dosha_index = _DOSHA_INDEX.get(dosha)
+        if condition_index < 0 or dosha_index is None:
+            return []
+        slot = (dosha_index * (len(self.conditions) + 1) + condition_index) * len(SECTIONS) + _SECTION_INDEX[section]
+        first, count = _SLOT.unpack_from(self._buffer, self._slots_at + slot * _SLOT.size)
+        if not count:
+            return []
+        offsets = struct.unpack_from(f"<{count + 1}I", self._buffer, self._offsets_at + first * _OFFSET.size)
+        text_at, buffer = self._text_at, self._buffer
+        return [
+            bytes(buffer[text_at + start:text_at + end]).decode("utf-8")
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def recommendations(self, dosha_profile: Optional[Dict], conditions: Iterable[str] = ()) -> Dict:
+        """Sections dict for a primary dosha and list of conditions.
+
+        Each section lists dosha-and-condition items first, then condition,
+        dosha and general ones, without repeats. Sections nothing matches
+        stay empty.
+        """
+        dosha = str((dosha_profile or {}).get("primary_dosha") or "").lower()
+        doshas = [dosha, "any"] if dosha in _DOSHA_INDEX and dosha != "any" else ["any"]
+        known = [condition for condition in conditions or () if condition in self._condition_index]
+        result = empty_sections()
+        for section in SECTIONS:
+            items, seen = [], set()
+            for condition in [*known, None]:
+                for cell_dosha in doshas:
+                    for item in self.items(cell_dosha, condition, section):
+                        if item not in seen:
+                            seen.add(item)
+                            items.append(item)
+            if section != "warnings":
+                items = items[:MAX_ITEMS_PER_SECTION]
+            section_items(result, section).extend(items)
+        return result
+
+
+def fill_sections(defaults: Dict, found: Dict) -> Dict:
+    """`defaults` with every section that `found` has items for replaced by them"""
+    for section in SECTIONS:
+        items = section_items(found, section)
+        if items:
+            target = section_items(defaults, section)
+            target[:] = items
+    return defaults
+
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base() -> KnowledgeBase:
+    """Process-wide knowledge base; an empty one if the source cannot be loaded"""
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                path = get_knowledge_base_path()
+                try:
+                    _knowledge_base = KnowledgeBase.load(path)
+                    logger.info(f"Loaded knowledge base version {_knowledge_base.version} from {path}")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Error loading knowledge base from {path}: {str(e)}")
+                    _knowledge_base = KnowledgeBase(compile_knowledge_base({}))
+    return _knowledge_base
@@ -0,0 +1,435 @@
+from typing import AsyncIterator, Dict, Iterator, Optional
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+# iterate_async and run_coroutine are re-exported for existing callers
+from .background_loop import get_background_loop, iterate_async, run_coroutine  # noqa: F401
+from .circuit_breaker import CircuitBreaker
+from .llm_errors import LLMAPIError, LLMRateLimitError
+from .metrics import CONNECT, GENERATION, TTFB, get_metrics
+from ..config import get_circuit_breaker_settings, get_groq_api_key, get_llm_settings
+
+logger = logging.getLogger(__name__)
+
+# finish_reason of a completion cut off at max_tokens
+LENGTH_FINISH_REASON = "length"
+
+
+class Completion(str):
+    """Completion text, or the stream chunk that ended it, with the API's
+    finish_reason and token usage"""
+
+    def __new__(cls, content: str, finish_reason: Optional[str] = None, usage: Optional[Dict] = None):
+        completion = super().__new__(cls, content)
+        completion.finish_reason = finish_reason
+        completion.usage = usage
+        return completion
+
+
+def is_truncated(text: Optional[str]) -> bool:
+    """True for a completion, or final stream chunk, that stopped at max_tokens"""
+    return getattr(text, "finish_reason", None) == LENGTH_FINISH_REASON
+
+
+# Seconds the current thread spent opening connections since the last reset
+_connect_time = threading.local()
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = getattr(_connect_time, "seconds", 0.0) + time.monotonic() - start
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report how long TCP and TLS setup took"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool
+        }
+
+
+class _CallTimer:
+    """Splits one upstream call into the connect, ttfb and generation stages.
+
+    Sync calls learn their connect time from _TimedAdapter and their header
+    time from the response's `elapsed`; async calls from httpx's trace
+    extension. Token usage, when the API reported it, is recorded with the
+    stages.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.connect = 0.0
+        self.headers_at: Optional[float] = None
+        self.usage: Optional[Dict] = None
+        self._connect_started: Optional[float] = None
+        _connect_time.seconds = 0.0
+
+    def sync_headers(self, response: requests.Response):
+        self.connect = getattr(_connect_time, "seconds", 0.0)
+        self.headers_at = self.start + response.elapsed.total_seconds()
+
+    async def trace(self, event: str, info: Dict):
+        if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            self._connect_started = time.monotonic()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.connect += time.monotonic() - (self._connect_started or self.start)
+        elif event.endswith("receive_response_headers.complete"):
+            self.headers_at = time.monotonic()
+
+    def finish(self, usage: Optional[Dict] = None):
+        end = time.monotonic()
+        headers_at = self.headers_at or end
+        metrics = get_metrics()
+        metrics.observe(CONNECT, self.connect)
+        metrics.observe(TTFB, headers_at - self.start - self.connect)
+        metrics.observe(GENERATION, end - headers_at)
+        metrics.record_usage(usage or self.usage)
+
+
+class LLMClient:
+    """Groq chat-completions transport shared by every service.
+
+    Sync calls go through one keep-alive requests.Session whose connection
+    pool is sized by LLM_MAX_CONNECTIONS; urllib3 pools are thread-safe, so
+    the session is shared across Streamlit script threads. Async calls use
+    one httpx.AsyncClient per event loop with the same limits. API URL,
+    model and timeout come from config instead of being repeated per service.
+
+    Chat calls go through a CircuitBreaker: 5xx answers, connection errors
+    and timeouts count as failures, 429 and other 4xx answers are neutral.
+    Every call takes an optional timeout so callers can pass what is left
+    of their deadline. Completions are returned as Completion strings
+    carrying the API's finish_reason; streams yield one with the final
+    chunk.
+
+    Each call records its connect, time-to-first-byte and generation time,
+    its token usage and, if it fails, the cause (see metrics.py).
+    """
+
+    def __init__(self, api_key: Optional[str] = None, settings: Optional[Dict] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        settings = settings or get_llm_settings()
+        self.api_key = api_key or get_groq_api_key()
+        self.api_url = settings["api_url"]
+        self.model = settings["model"]
+        self.timeout = settings["timeout"]
+        self.max_connections = settings["max_connections"]
+        self.max_keepalive_connections = settings["max_keepalive_connections"]
+        self.prewarm_connections = settings["prewarm_connections"]
+        self.breaker = breaker or CircuitBreaker(**get_circuit_breaker_settings())
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = _TimedAdapter(pool_connections=1, pool_maxsize=self.max_connections, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # httpx connections cannot cross event loops, so keep one client per loop
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+
+    def post_chat(self, data: Dict, timeout: Optional[float] = None,
+                  timer: Optional[_CallTimer] = None) -> requests.Response:
+        self.breaker.before_call()
+        timer = timer or _CallTimer()
+        try:
+            response = self.session.post(self.api_url, json=data, timeout=timeout or self.timeout)
+        except requests.Timeout:
+            self._record_timeout(timer.start)
+            raise
+        except requests.RequestException:
+            self._record_connection_error()
+            raise
+        timer.sync_headers(response)
+        self._record_status(response.status_code, timer.start)
+        return response
+
+    async def apost_chat(self, data: Dict, timeout: Optional[float] = None,
+                         timer: Optional[_CallTimer] = None) -> httpx.Response:
+        self.breaker.before_call()
+        timer = timer or _CallTimer()
+        try:
+            response = await self.get_async_client().post(
+                self.api_url, json=data, timeout=timeout or self.timeout, extensions={"trace": timer.trace}
+            )
+        except httpx.TimeoutException:
+            self._record_timeout(timer.start)
+            raise
+        except httpx.HTTPError:
+            self._record_connection_error()
+            raise
+        self._record_status(response.status_code, timer.start)
+        return response
+
+    def complete(self, data: Dict, timeout: Optional[float] = None) -> Optional[str]:
+        """Content of a chat completion, or None when the API answers with an error"""
+        timer = _CallTimer()
+        response = self.post_chat(data, timeout, timer)
+        _raise_for_rate_limit(response)
+        if response.status_code != 200:
+            logger.error(f"API call failed: {response.text}")
+            return None
+        completion = _completion(response.json())
+        timer.finish(completion.usage)
+        return completion
+
+    async def acomplete(self, data: Dict, timeout: Optional[float] = None) -> Optional[str]:
+        timer = _CallTimer()
+        response = await self.apost_chat(data, timeout, timer)
+        _raise_for_rate_limit(response)
+        if response.status_code != 200:
+            logger.error(f"API call failed: {response.text}")
+            return None
+        completion = _completion(response.json())
+        timer.finish(completion.usage)
+        return completion
+
+    def stream_chat(self, data: Dict, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield content deltas of a streamed completion as they arrive.
+
+        The breaker judges the call by its time to the response headers;
+        `timeout` bounds the connection and each read.
+        """
+        self.breaker.before_call()
+        timer = _CallTimer()
+        recorded = False
+        try:
+            with self.session.post(self.api_url, json={**data, "stream": True}, timeout=timeout or self.timeout,
+                                   stream=True) as response:
+                recorded = True
+                timer.sync_headers(response)
+                self._record_status(response.status_code, timer.start)
+                _raise_for_rate_limit(response)
+                if response.status_code != 200:
+                    raise LLMAPIError(f"API call failed: {response.text}")
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = _parse_sse_line(line)
+                    if delta is None:
+                        break
+                    if isinstance(delta, Completion):
+                        timer.usage = delta.usage or timer.usage
+                    if delta or isinstance(delta, Completion):
+                        yield delta
+                timer.finish()
+        except requests.Timeout:
+            self._record_timeout(timer.start, counted=recorded)
+            raise
+        except requests.RequestException:
+            if not recorded:
+                self.breaker.record_failure()
+            self._count_error("connection")
+            raise
+
+    async def astream_chat(self, data: Dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        self.breaker.before_call()
+        timer = _CallTimer()
+        recorded = False
+        try:
+            async with self.get_async_client().stream(
+                "POST", self.api_url, json={**data, "stream": True}, timeout=timeout or self.timeout,
+                extensions={"trace": timer.trace}
+            ) as response:
+                recorded = True
+                self._record_status(response.status_code, timer.start)
+                _raise_for_rate_limit(response)
+                if response.status_code != 200:
+                    await response.aread()
+                    raise LLMAPIError(f"API call failed: {response.text}")
+                async for line in response.aiter_lines():
+                    delta = _parse_sse_line(line)
+                    if delta is None:
+                        break
+                    if isinstance(delta, Completion):
+                        timer.usage = delta.usage or timer.usage
+                    if delta or isinstance(delta, Completion):
+                        yield delta
+                timer.finish()
+        except httpx.TimeoutException:
+            self._record_timeout(timer.start, counted=recorded)
+            raise
+        except httpx.HTTPError:
+            if not recorded:
+                self.breaker.record_failure()
+            self._count_error("connection")
+            raise
+
+    def _record_status(self, status_code: int, start: float):
+        if status_code == 200:
+            self.breaker.record_success(time.monotonic() - start)
+            return
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        self._count_error("rate_limited" if status_code == 429 else f"http_{status_code // 100}xx")
+
+    def _record_timeout(self, start: float, counted: bool = False):
+        # counted: the breaker already judged this call by its response headers
+        self._count_error("timeout")
+        if counted:
+            return
+        # A timeout shortened by the caller's deadline says nothing about upstream health
+        if time.monotonic() - start >= self.breaker.slow_call_seconds:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+
+    def _record_connection_error(self):
+        self.breaker.record_failure()
+        self._count_error("connection")
+
+    def _count_error(self, cause: str):
+        get_metrics().count_error(cause)
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            with self._async_lock:
+                client = self._async_clients.get(loop)
+                if client is None:
+                    client = httpx.AsyncClient(
+                        headers=self.headers,
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections
+                        ),
+                        timeout=self.timeout
+                    )
+                    self._async_clients[loop] = client
+        return client
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def prewarm(self, connections: Optional[int] = None):
+        """Open keep-alive connections ahead of the first consultation.
+
+        Each warm-up is a cheap GET on the models endpoint, issued in
+        parallel so the pool ends up holding that many established
+        TCP+TLS connections.
+        """
+        connections = self.prewarm_connections if connections is None else connections
+        if connections <= 0:
+            return
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(lambda _: self._warm_request(), range(connections)))
+
+    async def aprewarm(self, connections: Optional[int] = None):
+        connections = self.prewarm_connections if connections is None else connections
+        if connections <= 0:
+            return
+        client = self.get_async_client()
+        await asyncio.gather(
+            *(self._awarm_request(client) for _ in range(connections))
+        )
+
+    def _models_url(self) -> str:
+        return self.api_url.rsplit("/chat/completions", 1)[0] + "/models"
+
+    def _warm_request(self):
+        try:
+            self.session.get(self._models_url(), timeout=self.timeout).close()
+        except requests.RequestException as e:
+            logger.warning(f"Connection pre-warm failed: {str(e)}")
+
+    async def _awarm_request(self, client: httpx.AsyncClient):
+        try:
+            await client.get(self._models_url())
+        except httpx.HTTPError as e:
+            logger.warning(f"Connection pre-warm failed: {str(e)}")
+
+
+def _raise_for_rate_limit(response):
+    # requests and httpx responses both expose status_code and case-insensitive headers
+    if response.status_code != 429:
+        return
+    try:
+        retry_after = float(response.headers.get("retry-after", "1"))
+    except ValueError:
+        retry_after = 1.0
+    raise LLMRateLimitError(f"API rate limit reached; retry after {retry_after}s", retry_after)
+
+
+def _completion(payload: Dict) -> Completion:
+    choice = payload['choices'][0]
+    return Completion(choice['message']['content'], choice.get('finish_reason'), payload.get('usage'))
+
+
+def _parse_sse_line(line: str) -> Optional[str]:
+    """Content delta of one server-sent event line; None marks the end of the stream.
+
+    The chunk carrying finish_reason comes back as a Completion, even when
+    empty, with the usage Groq reports in that chunk (under x_groq).
+    """
+    if not line or not line.startswith("data:"):
+        return ""
+    payload = line[5:].strip()
+    if payload == "[DONE]":
+        return None
+    chunk = json.loads(payload)
+    choice = (chunk.get("choices") or [{}])[0]
+    content = choice.get("delta", {}).get("content") or ""
+    if choice.get("finish_reason"):
+        usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+        return Completion(content, choice["finish_reason"], usage)
+    return content
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Process-wide LLMClient shared by RecommendationEngine and ConsultationService"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LLMClient()
+    return _llm_client
+
+
+def prewarm_in_background(client: LLMClient):
+    """Warm the async pool on the background loop without blocking startup"""
+    if client.prewarm_connections > 0:
+        asyncio.run_coroutine_threadsafe(client.aprewarm(), get_background_loop())
@@ -0,0 +1,10 @@
+class LLMAPIError(Exception):
+    """Raised when the LLM API answers a streaming request with an error status"""
+
+
+class LLMRateLimitError(LLMAPIError):
+    """Raised on HTTP 429; retry_after is the pause in seconds the API asked for"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,329 @@
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional
+import asyncio
+import logging
+import threading
+import time
+from .deadline import DeadlineExceededError, check_deadline, remaining
+from .llm_errors import LLMAPIError
+from .metrics import QUEUE_WAIT, get_metrics
+from .prompt_builder import estimate_tokens
+from ..config import get_rate_limit_settings
+
+logger = logging.getLogger(__name__)
+
+# Lower value is served first
+PRIORITY_CONSULTATION = 0
+PRIORITY_RECOMMENDATION = 1
+
+# Stream event key carrying {"position", "eta_seconds", "queued"} while a request waits
+QUEUE_EVENT = "queue"
+
+DEFAULT_COMPLETION_TOKENS = 1024
+
+# Session used for callers that do not identify themselves
+current_session: ContextVar[Optional[str]] = ContextVar("llm_session", default=None)
+
+
+class LLMQueueFullError(LLMAPIError):
+    """Raised when admission control refuses a request instead of queueing it"""
+
+
+def estimate_request_tokens(data: Dict) -> int:
+    """Tokens a chat request counts against the per-minute budget: prompt plus completion allowance"""
+    prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in data.get("messages", []))
+    return prompt_tokens + data.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second up to one minute's worth"""
+
+    def __init__(self, per_minute: float):
+        self.unlimited = per_minute <= 0
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available; requests larger than the bucket wait for a full one"""
+        if self.unlimited:
+            return 0.0
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.level -= min(amount, self.capacity)
+
+
+class Ticket:
+    """A queued LLM call; granted once both buckets can pay for it"""
+
+    def __init__(self, priority: int, session: str, tokens: int):
+        self.priority = priority
+        self.session = session
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        # Seconds between submitting and being granted
+        self.waited: Optional[float] = None
+        self.granted = threading.Event()
+        self._futures: List = []
+
+
+class LLMScheduler:
+    """Central admission point for every upstream LLM call.
+
+    Requests wait in a bounded priority queue until a requests-per-minute
+    and a tokens-per-minute token bucket can both pay for them. Within one
+    priority, sessions are served round-robin so a single user cannot
+    starve the others. A 429 from the API pauses dispatching for its
+    Retry-After. Requests are refused up front (LLMQueueFullError) when the
+    queue is full or their estimated wait exceeds max_wait_seconds, and
+    (DeadlineExceededError) when it exceeds the request's deadline; a
+    request whose deadline passes while queued leaves the queue.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_queue: int = 100, max_wait_seconds: float = 120.0):
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._queues: Dict[int, "OrderedDict[str, Deque[Ticket]]"] = {}
+        self._size = 0
+        self._paused_until = 0.0
+        self._dispatcher: Optional[threading.Thread] = None
+        self._stats = {"granted": 0, "rejected": 0, "rate_limited": 0, "max_queued": 0, "wait_seconds": 0.0}
+
+    def submit(self, priority: int, tokens: int, session: Optional[str] = None) -> Ticket:
+        ticket = Ticket(priority, session or "anonymous", tokens)
+        with self._cond:
+            if self._size >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise LLMQueueFullError(f"LLM queue is full ({self._size} requests waiting)")
+            self._enqueue(ticket)
+            self._dispatch()
+            if not ticket.granted.is_set():
+                eta = self._status(ticket)["eta_seconds"]
+                if self.max_wait_seconds and eta > self.max_wait_seconds:
+                    self._remove(ticket)
+                    self._stats["rejected"] += 1
+                    raise LLMQueueFullError(f"Estimated LLM queue wait of {eta:.0f}s is too long")
+                left = remaining()
+                if left is not None and eta > left:
+                    self._remove(ticket)
+                    self._stats["rejected"] += 1
+                    raise DeadlineExceededError(f"Estimated LLM queue wait of {eta:.0f}s exceeds the request deadline")
+                self._ensure_dispatcher()
+                self._cond.notify()
+        return ticket
+
+    def wait_turn(self, ticket: Ticket, interval: float = 1.0) -> Iterator[Dict]:
+        """Block until the ticket is granted, yielding its queue status every `interval` seconds"""
+        try:
+            while not ticket.granted.is_set():
+                yield self.status(ticket)
+                if not ticket.granted.wait(_bounded(interval)):
+                    check_deadline("its turn in the LLM queue")
+            # Recorded here rather than by the dispatcher, in the waiting request's context
+            get_metrics().observe(QUEUE_WAIT, ticket.waited or 0.0)
+        finally:
+            if not ticket.granted.is_set():
+                self.cancel(ticket)
+
+    def acquire(self, priority: int, tokens: int, session: Optional[str] = None):
+        for _ in self.wait_turn(self.submit(priority, tokens, session), interval=60.0):
+            pass
+
+    async def await_turn(self, ticket: Ticket, interval: float = 1.0) -> AsyncIterator[Dict]:
+        """Wait for the ticket on the running loop, yielding its queue status every `interval` seconds"""
+        future = self._future(ticket)
+        try:
+            while not future.done():
+                yield self.status(ticket)
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), _bounded(interval))
+                except asyncio.TimeoutError:
+                    check_deadline("its turn in the LLM queue")
+            get_metrics().observe(QUEUE_WAIT, ticket.waited or 0.0)
+        finally:
+            if not future.done():
+                self.cancel(ticket)
+
+    async def aacquire(self, priority: int, tokens: int, session: Optional[str] = None):
+        async for _ in self.await_turn(self.submit(priority, tokens, session), interval=60.0):
+            pass
+
+    def cancel(self, ticket: Ticket):
+        with self._cond:
+            if not ticket.granted.is_set():
+                self._remove(ticket)
+                self._cond.notify()
+
+    def pause(self, seconds: float):
+        """Stop granting for `seconds`, e.g. after a 429 with Retry-After"""
+        with self._cond:
+            self._stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            logger.warning(f"LLM rate limit reached; pausing requests for {seconds:.1f}s")
+
+    def status(self, ticket: Ticket) -> Dict:
+        with self._cond:
+            return self._status(ticket)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = self._size
+            stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["granted"] if stats["granted"] else 0.0
+        return stats
+
+    # Everything below runs with self._cond held
+
+    def _enqueue(self, ticket: Ticket):
+        sessions = self._queues.setdefault(ticket.priority, OrderedDict())
+        sessions.setdefault(ticket.session, deque()).append(ticket)
+        self._size += 1
+        self._stats["max_queued"] = max(self._stats["max_queued"], self._size)
+
+    def _remove(self, ticket: Ticket):
+        sessions = self._queues.get(ticket.priority, {})
+        queue = sessions.get(ticket.session)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del sessions[ticket.session]
+        self._size -= 1
+
+    def _next(self) -> Optional[Ticket]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _pop(self, ticket: Ticket):
+        sessions = self._queues[ticket.priority]
+        queue = sessions[ticket.session]
+        queue.popleft()
+        if queue:
+            # Round-robin: the session's next request goes behind the other sessions
+            sessions.move_to_end(ticket.session)
+        else:
+            del sessions[ticket.session]
+        self._size -= 1
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant every ticket the buckets allow; returns seconds until the next one could go"""
+        while True:
+            ticket = self._next()
+            if ticket is None:
+                return None
+            now = time.monotonic()
+            delay = max(
+                self._paused_until - now,
+                self._requests.wait_time(1, now),
+                self._tokens.wait_time(ticket.tokens, now)
+            )
+            if delay > 0:
+                return delay
+            self._pop(ticket)
+            self._requests.take(1)
+            self._tokens.take(ticket.tokens)
+            self._stats["granted"] += 1
+            ticket.waited = now - ticket.enqueued
+            self._stats["wait_seconds"] += ticket.waited
+            self._grant(ticket)
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted.set()
+        for loop, future in ticket._futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _future(self, ticket: Ticket) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if ticket.granted.is_set():
+                future.set_result(None)
+            else:
+                ticket._futures.append((loop, future))
+        return future
+
+    def _ordered(self) -> Iterator[Ticket]:
+        # Dispatch order: priorities in turn, sessions round-robin within each
+        for priority in sorted(self._queues):
+            queues = [list(queue) for queue in self._queues[priority].values()]
+            for depth in range(max((len(queue) for queue in queues), default=0)):
+                for queue in queues:
+                    if depth < len(queue):
+                        yield queue[depth]
+
+    def _status(self, ticket: Ticket) -> Dict:
+        if ticket.granted.is_set():
+            return {"position": 0, "eta_seconds": 0.0, "queued": self._size}
+        position, tokens = 0, 0
+        for queued in self._ordered():
+            position += 1
+            tokens += queued.tokens
+            if queued is ticket:
+                break
+        now = time.monotonic()
+        eta = max(
+            self._paused_until - now,
+            _time_for(self._requests, position, now),
+            _time_for(self._tokens, tokens, now)
+        )
+        return {"position": position, "eta_seconds": round(eta, 1), "queued": self._size}
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+            self._dispatcher.start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                self._cond.wait(timeout=self._dispatch())
+
+
+def _time_for(bucket: TokenBucket, amount: float, now: float) -> float:
+    # Unlike wait_time this is not capped at the bucket size: it covers everything queued ahead
+    if bucket.unlimited:
+        return 0.0
+    bucket.refill(now)
+    return max(0.0, (amount - bucket.level) / bucket.rate)
+
+
+def _bounded(interval: float) -> float:
+    left = remaining()
+    return interval if left is None else max(0.0, min(interval, left))
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Process-wide scheduler; every service shares the same Groq limits"""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        with _llm_scheduler_lock:
+            if _llm_scheduler is None:
+                _llm_scheduler = LLMScheduler(**get_rate_limit_settings())
+    return _llm_scheduler
@@ -0,0 +1,890 @@
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import contextvars
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..config import get_prompt_settings
+from .circuit_breaker import CircuitOpenError
+from .deadline import DeadlineExceededError, call_timeout, check_deadline, remaining
+from .knowledge_base import INSTANT_EVENT, get_knowledge_base
+from .llm_client import LLMRateLimitError, get_llm_client, is_truncated
+from .llm_errors import LLMAPIError
+from .llm_scheduler import (
+    PRIORITY_RECOMMENDATION, QUEUE_EVENT, LLMQueueFullError, current_session, estimate_request_tokens,
+    get_llm_scheduler
+)
+from .metrics import PARSE, PROMPT_BUILD, get_metrics
+from .prompt_builder import (
+    DOSHA_TEMPLATE, MISSING_DOSHA_TEMPLATE, PATIENT_PROFILE_TEMPLATE, SECTION_PROMPTS, STRUCTURED_OUTPUT_TEMPLATE,
+    PromptTemplate, estimate_tokens, fit_free_text, get_prompt_stats, length_hint, output_budget
+)
+from .response_cache import get_response_cache, make_cache_key
+from .response_parser import (
+    ConsultationResponseParser, SectionEvent, StructuredResponseParser, event_key, mark_fallback,
+    parse_consultation_response, parse_section_response, parse_structured_response, parse_structured_section,
+    section_events, section_items, split_truncated, structured_shape
+)
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .term_extractor import CONDITION, MEDICATION, extract_consultation_terms, get_term_matcher
+
+logger = logging.getLogger(__name__)
+
+# Extra attempts after a 429; the scheduler pauses for Retry-After in between
+RATE_LIMIT_RETRIES = 2
+
+# Fallback cause when the API answered with an error status, or nothing was left to serve
+NO_COMPLETION = "no_completion"
+# Fallback causes by exception type, most specific first; anything else is "error"
+FALLBACK_CAUSES = (
+    (DeadlineExceededError, "deadline"),
+    (CircuitOpenError, "circuit_open"),
+    (LLMQueueFullError, "queue_full"),
+    (LLMRateLimitError, "rate_limited"),
+    (LLMAPIError, "api_error"),
+)
+
+
+class LLMService:
+    """Cache, coalescing, transport and parsing shared by the LLM-backed services.
+
+    The prompt is the patient profile and the instructions of the requested
+    sections inside `prompt_template`. Subclasses set that frame (and
+    `section_prompts` if they generate fewer sections) and build the request
+    (_build_request_data), the parser (_create_parser /
+    _parse_consultation_response) and the fallback result (_get_fallback).
+    Identical concurrent requests, keyed like the response cache, share one
+    upstream call in both the sync and the async path.
+    """
+
+    # Bump whenever the prompt template changes so cached completions are not reused
+    prompt_template_version = 3
+    # Section key -> prompt instructions for that section, in prompt order
+    section_prompts: Dict[str, PromptTemplate] = SECTION_PROMPTS
+    # Frame around the patient profile and the section instructions
+    prompt_template: Optional[PromptTemplate] = None
+    # Sent instead when the prompt cannot be built
+    default_prompt_template = PromptTemplate("Provide general Ayurvedic recommendations")
+    # Scheduler priority of this service's calls; lower is served first
+    priority = PRIORITY_RECOMMENDATION
+
+    def __init__(self):
+        self.llm_client = get_llm_client()
+        self.model = self.llm_client.model
+        self.cache = get_response_cache()
+        self.inflight = SingleFlight()
+        self.async_inflight = AsyncSingleFlight()
+        self.scheduler = get_llm_scheduler()
+        prompt_settings = get_prompt_settings()
+        self.input_token_budget = prompt_settings["input_token_budget"]
+        self.max_output_tokens = prompt_settings["max_output_tokens"]
+        self.output_token_headroom = prompt_settings["output_token_headroom"]
+        self.structured_output = prompt_settings["structured_output"]
+        # Near-duplicate tier behind the exact cache; services that want one set it
+        self.similar_cache = None
+        self.knowledge_base = get_knowledge_base()
+        self.term_matcher = get_term_matcher()
+
+    @property
+    def condition_info(self) -> Dict[str, str]:
+        """Ayurvedic description of each known condition, from the knowledge base"""
+        return self.knowledge_base.descriptions
+
+    def _recognized_terms(self, data: Dict) -> Dict[str, List[str]]:
+        """Canonical conditions and medications mentioned in the free-text fields"""
+        return extract_consultation_terms(self.term_matcher, data)
+
+    def _conditions(self, data: Dict) -> Tuple[List[str], List[str]]:
+        """Conditions selected in the form, and those only mentioned in its free text"""
+        selected = (data.get('medical_history') or {}).get('conditions') or []
+        selected = [] if "None" in selected else list(selected)
+        mentioned = [condition for condition in self._recognized_terms(data)[CONDITION] if condition not in selected]
+        return selected, mentioned
+
+    def _knowledge_base_conditions(self, conditions: Iterable[str]) -> List[str]:
+        """Conditions under the names the knowledge base files them by, without
+        repeats, so "Type 2 Diabetes" finds the Diabetes recommendations"""
+        return list(dict.fromkeys(self.term_matcher.group(condition) for condition in conditions))
+
+    def _condition_description(self, condition: str) -> Optional[str]:
+        """Knowledge-base description of a condition, or of the one it is filed under"""
+        return self.condition_info.get(condition) or self.condition_info.get(self.term_matcher.group(condition))
+
+    def _medications_context(self, data: Dict) -> str:
+        """The medications field, followed by the medications and herbs
+        recognized anywhere in the free text with their class"""
+        medications = data.get('medical_history', {}).get('medications', 'None reported')
+        recognized = [
+            f"{name} ({self.term_matcher.categories[name]})" if name in self.term_matcher.categories else name
+            for name in self._recognized_terms(data)[MEDICATION]
+        ]
+        if not recognized:
+            return medications
+        return f"{medications}\nRecognized: {', '.join(recognized)}"
+
+    def _build_request_data(self, consultation_data: Dict, sections: Optional[List[str]] = None) -> Dict:
+        raise NotImplementedError
+
+    def _create_parser(self, consultation_data: Dict) -> ConsultationResponseParser:
+        raise NotImplementedError
+
+    def _parse_consultation_response(self, response: str, consultation_data: Dict) -> Dict:
+        raise NotImplementedError
+
+    def _get_fallback(self, consultation_data: Dict) -> Dict:
+        raise NotImplementedError
+
+    def _fallback(self, consultation_data: Dict, cause: str) -> Dict:
+        """The knowledge-base answer (see knowledge_base.py), marked as a
+        fallback and counted under `cause` in the metrics"""
+        get_metrics().count_fallback(cause)
+        return mark_fallback(self._get_fallback(consultation_data))
+
+    def _instant_events(self, consultation_data: Dict) -> Iterator[SectionEvent]:
+        # Streams that have to wait for the LLM show the knowledge-base answer
+        # first, until the generated sections arrive
+        try:
+            yield INSTANT_EVENT, self._get_fallback(consultation_data)
+        except Exception as e:
+            logger.error(f"Error building instant results in {type(self).__name__}: {str(e)}")
+
+    def _create_consultation_prompt(self, data: Dict, sections: Optional[Iterable[str]] = None) -> str:
+        try:
+            instructions = self._section_instructions(data, sections or self.section_prompts)
+            return self.prompt_template.format(profile=self._create_patient_profile(data), instructions=instructions)
+            
+        except Exception as e:
+            logger.error(f"Error creating consultation prompt: {str(e)}")
+            return self._get_default_prompt()
+
+    def _get_default_prompt(self) -> str:
+        """Provide a default prompt if there's an error"""
+        return self.default_prompt_template.text
+
+    def _create_patient_profile(self, data: Dict) -> str:
+        # Safely get all required data with defaults
+        personal = data.get('personal_info', {})
+        lifestyle = data.get('lifestyle', {})
+        concerns = data.get('concerns', {})
+
+        return PATIENT_PROFILE_TEMPLATE.format(
+            # Get dosha and condition information
+            dosha_info=self._get_dosha_context(data.get('dosha_profile')),
+            conditions_info=self._get_conditions_context(*self._conditions(data)).strip(),
+            age=personal.get('age', 'Not provided'),
+            gender=personal.get('gender', 'Not provided'),
+            bmi=personal.get('bmi', 'Not provided'),
+            weight=personal.get('weight', 'Not provided'),
+            height=personal.get('height', 'Not provided'),
+            medications=self._medications_context(data),
+            diet_type=lifestyle.get('diet_type', 'Not provided'),
+            physical_activity=lifestyle.get('physical_activity', 'Not provided'),
+            sleep_hours=lifestyle.get('sleep_hours', 'Not provided'),
+            stress_level=lifestyle.get('stress_level', 'Not provided'),
+            primary_concerns=concerns.get('primary_concerns', 'Not provided'),
+            previous_treatments=concerns.get('previous_treatments', 'None reported')
+        )
+
+    def _get_dosha_context(self, dosha_profile: Dict) -> str:
+        """Safely get dosha context even if dosha profile is missing"""
+        if not dosha_profile:
+            return MISSING_DOSHA_TEMPLATE.text
+            
+        try:
+            primary_dosha = str(dosha_profile.get('primary_dosha', '')).lower() if dosha_profile.get('primary_dosha') else 'unknown'
+            secondary_dosha = str(dosha_profile.get('secondary_dosha', '')).lower() if dosha_profile.get('secondary_dosha') else 'none'
+            
+            return DOSHA_TEMPLATE.format(
+                primary=primary_dosha.title(),
+                secondary=secondary_dosha.title() if secondary_dosha != 'none' else 'None',
+                vata=dosha_profile.get('vata_percentage', 0),
+                pitta=dosha_profile.get('pitta_percentage', 0),
+                kapha=dosha_profile.get('kapha_percentage', 0)
+            )
+        except Exception as e:
+            logger.error(f"Error processing dosha profile: {str(e)}")
+            return "Dosha Profile: Error processing dosha information"
+
+    def _get_conditions_context(self, conditions: List[str], mentioned: Iterable[str] = ()) -> str:
+        """Safely get conditions context; `mentioned` are conditions only
+        recognized in the free-text fields"""
+        try:
+            if not conditions or "None" in conditions:
+                conditions = []
+            # Conditions the form does not list are marked, so the model can weigh them accordingly
+            labelled = [(condition, condition) for condition in conditions]
+            labelled += [(condition, f"{condition} (mentioned by the patient)") for condition in mentioned]
+            if not labelled:
+                return "No current medical conditions reported."
+                
+            context = "Current Medical Conditions and Their Ayurvedic Context:\n"
+            for condition, label in labelled:
+                description = self._condition_description(condition)
+                if description:
+                    context += f"- {label}: {description}\n"
+                else:
+                    context += f"- {label}\n"
+            return context
+        except Exception as e:
+            logger.error(f"Error processing conditions: {str(e)}")
+            return "Error processing medical conditions"
+
+    def _create_prompt(self, data: Dict, sections: List[str]) -> str:
+        prompt = self._create_consultation_prompt(data, sections)
+        if self.structured_output:
+            prompt += "\n\n" + STRUCTURED_OUTPUT_TEMPLATE.format(shape=structured_shape(sections))
+        return prompt
+
+    def _build_prompt(self, consultation_data: Dict, sections: Optional[Iterable[str]] = None) -> str:
+        """Prompt for the sections (all by default), built from the compacted
+        templates (see prompt_builder.py). A prompt estimated above
+        LLM_INPUT_TOKEN_BUDGET is rebuilt with its free-text fields trimmed."""
+        sections = list(sections or self.section_prompts)
+        with get_metrics().timed(PROMPT_BUILD):
+            prompt = self._create_prompt(consultation_data, sections)
+            tokens = estimate_tokens(prompt)
+            saved_by_trimming = 0
+            if self.input_token_budget and tokens > self.input_token_budget:
+                trimmed, saved_by_trimming = fit_free_text(consultation_data, tokens - self.input_token_budget)
+                if saved_by_trimming:
+                    prompt = self._create_prompt(trimmed, sections)
+                    tokens = estimate_tokens(prompt)
+                if tokens > self.input_token_budget:
+                    logger.warning(
+                        f"Prompt of ~{tokens} tokens is over the input budget of {self.input_token_budget} after trimming"
+                    )
+        get_prompt_stats().record(tokens, self._compaction_savings(sections), saved_by_trimming)
+        return prompt
+
+    def _output_budget(self, consultation_data: Dict, sections: Iterable[str]) -> Dict[str, int]:
+        """Output tokens per section, from the number of conditions and concerns,
+        scaled down to fit max_output_tokens with headroom. Each one is stated
+        in the prompt as a length hint; max_tokens is their sum plus headroom."""
+        budget = output_budget(consultation_data, sections)
+        total = sum(budget.values()) * self.output_token_headroom
+        if total > self.max_output_tokens:
+            scale = self.max_output_tokens / total
+            budget = {section: int(tokens * scale) for section, tokens in budget.items()}
+        return budget
+
+    def _max_tokens(self, consultation_data: Dict, sections: Optional[Iterable[str]] = None) -> Optional[int]:
+        if not self.max_output_tokens:
+            return None
+        budget = self._output_budget(consultation_data, sections or self.section_prompts)
+        return min(self.max_output_tokens, math.ceil(sum(budget.values()) * self.output_token_headroom))
+
+    def _section_instructions(self, consultation_data: Dict, sections: Iterable[str]) -> str:
+        """Instructions of the requested sections, each with its length hint
+        and, in structured mode, the JSON key its items go under"""
+        sections = list(sections)
+        instructions = {section: self.section_prompts[section].text for section in sections}
+        if self.structured_output:
+            instructions = {section: f"[{event_key(section)}] {text}" for section, text in instructions.items()}
+        if not self.max_output_tokens:
+            return "\n\n".join(instructions.values())
+        budget = self._output_budget(consultation_data, sections)
+        return "\n\n".join(
+            f"{instructions[section]}\n{length_hint(budget[section])}" for section in sections
+        )
+
+    def _response_format(self) -> Dict:
+        """Request fields selecting Groq's JSON mode in structured mode
+        (LLM_STRUCTURED_OUTPUT), where the prompt asks for a JSON object shaped
+        like the sections dict. Answers that are not such JSON go through the
+        text parser instead."""
+        return {"response_format": {"type": "json_object"}} if self.structured_output else {}
+
+    def _stream_request(self, data: Dict) -> Dict:
+        # Groq's JSON mode does not stream; streamed structured answers rely on
+        # the prompt alone and are parsed once they finish
+        return {key: value for key, value in data.items() if key != "response_format"}
+
+    def _parse_response(self, response: str, condition_analysis: Optional[List[str]] = None) -> Dict:
+        if self.structured_output:
+            return parse_structured_response(response, condition_analysis)
+        return parse_consultation_response(response, condition_analysis)
+
+    def _new_parser(self, condition_analysis: Optional[List[str]] = None):
+        if self.structured_output:
+            return StructuredResponseParser(condition_analysis)
+        return ConsultationResponseParser(condition_analysis)
+
+    def _parse_section(self, response: str, section: str) -> List[str]:
+        with get_metrics().timed(PARSE):
+            if self.structured_output:
+                return parse_structured_section(response, section)
+            return parse_section_response(response, section)
+
+    def _timed_parse(self, response: str, consultation_data: Dict) -> Dict:
+        with get_metrics().timed(PARSE):
+            return self._parse_consultation_response(response, consultation_data)
+
+    def _compaction_savings(self, sections: List[str]) -> int:
+        templates = [self.prompt_template, PATIENT_PROFILE_TEMPLATE, DOSHA_TEMPLATE]
+        if self.structured_output:
+            templates.append(STRUCTURED_OUTPUT_TEMPLATE)
+        templates.extend(self.section_prompts[section] for section in sections)
+        return sum(template.saved_tokens for template in templates if template is not None)
+
+    def _get_cache_key(self, data: Dict) -> str:
+        return make_cache_key(
+            data["messages"][0]["content"], data["model"], data["temperature"], self.prompt_template_version
+        )
+
+    def _similarity_namespace(self) -> str:
+        # Completions are only interchangeable between identical prompt setups
+        return f"{self.model}:{self.prompt_template_version}:{int(self.structured_output)}"
+
+    def _cached(self, cache_key: str, consultation_data: Dict, sections: List[str]) -> Optional[str]:
+        """Completion from the exact cache or, for whole answers, a near-duplicate consultation's"""
+        content = self.cache.get(cache_key)
+        if content is None and self.similar_cache is not None and sections == list(self.section_prompts):
+            content = self.similar_cache.get(consultation_data, self._similarity_namespace())
+        return content
+
+    def _store(self, cache_key: str, consultation_data: Dict, sections: List[str], content: str):
+        self.cache.set(cache_key, content)
+        self._store_similar(consultation_data, sections, content)
+
+    async def _acached(self, cache_key: str, consultation_data: Dict, sections: List[str]) -> Optional[str]:
+        # The async path must not block the event loop on the cache's SQLite tier
+        content = await self.cache.aget(cache_key)
+        if content is None and self.similar_cache is not None and sections == list(self.section_prompts):
+            content = self.similar_cache.get(consultation_data, self._similarity_namespace())
+        return content
+
+    async def _astore(self, cache_key: str, consultation_data: Dict, sections: List[str], content: str):
+        await self.cache.aset(cache_key, content)
+        self._store_similar(consultation_data, sections, content)
+
+    def _store_similar(self, consultation_data: Dict, sections: List[str], content: str):
+        if self.similar_cache is not None and sections == list(self.section_prompts):
+            self.similar_cache.set(consultation_data, self._similarity_namespace(), content)
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        sync_stats = self.inflight.stats()
+        async_stats = self.async_inflight.stats()
+        return {key: sync_stats[key] + async_stats[key] for key in sync_stats}
+
+    # Completions cut off at max_tokens keep the sections they finished; the
+    # one they were cut off in is requested again with any they never reached.
+    # A truncated structured answer is requested again in full.
+
+    def _continuation(self, content: str, consultation_data: Dict, sections: List[str]):
+        """(text to keep, request for the sections still missing) of a truncated completion"""
+        get_prompt_stats().record_truncation()
+        # A cut-off JSON object has no usable head; structured answers are requested again in full
+        head, cut = split_truncated(content) if len(sections) > 1 and not self.structured_output else ("", None)
+        if cut not in sections:
+            head, cut = "", sections[0]
+        missing = sections[sections.index(cut):]
+        logger.warning(
+            f"{type(self).__name__} completion stopped at max_tokens in {cut}; requesting {', '.join(missing)} again"
+        )
+        data = self._build_request_data(consultation_data, missing)
+        if self.max_output_tokens:
+            data["max_tokens"] = self.max_output_tokens
+        return head, data
+
+    def _complete_truncated(self, content: str, consultation_data: Dict, sections: List[str]):
+        """(kept text, completion of the rest), or None if the rest could not be generated"""
+        try:
+            head, data = self._continuation(content, consultation_data, sections)
+            rest = self._call(data)
+        except Exception as e:
+            logger.error(f"Error completing truncated response in {type(self).__name__}: {str(e)}")
+            return None
+        return self._joined(head, rest)
+
+    def _joined(self, head: str, rest: Optional[str]):
+        if rest is None:
+            return None
+        if is_truncated(rest):
+            logger.warning(f"{type(self).__name__} completion of the missing sections also stopped at max_tokens")
+        return head, rest
+
+    async def _acomplete_truncated(self, content: str, consultation_data: Dict, sections: List[str]):
+        try:
+            head, data = self._continuation(content, consultation_data, sections)
+            rest = await self._acall(data)
+        except Exception as e:
+            logger.error(f"Error completing truncated response in {type(self).__name__}: {str(e)}")
+            return None
+        return self._joined(head, rest)
+
+    # Fan-out: with fan_out=True every section is requested with its own
+    # smaller prompt, all concurrently, and the answers are merged into the
+    # same sections dict, so latency follows the slowest section instead of
+    # the whole completion. Sections whose request fails take their items
+    # from the fallback, and the result is marked as a fallback.
+
+    def _merge_sections(self, consultation_data: Dict, contents: Dict[str, Optional[str]]) -> Dict:
+        """Combine per-section completions into the single-prompt result shape"""
+        if all(content is None for content in contents.values()):
+            return self._fallback(consultation_data, NO_COMPLETION)
+        result = self._parse_consultation_response("", consultation_data)
+        for section, content in contents.items():
+            section_items(result, section).extend(self._section_result(consultation_data, section, content))
+        if any(content is None for content in contents.values()):
+            get_metrics().count_fallback("section_failed")
+            mark_fallback(result)
+        return result
+
+    def _section_result(self, consultation_data: Dict, section: str, content: Optional[str]) -> List[str]:
+        if content is None:
+            return list(section_items(self._get_fallback(consultation_data), section))
+        return self._parse_section(content, section)
+
+    # Sync path
+
+    def _generate(self, consultation_data: Dict, fan_out: bool = False) -> Dict:
+        if fan_out:
+            return self._generate_fan_out(consultation_data)
+        try:
+            check_deadline("prompt building")
+            data = self._build_request_data(consultation_data)
+            content = self._completion(data, consultation_data, list(self.section_prompts))
+            if content is None:
+                return self._fallback(consultation_data, NO_COMPLETION)
+            check_deadline("parsing")
+            return self._timed_parse(content, consultation_data)
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            return self._fallback(consultation_data, _error_cause(e))
+
+    def _completion(self, data: Dict, consultation_data: Dict, sections: List[str]) -> Optional[str]:
+        cache_key = self._get_cache_key(data)
+        content = self._cached(cache_key, consultation_data, sections)
+        if content is None:
+            content = self.inflight.do(
+                cache_key, lambda: self._request_completion(data, cache_key, consultation_data, sections),
+                timeout=_wait_timeout()
+            )
+        return content
+
+    def _section_completion(self, consultation_data: Dict, section: str) -> Optional[str]:
+        try:
+            return self._completion(
+                self._build_request_data(consultation_data, [section]), consultation_data, [section]
+            )
+        except Exception as e:
+            logger.error(f"Error generating {section} in {type(self).__name__}: {str(e)}")
+            return None
+
+    def _generate_fan_out(self, consultation_data: Dict) -> Dict:
+        try:
+            sections = list(self.section_prompts)
+            # Worker threads inherit the caller's session for scheduler fairness
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+                contents = executor.map(
+                    lambda section: context.copy().run(self._section_completion, consultation_data, section),
+                    sections
+                )
+                return self._merge_sections(consultation_data, dict(zip(sections, contents)))
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            return self._fallback(consultation_data, _error_cause(e))
+
+    def _submit(self, data: Dict):
+        # Every upstream call takes a turn from the shared LLMScheduler at this
+        # service's priority; streams report their queue position meanwhile
+        return self.scheduler.submit(self.priority, estimate_request_tokens(data), current_session.get())
+
+    def _check_circuit(self):
+        # Checked before queueing so an open circuit does not cost a scheduler turn
+        if self.llm_client.breaker.is_open():
+            raise CircuitOpenError("LLM API circuit is open; serving fallback")
+
+    def _call_timeout(self) -> float:
+        # The route's deadline (see deadline.py) also bounds the queue wait and
+        # the wait for a coalesced call
+        return call_timeout(self.llm_client.timeout, "the LLM call")
+
+    def _request_completion(self, data: Dict, cache_key: str, consultation_data: Dict,
+                            sections: List[str]) -> Optional[str]:
+        content = self._call(data)
+        if is_truncated(content):
+            completed = self._complete_truncated(content, consultation_data, sections)
+            if completed is None:
+                # Parse what arrived, but do not cache an incomplete answer
+                return content
+            content = "".join(completed)
+        if content is not None:
+            self._store(cache_key, consultation_data, sections, content)
+        return content
+
+    def _call(self, data: Dict) -> Optional[str]:
+        self._check_circuit()
+        logger.info(f"Sending request to Groq API with prompt length: {len(data['messages'][0]['content'])}")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.scheduler.acquire(self.priority, estimate_request_tokens(data), current_session.get())
+            try:
+                return self.llm_client.complete(data, self._call_timeout())
+            except LLMRateLimitError as e:
+                self.scheduler.pause(e.retry_after)
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+
+    def _stream(self, consultation_data: Dict, fan_out: bool = False) -> Iterator[SectionEvent]:
+        if fan_out:
+            yield from self._stream_fan_out(consultation_data)
+            return
+        try:
+            check_deadline("prompt building")
+            data = self._build_request_data(consultation_data)
+            cache_key = self._get_cache_key(data)
+            content = self._cached(cache_key, consultation_data, list(self.section_prompts))
+            if content is None:
+                yield from self._instant_events(consultation_data)
+                call, leader = self.inflight.claim(cache_key)
+                if leader:
+                    stream = _CompletionStream(self, consultation_data)
+                    try:
+                        yield from self._stream_completion(data, cache_key, consultation_data, stream)
+                    except BaseException as e:
+                        self.inflight.resolve(cache_key, call, error=e)
+                        raise
+                    # Followers get the result before the consumer sees the last events
+                    self.inflight.resolve(cache_key, call, stream.content)
+                    yield from stream.closing
+                    return
+                # An identical request is already streaming; replay its result
+                content = self.inflight.wait(call, _wait_timeout())
+            if content is None:
+                yield from section_events(self._fallback(consultation_data, NO_COMPLETION))
+                return
+            check_deadline("parsing")
+            yield from section_events(self._timed_parse(content, consultation_data))
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            yield from section_events(self._fallback(consultation_data, _error_cause(e)))
+
+    def _stream_completion(self, data: Dict, cache_key: str, consultation_data: Dict,
+                           stream: "_CompletionStream") -> Iterator[SectionEvent]:
+        """Stream one completion into `stream`, yielding queue and section events; caches it if complete"""
+        self._check_circuit()
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            for status in self.scheduler.wait_turn(self._submit(data)):
+                yield QUEUE_EVENT, status
+            try:
+                for delta in self.llm_client.stream_chat(self._stream_request(data), self._call_timeout()):
+                    yield from stream.feed(delta)
+                break
+            except Exception as e:
+                if not stream.failed(e, attempt):
+                    return
+        completed = None
+        if stream.truncated:
+            completed = self._complete_truncated(stream.text, consultation_data, list(self.section_prompts))
+        yield from stream.finish(completed)
+        if stream.content is not None:
+            self._store(cache_key, consultation_data, list(self.section_prompts), stream.content)
+
+    def _stream_fan_out(self, consultation_data: Dict) -> Iterator[SectionEvent]:
+        """Yield each section as soon as its own request finishes, in completion order"""
+        try:
+            contents = {}
+            yield from self._instant_events(consultation_data)
+            result = self._parse_consultation_response("", consultation_data)
+            yield from _known_sections(result)
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=len(self.section_prompts)) as executor:
+                futures = {
+                    executor.submit(context.copy().run, self._section_completion, consultation_data, section): section
+                    for section in self.section_prompts
+                }
+                for future in as_completed(futures):
+                    section = futures[future]
+                    contents[section] = future.result()
+                    items = self._section_result(consultation_data, section, contents[section])
+                    if items:
+                        yield event_key(section), items
+            yield None, self._merge_sections(consultation_data, contents)
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            yield from section_events(self._fallback(consultation_data, _error_cause(e)))
+
+    # Async path
+
+    async def _agenerate(self, consultation_data: Dict, fan_out: bool = False) -> Dict:
+        if fan_out:
+            return await self._agenerate_fan_out(consultation_data)
+        try:
+            check_deadline("prompt building")
+            data = self._build_request_data(consultation_data)
+            content = await self._acompletion(data, consultation_data, list(self.section_prompts))
+            if content is None:
+                return self._fallback(consultation_data, NO_COMPLETION)
+            check_deadline("parsing")
+            return self._timed_parse(content, consultation_data)
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            return self._fallback(consultation_data, _error_cause(e))
+
+    async def _acompletion(self, data: Dict, consultation_data: Dict, sections: List[str]) -> Optional[str]:
+        cache_key = self._get_cache_key(data)
+        content = await self._acached(cache_key, consultation_data, sections)
+        if content is None:
+            content = await self.async_inflight.do(
+                cache_key, lambda: self._arequest_completion(data, cache_key, consultation_data, sections),
+                timeout=_wait_timeout()
+            )
+        return content
+
+    async def _asection_completion(self, consultation_data: Dict, section: str) -> Optional[str]:
+        try:
+            return await self._acompletion(
+                self._build_request_data(consultation_data, [section]), consultation_data, [section]
+            )
+        except Exception as e:
+            logger.error(f"Error generating {section} in {type(self).__name__}: {str(e)}")
+            return None
+
+    async def _agenerate_fan_out(self, consultation_data: Dict) -> Dict:
+        try:
+            sections = list(self.section_prompts)
+            contents = await asyncio.gather(
+                *(self._asection_completion(consultation_data, section) for section in sections)
+            )
+            return self._merge_sections(consultation_data, dict(zip(sections, contents)))
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            return self._fallback(consultation_data, _error_cause(e))
+
+    async def _arequest_completion(self, data: Dict, cache_key: str, consultation_data: Dict,
+                                   sections: List[str]) -> Optional[str]:
+        content = await self._acall(data)
+        if is_truncated(content):
+            completed = await self._acomplete_truncated(content, consultation_data, sections)
+            if completed is None:
+                return content
+            content = "".join(completed)
+        if content is not None:
+            await self._astore(cache_key, consultation_data, sections, content)
+        return content
+
+    async def _acall(self, data: Dict) -> Optional[str]:
+        self._check_circuit()
+        logger.info(f"Sending request to Groq API with prompt length: {len(data['messages'][0]['content'])}")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            await self.scheduler.aacquire(self.priority, estimate_request_tokens(data), current_session.get())
+            try:
+                return await self.llm_client.acomplete(data, self._call_timeout())
+            except LLMRateLimitError as e:
+                self.scheduler.pause(e.retry_after)
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+
+    async def _astream(self, consultation_data: Dict, fan_out: bool = False) -> AsyncIterator[SectionEvent]:
+        if fan_out:
+            async for event in self._astream_fan_out(consultation_data):
+                yield event
+            return
+        try:
+            check_deadline("prompt building")
+            data = self._build_request_data(consultation_data)
+            cache_key = self._get_cache_key(data)
+            content = await self._acached(cache_key, consultation_data, list(self.section_prompts))
+            if content is None:
+                for event in self._instant_events(consultation_data):
+                    yield event
+                call, leader = self.async_inflight.claim(cache_key)
+                if leader:
+                    stream = _CompletionStream(self, consultation_data)
+                    try:
+                        async for event in self._astream_completion(data, cache_key, consultation_data, stream):
+                            yield event
+                    except BaseException as e:
+                        self.async_inflight.resolve(cache_key, call, error=e)
+                        raise
+                    self.async_inflight.resolve(cache_key, call, stream.content)
+                    for event in stream.closing:
+                        yield event
+                    return
+                # An identical request is already streaming; replay its result
+                content = await self.async_inflight.wait(call, _wait_timeout())
+            if content is None:
+                for event in section_events(self._fallback(consultation_data, NO_COMPLETION)):
+                    yield event
+                return
+            check_deadline("parsing")
+            for event in section_events(self._timed_parse(content, consultation_data)):
+                yield event
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            for event in section_events(self._fallback(consultation_data, _error_cause(e))):
+                yield event
+
+    async def _astream_completion(self, data: Dict, cache_key: str, consultation_data: Dict,
+                                  stream: "_CompletionStream") -> AsyncIterator[SectionEvent]:
+        """Async counterpart of _stream_completion"""
+        self._check_circuit()
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            async for status in self.scheduler.await_turn(self._submit(data)):
+                yield QUEUE_EVENT, status
+            try:
+                async for delta in self.llm_client.astream_chat(self._stream_request(data), self._call_timeout()):
+                    for event in stream.feed(delta):
+                        yield event
+                break
+            except Exception as e:
+                if not stream.failed(e, attempt):
+                    return
+        completed = None
+        if stream.truncated:
+            completed = await self._acomplete_truncated(stream.text, consultation_data, list(self.section_prompts))
+        for event in stream.finish(completed):
+            yield event
+        if stream.content is not None:
+            await self._astore(cache_key, consultation_data, list(self.section_prompts), stream.content)
+
+    async def _astream_fan_out(self, consultation_data: Dict) -> AsyncIterator[SectionEvent]:
+        async def generate(section: str):
+            return section, await self._asection_completion(consultation_data, section)
+
+        tasks = []
+        try:
+            contents = {}
+            for event in self._instant_events(consultation_data):
+                yield event
+            result = self._parse_consultation_response("", consultation_data)
+            for event in _known_sections(result):
+                yield event
+            tasks = [asyncio.ensure_future(generate(section)) for section in self.section_prompts]
+            for next_done in asyncio.as_completed(tasks):
+                section, contents[section] = await next_done
+                items = self._section_result(consultation_data, section, contents[section])
+                if items:
+                    yield event_key(section), items
+            yield None, self._merge_sections(consultation_data, contents)
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e) or type(e).__name__}")
+            for event in section_events(self._fallback(consultation_data, _error_cause(e))):
+                yield event
+        finally:
+            # A consumer that stops early must not leave section requests running
+            for task in tasks:
+                task.cancel()
+
+
+def _wait_timeout() -> Optional[float]:
+    # How long a coalesced waiter may wait for the leader's result
+    left = remaining()
+    return None if left is None else max(0.0, left)
+
+
+def _known_sections(result: Dict) -> Iterator[SectionEvent]:
+    # Sections available before any completion arrives, e.g. the local condition analysis
+    for key, items in section_events(result):
+        if key is not None:
+            yield key, items
+
+
+def _partial(events: Iterable[SectionEvent]) -> Iterator[SectionEvent]:
+    # An interrupted stream's final result is incomplete; keep it out of caches
+    for key, items in events:
+        if key is None:
+            get_metrics().count_fallback("stream_interrupted")
+            mark_fallback(items)
+        yield key, items
+
+
+def _error_cause(error: BaseException) -> str:
+    for error_type, cause in FALLBACK_CAUSES:
+        if isinstance(error, error_type):
+            return cause
+    # Transport failures of requests/httpx; the client counts them in more detail
+    if type(error).__module__.split(".")[0] in ("requests", "httpx", "urllib3"):
+        return "timeout" if "Timeout" in type(error).__name__ else "transport"
+    return "error"
+
+
+class _CompletionStream:
+    """Leader side of one streamed completion, shared by the sync and async
+    streaming paths so that they differ only in how they wait and read.
+
+    Deltas go through the section parser as they arrive. Once the stream
+    has ended, `content` is the full completion (None if it was cut short)
+    and `closing` holds the last events, ending with (None, result).
+    """
+
+    def __init__(self, service: LLMService, consultation_data: Dict):
+        self.service = service
+        self.parser = _TimedParser(service._create_parser(consultation_data))
+        self.chunks: List[str] = []
+        self.truncated = False
+        self.content: Optional[str] = None
+        self.closing: List[SectionEvent] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, delta: str) -> List[SectionEvent]:
+        check_deadline("the stream finished")
+        self.truncated = is_truncated(delta)
+        self.chunks.append(delta)
+        return self.parser.feed(delta)
+
+    def failed(self, error: Exception, attempt: int) -> bool:
+        """After a failed attempt: True to stream again, False to end with the
+        sections already shown. Errors before any content propagate."""
+        if isinstance(error, LLMRateLimitError):
+            # 429 arrives before any content, so the stream can simply restart
+            self.service.scheduler.pause(error.retry_after)
+            if attempt == RATE_LIMIT_RETRIES:
+                raise error
+            return True
+        if not self.chunks:
+            raise error
+        logger.error(f"Stream interrupted in {type(self.service).__name__}: {str(error) or type(error).__name__}")
+        self._cut_short()
+        return False
+
+    def finish(self, completed: Optional[Tuple[str, str]] = None) -> List[SectionEvent]:
+        """End a stream that ran to its end. A truncated one needs `completed`,
+        the (kept text, rest) from _complete_truncated; returns the events of the rest."""
+        events = []
+        if not self.truncated:
+            self.content = self.text
+        elif completed is None:
+            self._cut_short()
+            return events
+        else:
+            head, rest = completed
+            self.parser.restart_section()
+            events = self.parser.feed("\n" + rest)
+            self.content = head + rest
+        self.closing = self.parser.close()
+        return events
+
+    def _cut_short(self):
+        # Sections already shown stay; finish with them instead of the fallback
+        self.closing = list(_partial(self.parser.close()))
+
+
+class _TimedParser:
+    """Stream parser that adds the time spent in it to the parse stage once closed"""
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._seconds = 0.0
+
+    def feed(self, chunk: str) -> List[SectionEvent]:
+        start = time.perf_counter()
+        try:
+            return self._parser.feed(chunk)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def restart_section(self):
+        self._parser.restart_section()
+
+    def close(self) -> List[SectionEvent]:
+        start = time.perf_counter()
+        try:
+            return self._parser.close()
+        finally:
+            get_metrics().observe(PARSE, self._seconds + time.perf_counter() - start)
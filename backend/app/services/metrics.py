@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect
+import itertools
+import threading
+import time
+
+# Stages of a request, in the order they happen. connect, ttfb and
+# generation split each upstream call: opening a connection (0 when a
+# pooled one is reused), waiting for the response headers, and receiving
+# the body or stream. render is the Streamlit app drawing the result.
+PROMPT_BUILD = "prompt_build"
+QUEUE_WAIT = "queue_wait"
+CONNECT = "connect"
+TTFB = "ttfb"
+GENERATION = "generation"
+PARSE = "parse"
+RENDER = "render"
+STAGES = (PROMPT_BUILD, QUEUE_WAIT, CONNECT, TTFB, GENERATION, PARSE, RENDER)
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# Route the current request is served for; set by the route functions next
+# to the session and deadline, and inherited by everything below them
+current_route: ContextVar[str] = ContextVar("metrics_route", default="other")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination, as Prometheus expects"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Per label combination: observations per bucket (the last one for
+        # +Inf, not cumulative) and their sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(label_values)
+            if counts is None:
+                counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[label_values] = self._sums.get(label_values, 0.0) + value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        """Per label combination: cumulative bucket counts (ending with +Inf) and the sum"""
+        with self._lock:
+            series = {labels: (list(counts), self._sums[labels]) for labels, counts in self._counts.items()}
+        return {labels: (list(itertools.accumulate(counts)), total) for labels, (counts, total) in series.items()}
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (buckets, total) in sorted(self.snapshot().items()):
+            bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, buckets):
+                labels = _labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {buckets[-1]}")
+        return lines
+
+
+class Metrics:
+    """Stage latencies, token usage, fallbacks and upstream errors of this process.
+
+    Everything is labelled with the route from `current_route` unless one
+    is given. `exposition()` renders the Prometheus text format served by
+    the backend's /metrics and the app's diagnostics page.
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "llm_stage_seconds", "Time spent in each stage of an LLM-backed request", ("route", "stage"),
+            SECONDS_BUCKETS
+        )
+        self.tokens = Histogram(
+            "llm_tokens", "Tokens per upstream call, from the usage the API reports", ("route", "kind"), TOKEN_BUCKETS
+        )
+        self.fallbacks = Counter("llm_fallbacks_total", "Results served from the fallback, by cause", ("route", "cause"))
+        self.errors = Counter("llm_errors_total", "Failed upstream calls, by cause", ("route", "cause"))
+
+    def observe(self, stage: str, seconds: float, route: Optional[str] = None):
+        self.stage_seconds.observe(max(0.0, seconds), route or current_route.get(), stage)
+
+    @contextmanager
+    def timed(self, stage: str, route: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, route)
+
+    def record_usage(self, usage: Optional[Dict], route: Optional[str] = None):
+        """Prompt and completion tokens of one call, from the API response's `usage`"""
+        if not usage:
+            return
+        route = route or current_route.get()
+        for kind in ("prompt", "completion"):
+            tokens = usage.get(f"{kind}_tokens")
+            if isinstance(tokens, (int, float)):
+                self.tokens.observe(tokens, route, kind)
+
+    def count_fallback(self, cause: str, route: Optional[str] = None):
+        self.fallbacks.inc(route or current_route.get(), cause)
+
+    def count_error(self, cause: str, route: Optional[str] = None):
+        self.errors.inc(route or current_route.get(), cause)
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in (self.stage_seconds, self.tokens, self.fallbacks, self.errors):
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Process-wide metrics shared by the services, the backend and the app"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
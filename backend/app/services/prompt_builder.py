@@ -0,0 +1,327 @@
+from typing import Dict, Iterable, Tuple
+import copy
+import re
+import threading
+from collections import Counter
+
+# Prompt templates are written as indented triple-quoted strings in the
+# service classes. PromptTemplate compacts them once, when the class is
+# defined, and the services fit oversized free text into the input token
+# budget (LLM_INPUT_TOKEN_BUDGET) before formatting.
+
+# Roughly how Llama-style BPE tokenizers split English: a token per short word
+# or punctuation mark, longer words in ~4 character pieces, a token per line
+# break and another for the indentation that follows it
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]|\s*\n\s*| {2,}")
+# Sentences end at ., ! or ? followed by whitespace, so "key.py" or "2.5" stay whole
+_SENTENCE_PATTERN = re.compile(r"(?:[^.!?\n]|[.!?]+(?=[^\s.!?]))+(?:[.!?]+|$)", re.MULTILINE)
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be been but by can do for from had has have i if in into is it its my me of on or our "
+    "so than that the their them then there they this to too was we were what when which while will with you your "
+    "also very just more most some any all not no have has been after before about".split()
+)
+
+# Free-text fields of a consultation that the input budget may trim, in the
+# order their share of the budget is settled
+FREE_TEXT_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("medical_history", "medications"),
+    ("concerns", "previous_treatments"),
+    ("concerns", "primary_concerns"),
+)
+# Each trimmed field keeps at least this many tokens
+MIN_FIELD_TOKENS = 32
+
+# Output tokens a section needs for a patient with no listed conditions or
+# concerns, and how many more each condition or concern adds
+SECTION_OUTPUT_TOKENS: Dict[str, Tuple[int, int]] = {
+    "condition_analysis": (90, 30),
+    "dosha_impact": (90, 15),
+    "dietary": (140, 20),
+    "lifestyle": (120, 15),
+    "exercise": (110, 10),
+    "herbal": (140, 25),
+    "therapeutic": (110, 15),
+    "warnings": (90, 25),
+}
+# Conditions plus concerns beyond this do not grow the output budget further
+MAX_OUTPUT_FACTORS = 6
+# Concerns are counted as the clauses of primary_concerns
+_CONCERN_PATTERN = re.compile(r"[^,;.!?\n]*[a-zA-Z][^,;.!?\n]*")
+LENGTH_HINT = "- Keep this section to about {words} words"
+
+
+def compact_prompt(text: str) -> str:
+    """Strip every line and collapse runs of blank lines into one"""
+    lines = []
+    for line in text.strip().splitlines():
+        line = line.strip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def estimate_tokens(text: str) -> int:
+    """Local approximation of the model's token count, within ~15% for English prose"""
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        if piece[0].isalnum() or piece[0] == "_":
+            tokens += (len(piece) + 3) // 4
+        elif "\n" in piece and piece.endswith("  "):
+            tokens += 2
+        else:
+            tokens += 1
+    return tokens
+
+
+def trim_text(text: str, max_tokens: int) -> str:
+    """Shorten text to about max_tokens by keeping its most informative sentences.
+
+    Repeated sentences are dropped first. The rest are scored by how often
+    their content words occur in the whole text, with a bonus for the
+    opening sentence, and kept greedily in their original order.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    sentences, seen = [], set()
+    for match in _SENTENCE_PATTERN.finditer(text):
+        sentence = match.group().strip()
+        normalized = " ".join(_WORD_PATTERN.findall(sentence.lower()))
+        if sentence and normalized not in seen:
+            seen.add(normalized)
+            sentences.append((sentence, normalized.split()))
+
+    frequencies = Counter(word for _, words in sentences for word in set(words) if word not in _STOPWORDS)
+    scored = []
+    for index, (sentence, words) in enumerate(sentences):
+        content = [word for word in words if word not in _STOPWORDS]
+        score = sum(frequencies[word] for word in set(content)) / (len(content) ** 0.5 or 1)
+        scored.append((score * (1.5 if index == 0 else 1.0), index, sentence, estimate_tokens(sentence)))
+
+    kept, budget = [], max_tokens
+    for _, index, sentence, tokens in sorted(scored, key=lambda item: (-item[0], item[1])):
+        if tokens <= budget:
+            kept.append((index, sentence))
+            budget -= tokens
+    if not kept:
+        # Not even the best sentence fits; cut it at a word boundary
+        _, _, sentence, _ = max(scored, key=lambda item: (item[0], -item[1]))
+        words = sentence.split()
+        while words and estimate_tokens(" ".join(words)) > max_tokens - 1:
+            words = words[:max(1, len(words) * 3 // 4)] if len(words) > 1 else []
+        return " ".join(words) + " …"
+    return " ".join(sentence for _, sentence in sorted(kept))
+
+
+def fit_free_text(data: Dict, excess_tokens: int) -> Tuple[Dict, int]:
+    """Copy of the consultation with its free-text fields trimmed by about
+    excess_tokens in total, and the number of tokens actually removed.
+
+    The remaining allowance is shared out evenly; fields shorter than their
+    share keep all of it and leave the rest to the longer ones.
+    """
+    fields = []
+    for section, field in FREE_TEXT_FIELDS:
+        value = (data.get(section) or {}).get(field)
+        if isinstance(value, str) and value:
+            fields.append((section, field, value, estimate_tokens(value)))
+    total = sum(tokens for *_, tokens in fields)
+    allowance = max(total - excess_tokens, MIN_FIELD_TOKENS * len(fields))
+    if not fields or allowance >= total:
+        return data, 0
+
+    trimmed = copy.deepcopy(data)
+    saved = 0
+    remaining = list(sorted(fields, key=lambda item: item[3]))
+    while remaining:
+        section, field, value, tokens = remaining.pop(0)
+        share = max(MIN_FIELD_TOKENS, allowance // (len(remaining) + 1))
+        if tokens > share:
+            value = trim_text(value, share)
+            trimmed[section][field] = value
+        used = estimate_tokens(value)
+        saved += tokens - used
+        allowance -= used
+    return trimmed, saved
+
+
+def output_budget(data: Dict, sections: Iterable[str]) -> Dict[str, int]:
+    """Expected output tokens of each requested section for this consultation"""
+    conditions = [
+        condition for condition in (data.get("medical_history") or {}).get("conditions") or []
+        if condition != "None"
+    ]
+    concerns = (data.get("concerns") or {}).get("primary_concerns")
+    concern_count = len(_CONCERN_PATTERN.findall(concerns)) if isinstance(concerns, str) else 0
+    factors = min(len(conditions) + concern_count, MAX_OUTPUT_FACTORS)
+    budget = {}
+    for section in sections:
+        base, per_factor = SECTION_OUTPUT_TOKENS[section]
+        budget[section] = base + per_factor * factors
+    return budget
+
+
+def length_hint(tokens: int) -> str:
+    # About 0.75 English words per token, rounded so small changes keep the prompt (and cache key) stable
+    return LENGTH_HINT.format(words=max(20, round(tokens * 0.75 / 10) * 10))
+
+
+class PromptTemplate:
+    """str.format template compacted once, when it is defined.
+
+    `saved_tokens` is what the compaction saves on every prompt built from it.
+    """
+
+    def __init__(self, text: str):
+        self.text = compact_prompt(text)
+        self.saved_tokens = estimate_tokens(text) - estimate_tokens(self.text)
+
+    def format(self, **values) -> str:
+        return self.text.format(**values)
+
+
+class PromptStats:
+    """Input tokens of the prompts built, how many compaction and trimming
+    saved, how many completions ran into max_tokens and how many structured
+    answers parsed as JSON or fell back to the text parser"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            "prompts": 0, "tokens": 0, "saved_by_compaction": 0, "saved_by_trimming": 0, "trimmed": 0,
+            "truncated_completions": 0, "structured_parsed": 0, "structured_fallbacks": 0
+        }
+
+    def record(self, tokens: int, saved_by_compaction: int, saved_by_trimming: int):
+        with self._lock:
+            self._counts["prompts"] += 1
+            self._counts["tokens"] += tokens
+            self._counts["saved_by_compaction"] += saved_by_compaction
+            self._counts["saved_by_trimming"] += saved_by_trimming
+            self._counts["trimmed"] += 1 if saved_by_trimming else 0
+
+    def record_truncation(self):
+        with self._lock:
+            self._counts["truncated_completions"] += 1
+
+    def record_structured(self, parsed: bool):
+        with self._lock:
+            self._counts["structured_parsed" if parsed else "structured_fallbacks"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        prompts = counts["prompts"] or 1
+        saved = counts["saved_by_compaction"] + counts["saved_by_trimming"]
+        counts["tokens_per_prompt"] = round(counts["tokens"] / prompts, 1)
+        counts["saved_per_prompt"] = round(saved / prompts, 1)
+        counts["saved_ratio"] = round(saved / ((counts["tokens"] + saved) or 1), 3)
+        return counts
+
+
+# Patient sections shared by the consultation and recommendation prompts
+
+PATIENT_PROFILE_TEMPLATE = PromptTemplate("""
+        {dosha_info}
+
+        Personal Information:
+        - Age: {age}
+        - Gender: {gender}
+        - BMI: {bmi} (Weight: {weight}kg, Height: {height}cm)
+
+        Medical Conditions and Ayurvedic Context:
+        {conditions_info}
+
+        Current Medications:
+        {medications}
+
+        Lifestyle Factors:
+        - Diet: {diet_type}
+        - Physical Activity: {physical_activity}
+        - Sleep: {sleep_hours} hours
+        - Stress Level: {stress_level}
+
+        Primary Health Concerns:
+        {primary_concerns}
+
+        Previous Treatments:
+        {previous_treatments}""")
+
+DOSHA_TEMPLATE = PromptTemplate("""
+        Dosha Profile:
+        Primary Dosha: {primary}
+        Secondary Dosha: {secondary}
+        Dosha Distribution:
+        - Vata: {vata:.1f}%
+        - Pitta: {pitta:.1f}%
+        - Kapha: {kapha:.1f}%""")
+
+MISSING_DOSHA_TEMPLATE = PromptTemplate("""
+        Dosha Profile: Not Available
+        Note: Recommendations will be based on current symptoms and conditions.
+        Please complete a dosha analysis for more personalized recommendations.""")
+
+
+# Instructions for each generated section, in prompt order. Single-prompt
+# mode asks for all of them at once; fan-out mode sends one per request.
+SECTION_PROMPTS = {
+    "condition_analysis": PromptTemplate("""CONDITION OVERVIEW:
+        - Explain how their current conditions relate to their dosha type
+        - Describe specific imbalances that need addressing
+        - Identify key areas for improvement"""),
+    "dosha_impact": PromptTemplate("""DOSHA IMPACT:
+        - Explain how their current dosha state affects their health
+        - Describe specific dosha-related symptoms to watch for
+        - Suggest dosha-balancing priorities"""),
+    "dietary": PromptTemplate("""DIETARY RECOMMENDATIONS:
+        - Specific foods to include or avoid
+        - Best times and ways to consume
+        - Quantity guidelines when applicable
+        - Special preparations or combinations"""),
+    "lifestyle": PromptTemplate("""LIFESTYLE MODIFICATIONS:
+        - Specific daily routine adjustments
+        - Best times for activities
+        - Duration and frequency
+        - Practical implementation tips"""),
+    "exercise": PromptTemplate("""EXERCISE RECOMMENDATIONS:
+        - Specific types of exercise
+        - Intensity levels
+        - Duration and frequency
+        - Best times to practice
+        - Precautions or modifications"""),
+    "herbal": PromptTemplate("""HERBAL REMEDIES:
+        - Specific herb or formulation
+        - Dosage and timing
+        - Method of preparation
+        - Duration of use
+        - Specific benefits"""),
+    "therapeutic": PromptTemplate("""THERAPEUTIC TREATMENTS:
+        - Specific therapy name
+        - Frequency and duration
+        - Expected benefits
+        - Any preparations needed
+        - Precautions"""),
+    "warnings": PromptTemplate("""WARNINGS AND PRECAUTIONS:
+        - List specific contraindications
+        - Interactions with medications
+        - Signs to watch for
+        - When to seek additional help"""),
+}
+
+
+# Appended to prompts in structured mode (LLM_STRUCTURED_OUTPUT); {shape} is
+# the JSON skeleton of the requested sections
+STRUCTURED_OUTPUT_TEMPLATE = PromptTemplate("""
+        Answer with one JSON object and nothing else, shaped like:
+        {shape}
+        Put the recommendations for each heading above in the list under the key shown in brackets before it, one complete recommendation per string, without bullets or numbering.""")
+
+
+_prompt_stats = PromptStats()
+
+
+def get_prompt_stats() -> PromptStats:
+    return _prompt_stats
+
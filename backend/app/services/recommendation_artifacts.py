@@ -0,0 +1,127 @@
+from typing import Dict, Iterator, Optional
+import copy
+import json
+import logging
+from pathlib import Path
+from ..config import get_artifact_path
+
+logger = logging.getLogger(__name__)
+
+# Bump when the artifact layout changes
+ARTIFACT_VERSION = 1
+DEFAULT_BUCKET_SIZE = 10
+DOSHAS = ("vata", "pitta", "kapha")
+
+
+def quantize_percentages(profile: Dict, bucket_size: int = DEFAULT_BUCKET_SIZE) -> Dict[str, int]:
+    """Round dosha percentages to bucket_size steps that still sum to 100"""
+    values = [float(profile.get(f"{dosha}_percentage", 0) or 0) for dosha in DOSHAS]
+    total = sum(values) or 1.0
+    units = 100 // bucket_size
+    scaled = [value / total * units for value in values]
+    floors = [int(value) for value in scaled]
+    # Largest remainder; ties go to the earlier dosha like DoshaAnalyzer
+    order = sorted(range(len(DOSHAS)), key=lambda i: scaled[i] - floors[i], reverse=True)
+    for i in order[:units - sum(floors)]:
+        floors[i] += 1
+    return {dosha: count * bucket_size for dosha, count in zip(DOSHAS, floors)}
+
+
+def bucket_profile(profile: Dict, bucket_size: int = DEFAULT_BUCKET_SIZE) -> Dict:
+    """Dosha profile for the bucket containing `profile`"""
+    return _profile_from_percentages(quantize_percentages(profile, bucket_size))
+
+
+def bucket_key(profile: Dict, bucket_size: int = DEFAULT_BUCKET_SIZE) -> str:
+    percentages = quantize_percentages(profile, bucket_size)
+    return "-".join(f"{dosha[0]}{percentages[dosha]}" for dosha in DOSHAS)
+
+
+def iter_bucket_profiles(bucket_size: int = DEFAULT_BUCKET_SIZE) -> Iterator[Dict]:
+    """Every bucket in the grid; the three pure doshas are the 100/0/0 corners"""
+    units = 100 // bucket_size
+    for vata in range(units, -1, -1):
+        for pitta in range(units - vata, -1, -1):
+            kapha = units - vata - pitta
+            yield _profile_from_percentages({
+                "vata": vata * bucket_size,
+                "pitta": pitta * bucket_size,
+                "kapha": kapha * bucket_size
+            })
+
+
+def _profile_from_percentages(percentages: Dict[str, int]) -> Dict:
+    ranked = sorted(percentages.items(), key=lambda x: x[1], reverse=True)
+    return {
+        "primary_dosha": ranked[0][0],
+        "secondary_dosha": ranked[1][0] if ranked[1][1] > 25 else None,
+        "vata_percentage": percentages["vata"],
+        "pitta_percentage": percentages["pitta"],
+        "kapha_percentage": percentages["kapha"]
+    }
+
+
+class RecommendationArtifactStore:
+    """Pre-generated recommendations for dosha-only requests, served from memory.
+
+    The artifact is built offline by scripts/build_recommendation_artifacts.py.
+    It is ignored when its version, prompt template version or model no
+    longer matches, so a stale file degrades to live LLM calls instead of
+    serving outdated text.
+    """
+
+    def __init__(self, path: Optional[Path] = None, prompt_template_version: Optional[int] = None,
+                 model: Optional[str] = None):
+        self.path = Path(path) if path else get_artifact_path()
+        self.prompt_template_version = prompt_template_version
+        self.model = model
+        self.bucket_size = DEFAULT_BUCKET_SIZE
+        self.entries: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not self.path.exists():
+            logger.info(f"No recommendation artifact at {self.path}; dosha recommendations will use the LLM")
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                artifact = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading recommendation artifact: {str(e)}")
+            return
+
+        if artifact.get("version") != ARTIFACT_VERSION:
+            logger.warning(f"Ignoring recommendation artifact with version {artifact.get('version')}")
+            return
+        if (self.prompt_template_version is not None
+                and artifact.get("prompt_template_version") != self.prompt_template_version):
+            logger.warning("Ignoring recommendation artifact built for a different prompt template")
+            return
+        if self.model is not None and artifact.get("model") != self.model:
+            logger.warning(f"Ignoring recommendation artifact built with model {artifact.get('model')}, not {self.model}")
+            return
+
+        self.bucket_size = artifact.get("bucket_size", DEFAULT_BUCKET_SIZE)
+        self.entries = artifact.get("entries", {})
+        logger.info(f"Loaded {len(self.entries)} pre-generated recommendation buckets")
+
+    def get(self, profile: Dict) -> Optional[Dict]:
+        entry = self.entries.get(bucket_key(profile, self.bucket_size))
+        return copy.deepcopy(entry) if entry is not None else None
+
+
+def write_artifact(path: Path, entries: Dict[str, Dict], bucket_size: int, prompt_template_version: int, model: str):
+    artifact = {
+        "version": ARTIFACT_VERSION,
+        "prompt_template_version": prompt_template_version,
+        "bucket_size": bucket_size,
+        "model": model,
+        "entries": entries
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=1, sort_keys=True)
+    tmp_path.replace(path)
@@ -0,0 +1,262 @@
+from typing import Dict, Optional
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from ..config import get_cache_settings
+
+logger = logging.getLogger(__name__)
+
+# Every this many writes to the SQLite tier, expired rows are deleted and
+# the table is cut back to db_max_entries
+DB_PURGE_INTERVAL = 256
+
+
+def make_cache_key(prompt: str, model: str, temperature: float, template_version: int) -> str:
+    """Canonical hash of everything that determines an LLM completion"""
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "model": model,
+            "temperature": round(float(temperature), 4),
+            "template_version": template_version
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_payload_key(payload: Dict) -> str:
+    """Canonical hash of a request payload; key order and surrounding whitespace do not matter"""
+    canonical = json.dumps(
+        _normalize(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+class ResponseCache:
+    """Two-tier cache for raw LLM completions.
+
+    The memory tier is an LRU bounded by entry count and total characters,
+    with a per-entry TTL. The optional SQLite tier (WAL mode) survives
+    restarts and can be shared by several worker processes; memory misses
+    fall through to it and promote hits back into memory. It keeps at most
+    db_max_entries rows, dropping the oldest writes first. Async callers use
+    aget/aset, which run the SQLite tier in a worker thread.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_chars: int = 16_000_000,
+                 ttl_seconds: float = 86400, db_path: Optional[str] = None, db_max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self._db_writes = 0
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "sets": 0,
+            "db_purged": 0
+        }
+
+        if self.db_path:
+            self._init_db()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is None and self.db_path:
+            value = self._promote(key, self._db_get(key, now))
+        if value is None:
+            self._count_miss()
+        return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is None and self.db_path:
+            value = self._promote(key, await asyncio.to_thread(self._db_get, key, now))
+        if value is None:
+            self._count_miss()
+        return value
+
+    def set(self, key: str, value: str):
+        expires_at = self._memory_set(key, value)
+        if self.db_path:
+            self._db_set(key, value, expires_at)
+
+    async def aset(self, key: str, value: str):
+        expires_at = self._memory_set(key, value)
+        if self.db_path:
+            await asyncio.to_thread(self._db_set, key, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+        if self.db_path:
+            try:
+                with self._connection() as conn:
+                    conn.execute("DELETE FROM responses")
+            except sqlite3.Error as e:
+                logger.error(f"Error clearing response cache: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["chars"] = self._chars
+        return stats
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return value
+            self._remove(key)
+            self._stats["expirations"] += 1
+            return None
+
+    def _promote(self, key: str, row: Optional[tuple]) -> Optional[str]:
+        # A row read from SQLite goes back into the memory tier
+        if row is None:
+            return None
+        value, expires_at = row
+        with self._lock:
+            self._insert(key, value, expires_at)
+            self._stats["disk_hits"] += 1
+        return value
+
+    def _count_miss(self):
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def _memory_set(self, key: str, value: str) -> float:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, value, expires_at)
+            self._stats["sets"] += 1
+        return expires_at
+
+    def _insert(self, key: str, value: str, expires_at: float):
+        if key in self._entries:
+            self._remove(key)
+        if len(value) > self.max_chars:
+            return
+        self._entries[key] = (value, expires_at)
+        self._chars += len(value)
+        while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._chars -= len(value)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._db_purge()
+        except sqlite3.Error as e:
+            logger.error(f"Disabling on-disk response cache at {self.db_path}: {str(e)}")
+            self.db_path = None
+
+    def _db_get(self, key: str, now: float) -> Optional[tuple]:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            return row
+        except sqlite3.Error as e:
+            logger.error(f"Error reading response cache: {str(e)}")
+            return None
+
+    def _db_set(self, key: str, value: str, expires_at: float):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+            with self._lock:
+                self._db_writes += 1
+                purge = self._db_writes % DB_PURGE_INTERVAL == 0
+            if purge:
+                self._db_purge()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing response cache: {str(e)}")
+
+    def _db_purge(self):
+        """Delete expired rows, then the oldest ones beyond db_max_entries. Every
+        row has the same TTL, so the earliest expiry is the oldest write."""
+        with self._connection() as conn:
+            purged = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+            if self.db_max_entries:
+                purged += conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.db_max_entries,)
+                ).rowcount
+        if purged:
+            with self._lock:
+                self._stats["db_purged"] += purged
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache shared by RecommendationEngine and ConsultationService"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(**get_cache_settings())
+    return _response_cache
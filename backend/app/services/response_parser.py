@@ -0,0 +1,391 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import re
+from ..models.recommendations import StructuredSections
+from .prompt_builder import get_prompt_stats
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional; the stdlib decoder is slower but gives the same result
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+SectionEvent = Tuple[Optional[str], object]
+
+# Set on results that hold fallback items instead of (some) generated ones,
+# so callers can show them but should not cache or persist them
+FALLBACK_KEY = "fallback"
+
+# Section key -> where its items live in the result dict
+SECTION_PATHS = {
+    "condition_analysis": ("overview", "condition_analysis"),
+    "dosha_impact": ("overview", "dosha_impact"),
+    "dietary": ("recommendations", "dietary"),
+    "lifestyle": ("recommendations", "lifestyle"),
+    "exercise": ("recommendations", "exercise"),
+    "herbal": ("recommendations", "herbal"),
+    "therapeutic": ("recommendations", "therapeutic"),
+    "warnings": ("warnings", None),
+}
+
+# One pass over the lowercased line finds the earliest section keyword it mentions
+HEADER_PATTERN = re.compile(
+    r"(?P<condition_analysis>condition overview)"
+    r"|(?P<dosha_impact>dosha impact)"
+    r"|(?P<dietary>dietary)"
+    r"|(?P<lifestyle>lifestyle)"
+    r"|(?P<exercise>exercise)"
+    r"|(?P<herbal>herbal)"
+    r"|(?P<therapeutic>therapeutic)"
+    r"|(?P<warnings>warning|precaution|caution|consideration)"
+)
+NUMBER_PATTERN = re.compile(r"^\d+[.)]\s*")
+# Items containing these read as sub-headings rather than recommendations
+SUBHEADER_WORDS = ("recommendation", "guidelines", "suggested")
+
+HEADER_MAX_CHARS = 80
+NUMBERED_HEADER_MAX_WORDS = 5
+MIN_ITEM_CHARS = 10
+MIN_RECOMMENDATION_WORDS = 3
+
+
+def empty_sections() -> Dict:
+    return {
+        "overview": {
+            "condition_analysis": [],
+            "dosha_impact": []
+        },
+        "recommendations": {
+            "dietary": [],
+            "lifestyle": [],
+            "herbal": [],
+            "therapeutic": [],
+            "exercise": []
+        },
+        "warnings": []
+    }
+
+
+def event_key(section: str) -> str:
+    """Dotted key used in streaming events, e.g. recommendations.dietary"""
+    group, name = SECTION_PATHS[section]
+    return f"{group}.{name}" if name else group
+
+
+class ConsultationResponseParser:
+    """Single-pass state machine turning LLM output into the sections dict.
+
+    Text can be fed in arbitrary chunks (`feed`) or as lines (`feed_lines`);
+    partial lines are buffered until their newline arrives, so the same code
+    parses complete responses and streamed ones. `feed` returns
+    (section_key, items) events for sections that finished in that chunk and
+    `close` returns the rest followed by (None, sections).
+
+    A line is a header when it is not a bullet, mentions a section keyword
+    and is short; a numbered line must also be at most a few words or end
+    with a colon, so numbered recommendations are not mistaken for headers.
+    Items are bulleted or numbered lines longer than MIN_ITEM_CHARS; inside
+    recommendations they also need more than MIN_RECOMMENDATION_WORDS words
+    and must not look like a sub-heading.
+
+    Passing `section` parses a response that answers a single section (the
+    fan-out mode): every item goes to that section and headers are skipped.
+    """
+
+    def __init__(self, condition_analysis: Optional[List[str]] = None, section: Optional[str] = None):
+        self.sections = empty_sections()
+        self._current: Optional[str] = None
+        self._current_items: Optional[List[str]] = None
+        self._current_is_recommendation = False
+        self._buffer = ""
+        self._emitted: Dict[str, int] = {}
+        self._pending: List[SectionEvent] = []
+        if condition_analysis:
+            self.sections["overview"]["condition_analysis"].extend(condition_analysis)
+            self._pending.extend(self._finish("condition_analysis"))
+        self._locked = False
+        if section is not None:
+            self._switch_to(section)
+            self._locked = True
+
+    def feed(self, chunk: str) -> List[SectionEvent]:
+        if "\n" not in chunk:
+            self._buffer += chunk
+            return self._take_pending()
+        *lines, rest = chunk.split("\n")
+        lines[0] = self._buffer + lines[0]
+        self._buffer = rest
+        for line in lines:
+            self._process_line(line)
+        return self._take_pending()
+
+    def feed_lines(self, lines: Iterable[str]) -> List[SectionEvent]:
+        process_line = self._process_line
+        for line in lines:
+            process_line(line)
+        return self._take_pending()
+
+    def close(self) -> List[SectionEvent]:
+        if self._buffer:
+            self._process_line(self._buffer)
+            self._buffer = ""
+        if self._current is not None:
+            self._pending.extend(self._finish(self._current))
+        for section in SECTION_PATHS:
+            self._pending.extend(self._finish(section))
+        self._pending.append((None, self.sections))
+        return self._take_pending()
+
+    @property
+    def current_section(self) -> Optional[str]:
+        """Section the parser is collecting items for"""
+        return self._current
+
+    def restart_section(self):
+        """Drop the buffered partial line and the items of the current section.
+
+        Used when a completion is cut off at max_tokens and that section is
+        generated again; it has not been emitted yet, since sections are
+        emitted when the next header arrives.
+        """
+        self._buffer = ""
+        if self._current_items is not None:
+            self._current_items.clear()
+            self._emitted.pop(self._current, None)
+
+    def _process_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+
+        # Cheap first-character dispatch; regexes only run where they can match
+        first = line[0]
+        if first == "-" or first == "•" or (first == "*" and line[1:2] != "*"):
+            item = line[1:].lstrip()
+        else:
+            number = NUMBER_PATTERN.match(line) if first.isdigit() else None
+            if len(line) <= HEADER_MAX_CHARS:
+                section = self._match_header(line, number)
+                if section is not None:
+                    self._switch_to(section)
+                    return
+            if number is None:
+                return
+            item = line[number.end():]
+
+        items = self._current_items
+        if items is None or len(item) <= MIN_ITEM_CHARS:
+            return
+        if self._current_is_recommendation:
+            if len(item.split(None, MIN_RECOMMENDATION_WORDS)) <= MIN_RECOMMENDATION_WORDS:
+                return
+            lower = item.lower()
+            if SUBHEADER_WORDS[0] in lower or SUBHEADER_WORDS[1] in lower or SUBHEADER_WORDS[2] in lower:
+                return
+        items.append(item)
+
+    def _match_header(self, line: str, number) -> Optional[str]:
+        if number is not None:
+            text = line[number.end():]
+            if (len(text.split(None, NUMBERED_HEADER_MAX_WORDS)) > NUMBERED_HEADER_MAX_WORDS
+                    and not text.rstrip("*# ").endswith(":")):
+                return None
+        match = HEADER_PATTERN.search(line.lower())
+        return match.lastgroup if match else None
+
+    def _switch_to(self, section: str):
+        if section == self._current or self._locked:
+            return
+        if self._current is not None:
+            self._pending.extend(self._finish(self._current))
+        self._current = section
+        self._current_items = self._items(section)
+        self._current_is_recommendation = SECTION_PATHS[section][0] == "recommendations"
+
+    def _items(self, section: str) -> List[str]:
+        group, name = SECTION_PATHS[section]
+        return self.sections[group][name] if name else self.sections[group]
+
+    def _finish(self, section: str) -> List[SectionEvent]:
+        items = self._items(section)
+        if not items or self._emitted.get(section) == len(items):
+            return []
+        self._emitted[section] = len(items)
+        return [(event_key(section), list(items))]
+
+    def _take_pending(self) -> List[SectionEvent]:
+        pending, self._pending = self._pending, []
+        return pending
+
+
+class StructuredResponseParser:
+    """ConsultationResponseParser counterpart for answers requested as JSON.
+
+    A JSON object cannot be split into sections before it is complete, so
+    streamed chunks are buffered and parsed in one pass on `close`; only the
+    locally known condition analysis is emitted up front. Answers that are
+    not valid JSON of the expected shape go through the text parser instead.
+    """
+
+    def __init__(self, condition_analysis: Optional[List[str]] = None, section: Optional[str] = None):
+        self._condition_analysis = condition_analysis
+        self._section = section
+        self._chunks: List[str] = []
+        self._emitted: Dict[str, int] = {}
+        self._pending: List[SectionEvent] = []
+        if condition_analysis:
+            key = event_key("condition_analysis")
+            self._emitted[key] = len(condition_analysis)
+            self._pending.append((key, list(condition_analysis)))
+
+    def feed(self, chunk: str) -> List[SectionEvent]:
+        self._chunks.append(chunk)
+        return self._take_pending()
+
+    def feed_lines(self, lines: Iterable[str]) -> List[SectionEvent]:
+        for line in lines:
+            self._chunks.append(line)
+            self._chunks.append("\n")
+        return self._take_pending()
+
+    def close(self) -> List[SectionEvent]:
+        response = "".join(self._chunks)
+        self._chunks = []
+        if self._section is not None:
+            result = empty_sections()
+            section_items(result, self._section).extend(parse_structured_section(response, self._section))
+        else:
+            result = parse_structured_response(response, self._condition_analysis)
+        for key, items in section_events(result):
+            if key is None or self._emitted.get(key) != len(items):
+                self._pending.append((key, items))
+        return self._take_pending()
+
+    @property
+    def current_section(self) -> Optional[str]:
+        return None
+
+    def restart_section(self):
+        """Drop everything buffered; a truncated JSON answer is requested again in full"""
+        self._chunks = []
+
+    def _take_pending(self) -> List[SectionEvent]:
+        pending, self._pending = self._pending, []
+        return pending
+
+
+def parse_consultation_response(response: str, condition_analysis: Optional[List[str]] = None) -> Dict:
+    parser = ConsultationResponseParser(condition_analysis)
+    parser.feed_lines(response.split("\n"))
+    return parser.close()[-1][1]
+
+
+def parse_section_response(response: str, section: str) -> List[str]:
+    """Items of a response generated for one section only"""
+    parser = ConsultationResponseParser(section=section)
+    parser.feed_lines(response.split("\n"))
+    return section_items(parser.close()[-1][1], section)
+
+
+def parse_structured_response(response: str, condition_analysis: Optional[List[str]] = None) -> Dict:
+    """Sections of an answer requested as JSON, validated against StructuredSections.
+
+    Falls back to the text parser when the answer is not such a JSON object,
+    e.g. when the model ignored the format and wrote markdown.
+    """
+    sections = _decode_structured(response)
+    if sections is None:
+        return parse_consultation_response(response, condition_analysis)
+    result = empty_sections()
+    if condition_analysis:
+        result["overview"]["condition_analysis"].extend(condition_analysis)
+    for section in SECTION_PATHS:
+        section_items(result, section).extend(_structured_items(sections, section))
+    return result
+
+
+def parse_structured_section(response: str, section: str) -> List[str]:
+    """Items of a JSON answer generated for one section only"""
+    sections = _decode_structured(response)
+    if sections is None:
+        return parse_section_response(response, section)
+    return _structured_items(sections, section)
+
+
+def structured_shape(sections: Iterable[str]) -> str:
+    """Compact JSON skeleton of the requested sections, for the prompt"""
+    shape: Dict = {}
+    for section in sections:
+        group, name = SECTION_PATHS[section]
+        if name:
+            shape.setdefault(group, {})[name] = ["..."]
+        else:
+            shape[group] = ["..."]
+    return json.dumps(shape, separators=(",", ":"))
+
+
+def _decode_structured(response: str) -> Optional[Dict]:
+    if not response.strip():
+        return None
+    # Tolerate a ```json fence or a sentence around the object
+    start, end = response.find("{"), response.rfind("}")
+    text = response[start:end + 1] if 0 <= start < end else response
+    try:
+        sections = StructuredSections.model_validate(_loads(text)).model_dump()
+    except ValueError as e:
+        # JSON and validation errors are both ValueErrors
+        logger.warning(f"Structured answer was not valid JSON of the expected shape; parsing it as text: {str(e)[:200]}")
+        get_prompt_stats().record_structured(False)
+        return None
+    get_prompt_stats().record_structured(True)
+    return sections
+
+
+def _structured_items(sections: Dict, section: str) -> List[str]:
+    items = []
+    for item in section_items(sections, section):
+        item = item.strip().lstrip("-•* ").strip()
+        if item:
+            items.append(item)
+    return items
+
+
+def split_truncated(response: str) -> Tuple[str, Optional[str]]:
+    """Split a completion that was cut off into the text before the header of
+    the section it was writing and that section's key (None if no header was seen)"""
+    parser = ConsultationResponseParser()
+    head_end, section, offset = 0, None, 0
+    for line in response.splitlines(keepends=True):
+        parser.feed_lines((line,))
+        if parser.current_section != section:
+            section, head_end = parser.current_section, offset
+        offset += len(line)
+    return response[:head_end], section
+
+
+def mark_fallback(result: Dict) -> Dict:
+    result[FALLBACK_KEY] = True
+    return result
+
+
+def is_fallback(result: Optional[Dict]) -> bool:
+    return bool(result) and bool(result.get(FALLBACK_KEY))
+
+
+def section_items(sections: Dict, section: str) -> List[str]:
+    """Item list stored for a section key, or [] when the dict has no such section"""
+    group, name = SECTION_PATHS[section]
+    items = sections.get(group, {}).get(name) if name else sections.get(group)
+    return items if items is not None else []
+
+
+def section_events(sections: Dict) -> Iterable[SectionEvent]:
+    """Events for an already complete result: every non-empty section, then the result"""
+    for section in SECTION_PATHS:
+        items = section_items(sections, section)
+        if items:
+            yield event_key(section), items
+    yield None, sections
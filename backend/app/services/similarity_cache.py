@@ -0,0 +1,258 @@
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import random
+import re
+import threading
+import time
+from ..config import get_similarity_cache_settings
+from .response_cache import make_payload_key
+from .term_extractor import extract_consultation_terms, get_term_matcher, stem
+
+# Free-text consultation fields compared by similarity; every other field
+# has to match exactly (after normalization) for a cached answer to be reused
+SIMILAR_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("concerns", "primary_concerns"),
+    ("concerns", "previous_treatments"),
+)
+# Compared as a set of normalized entries instead: one added drug can change
+# the interaction warnings, however similar the rest of the list is
+MEDICATIONS_FIELD = ("medical_history", "medications")
+_MEDICATION_SEPARATORS = re.compile(r"[,;/+&\n]|\band\b|\bplus\b")
+
+# MinHash signature length and LSH banding: 8 bands of 4 rows make pairs
+# above ~0.6 Jaccard similarity likely to share a band
+NUM_PERMUTATIONS = 32
+LSH_BANDS = 8
+_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+_PRIME = (1 << 61) - 1
+# Fixed seed, so signatures are comparable across restarts and processes
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = tuple((_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS))
+
+# Lower edges of the similarity bands that lookups are reported in
+SIMILARITY_BANDS = (1.0, 0.9, 0.8, 0.7, 0.6, 0.5)
+
+_STOPWORDS = frozenset(stem(word) for word in (
+    "a an and are as at be been but by for from had has have i in into is it its my me of on or our so than "
+    "that the their them then this to too was we were which with also very some any all after before about "
+    "none reported"
+).split())
+
+
+def text_features(text) -> FrozenSet[str]:
+    """Content words of a free-text field, lowercased and crudely stemmed,
+    so "knee joint pains" and "joint pain in knees" give the same set.
+    Known conditions and medications count as one word each, under their
+    canonical name, so "high BP" and "hypertension" match too; distinct
+    diagnoses have canonical names of their own, so "type 1 diabetes" and
+    "type 2 diabetes" do not."""
+    return frozenset(token for token in get_term_matcher().canonical_tokens(text) if token not in _STOPWORDS)
+
+
+def medication_set(text) -> List[str]:
+    """Entries of the medications field, each with synonyms replaced by
+    their canonical name, sorted and without repeats, so "Glucophage 500mg,
+    aspirin" and "Aspirin and metformin 500mg" give the same list"""
+    if not isinstance(text, str):
+        return []
+    matcher = get_term_matcher()
+    entries = set()
+    for entry in _MEDICATION_SEPARATORS.split(text.lower()):
+        tokens = [token for token in matcher.canonical_tokens(entry) if token not in _STOPWORDS]
+        if tokens:
+            entries.add(" ".join(tokens))
+    return sorted(entries)
+
+
+def structured_key(data: Dict, namespace: str) -> str:
+    """Hash of everything but the similar free-text fields, normalized so
+    casing, whitespace, condition order and float noise do not matter.
+
+    The medications field counts as its `medication_set`, and the
+    conditions and medications recognized in any free-text field are
+    included too, so a consultation that mentions a condition or drug the
+    cached one does not never shares its answer.
+    """
+    data = data or {}
+    normalized = {}
+    for group, values in data.items():
+        if isinstance(values, dict):
+            values = {
+                field: value for field, value in values.items()
+                if (group, field) not in SIMILAR_FIELDS and (group, field) != MEDICATIONS_FIELD
+            }
+        normalized[group] = _normalize(values)
+    group, field = MEDICATIONS_FIELD
+    normalized["medication_set"] = medication_set((data.get(group) or {}).get(field))
+    normalized["recognized_terms"] = {
+        kind: sorted(names) for kind, names in extract_consultation_terms(get_term_matcher(), data).items()
+    }
+    return make_payload_key({"namespace": namespace, "data": normalized})
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted(_normalize(item) for item in value) if all(isinstance(item, str) for item in value) \
+            else [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, float):
+        return round(value, 1)
+    return value
+
+
+def minhash(tokens: FrozenSet[str]) -> Tuple[int, ...]:
+    if not tokens:
+        return (_PRIME,) * NUM_PERMUTATIONS
+    hashes = [int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+              for token in tokens]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+def band_label(similarity: Optional[float]) -> str:
+    if similarity is None:
+        return "no candidate"
+    if similarity >= 1.0:
+        return "1.0"
+    for lower, upper in zip(SIMILARITY_BANDS[1:], SIMILARITY_BANDS):
+        if similarity >= lower:
+            return f"{lower:.1f}-{upper:.1f}"
+    return f"<{SIMILARITY_BANDS[-1]:.1f}"
+
+
+class SimilarConsultationCache:
+    """Near-duplicate tier for consultation completions.
+
+    Sits behind the exact ResponseCache: a consultation whose structured
+    fields (age, conditions, dosha profile, lifestyle, medications and the
+    terms recognized in its free text, see `structured_key`) match a cached
+    one exactly after normalization, and whose concerns and previous
+    treatments are each at least `threshold` similar (Jaccard over stemmed
+    content words), gets that consultation's completion. Candidates come from a MinHash/LSH
+    index whose band keys include the structured key, so a lookup touches a
+    handful of entries however many are cached; the exact similarity is
+    then computed for those only.
+
+    Every lookup is counted in the band of its best candidate's similarity,
+    with how many of those were served, so the threshold can be tuned from
+    `stats()` before lowering it. Memory only, LRU-bounded with a TTL.
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 1024, ttl_seconds: float = 86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # id -> (per-field features, band keys, content, expires_at)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._index: Dict[str, set] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "sets": 0, "evictions": 0, "expirations": 0}
+        self._bands: Dict[str, Dict[str, int]] = {}
+
+    def get(self, data: Dict, namespace: str) -> Optional[str]:
+        fields, band_keys = self._features(data, namespace)
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for band_key in band_keys:
+                candidates.update(self._index.get(band_key, ()))
+            best, best_id = None, None
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry[3] <= now:
+                    self._remove(entry_id)
+                    self._stats["expirations"] += 1
+                    continue
+                similarity = min(jaccard(left, right) for left, right in zip(fields, entry[0]))
+                if best is None or similarity > best:
+                    best, best_id = similarity, entry_id
+            hit = best is not None and best >= self.threshold
+            self._stats["lookups"] += 1
+            band = self._bands.setdefault(band_label(best), {"lookups": 0, "hits": 0})
+            band["lookups"] += 1
+            if not hit:
+                return None
+            self._stats["hits"] += 1
+            band["hits"] += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def set(self, data: Dict, namespace: str, content: str):
+        fields, band_keys = self._features(data, namespace)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            # A later answer for the same consultation replaces the earlier one
+            for band_key in band_keys:
+                for entry_id in list(self._index.get(band_key, ())):
+                    if self._entries[entry_id][0] == fields:
+                        self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (fields, band_keys, content, expires_at)
+            for band_key in band_keys:
+                self._index.setdefault(band_key, set()).add(entry_id)
+            self._stats["sets"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["threshold"] = self.threshold
+            stats["bands"] = {
+                label: {**counts, "hit_rate": round(counts["hits"] / counts["lookups"], 3)}
+                for label, counts in self._bands.items()
+            }
+        stats["hit_rate"] = round(stats["hits"] / (stats["lookups"] or 1), 3)
+        return stats
+
+    def _features(self, data: Dict, namespace: str):
+        skey = structured_key(data, namespace)
+        fields = tuple(text_features((data.get(group) or {}).get(field)) for group, field in SIMILAR_FIELDS)
+        # Field-prefixed tokens, so a word moving between fields changes the signature
+        signature = minhash(frozenset(
+            f"{index}:{token}" for index, tokens in enumerate(fields) for token in tokens
+        ))
+        band_keys = [
+            f"{skey}:{band}:{hash(signature[band * _ROWS:(band + 1) * _ROWS])}" for band in range(LSH_BANDS)
+        ]
+        return fields, band_keys
+
+    def _remove(self, entry_id: int):
+        _, band_keys, _, _ = self._entries.pop(entry_id)
+        for band_key in band_keys:
+            ids = self._index.get(band_key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._index[band_key]
+
+
+_similarity_cache = None
+_similarity_cache_lock = threading.Lock()
+
+
+def get_similar_consultation_cache() -> Optional[SimilarConsultationCache]:
+    """Process-wide near-duplicate cache of ConsultationService; None when disabled"""
+    global _similarity_cache
+    if _similarity_cache is None:
+        with _similarity_cache_lock:
+            if _similarity_cache is None:
+                settings = get_similarity_cache_settings()
+                if settings["max_entries"] <= 0:
+                    return None
+                _similarity_cache = SimilarConsultationCache(**settings)
+    return _similarity_cache
@@ -0,0 +1,145 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import threading
+
+
+def _for_waiters(error: Optional[BaseException]) -> Optional[Exception]:
+    # The leader being cancelled or closed is no failure of the call itself,
+    # and must not cancel unrelated requests that joined it
+    if error is None or isinstance(error, Exception):
+        return error
+    return RuntimeError(f"Identical in-flight call was abandoned before completing ({type(error).__name__})")
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls into one.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait and receive the same result or exception.
+    Only the leader sees its own cancellation (KeyboardInterrupt,
+    GeneratorExit, CancelledError): waiters get a RuntimeError, which their
+    ordinary error handling covers.
+    `claim` / `resolve` expose the same mechanism for callers, such as
+    streams, that produce their result incrementally. A waiter's `timeout`
+    bounds only its own wait (TimeoutError); the leader's call carries on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {"leaders": 0, "waiters": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        call, leader = self.claim(key)
+        if not leader:
+            return self.wait(call, timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, call, error=e)
+            raise
+        self.resolve(key, call, result)
+        return result
+
+    def claim(self, key: Hashable) -> Tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["waiters"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self._stats["leaders"] += 1
+            return call, True
+
+    def wait(self, call: _Call, timeout: Optional[float] = None) -> Any:
+        if not call.event.wait(timeout):
+            raise TimeoutError("Timed out waiting for an identical in-flight call")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def resolve(self, key: Hashable, call: _Call, result: Any = None, error: BaseException = None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = _for_waiters(error)
+        call.event.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class _AsyncCall:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.future = loop.create_future()
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines; calls are only shared within one event loop"""
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, Hashable], _AsyncCall] = {}
+        self._stats = {"leaders": 0, "waiters": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        call, leader = self.claim(key)
+        if not leader:
+            return await self.wait(call, timeout)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.resolve(key, call, error=e)
+            raise
+        self.resolve(key, call, result)
+        return result
+
+    def claim(self, key: Hashable) -> Tuple[_AsyncCall, bool]:
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        call = self._calls.get(loop_key)
+        if call is not None:
+            call.waiters += 1
+            self._stats["waiters"] += 1
+            return call, False
+        call = self._calls[loop_key] = _AsyncCall(loop)
+        self._stats["leaders"] += 1
+        return call, True
+
+    async def wait(self, call: _AsyncCall, timeout: Optional[float] = None) -> Any:
+        # shield so a cancelled waiter does not cancel the shared result
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.future), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out waiting for an identical in-flight call")
+
+    def resolve(self, key: Hashable, call: _AsyncCall, result: Any = None, error: BaseException = None):
+        loop_key = (id(asyncio.get_running_loop()), key)
+        if self._calls.get(loop_key) is call:
+            del self._calls[loop_key]
+        if call.future.done():
+            return
+        if error is not None:
+            call.future.set_exception(_for_waiters(error))
+            # Retrieve it so an unawaited future does not log "exception never retrieved"
+            call.future.exception()
+        else:
+            call.future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls)
+        return stats
@@ -0,0 +1,236 @@
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import json
+import logging
+import re
+import threading
+from collections import deque
+from pathlib import Path
+from ..config import get_medical_terms_path
+from .prompt_builder import FREE_TEXT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+CONDITION = "condition"
+MEDICATION = "medication"
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# A word or a sentence end, which closes the negation window
+_WORD_OR_STOP_PATTERN = re.compile(r"[a-z0-9]+|[.!?;\n]")
+
+
+def tokenize(text) -> List[str]:
+    """Lowercased, crudely stemmed words, so "Knee pains" and "knee pain" match"""
+    if not isinstance(text, str):
+        return []
+    return [stem(word) for word in _WORD_PATTERN.findall(text.lower())]
+
+
+def stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize_sentences(text) -> Tuple[List[str], List[int]]:
+    """`tokenize(text)`, and for each word the position of the first word
+    of its sentence"""
+    words, sentence_starts, sentence_start = [], [], 0
+    if not isinstance(text, str):
+        return words, sentence_starts
+    for token in _WORD_OR_STOP_PATTERN.findall(text.lower()):
+        if token.isalnum():
+            words.append(stem(token))
+            sentence_starts.append(sentence_start)
+        else:
+            sentence_start = len(words)
+    return words, sentence_starts
+
+
+# A term right after one of these (within NEGATION_WINDOW words of the same
+# sentence) is not reported: "no history of asthma", "not diabetic". Stemmed
+# like the text they are compared with ("denies" is "deny")
+_NEGATIONS = frozenset(stem(word) for word in "no not never without denies denied none nor".split())
+NEGATION_WINDOW = 3
+
+
+class TermMatch(NamedTuple):
+    start: int
+    end: int
+    kind: str
+    canonical: str
+
+
+class TermMatcher:
+    """Aho-Corasick automaton over the words of a synonym dictionary.
+
+    Built once from (phrase, kind, canonical) terms; `find` then reports
+    every dictionary phrase in a text in one pass over its words, however
+    many terms there are. Transitions are per word rather than per
+    character, so matches always start and end on word boundaries, and
+    phrases go through the same `tokenize` as the text.
+
+    Overlapping matches resolve leftmost-longest: "high blood pressure"
+    wins over "blood pressure" and "pressure".
+    """
+
+    def __init__(self, terms: Iterable[Tuple[str, str, str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        # Per state: its own term as (length in words, kind, canonical), the
+        # failure link, and the nearest state on the failure chain with a term
+        self._terms: List[Optional[Tuple[int, str, str]]] = [None]
+        self._fail: List[int] = [0]
+        self._output_link: List[int] = [0]
+        self.term_count = 0
+        # Medication class by canonical name, e.g. "Metformin": "antidiabetic"
+        self.categories: Dict[str, str] = {}
+        # Broader condition a specific one is filed under in the knowledge
+        # base, e.g. "Type 2 Diabetes": "Diabetes"
+        self.groups: Dict[str, str] = {}
+
+        for phrase, kind, canonical in terms:
+            words = tokenize(phrase)
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][word] = next_state
+                    self._goto.append({})
+                    self._terms.append(None)
+                    self._fail.append(0)
+                    self._output_link.append(0)
+                state = next_state
+            if self._terms[state] is None:
+                self.term_count += 1
+            # The first entry of a phrase wins
+            self._terms[state] = self._terms[state] or (len(words), kind, canonical)
+        self._link()
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(word, 0)
+                self._fail[child] = fail
+                self._output_link[child] = fail if self._terms[fail] else self._output_link[fail]
+
+    @classmethod
+    def from_dictionary(cls, source: Dict) -> "TermMatcher":
+        """Matcher over a synonym dictionary (see backend/app/data/medical_terms.json).
+        Canonical names are terms of their own as well. A condition is
+        either a list of synonyms or {"group": ..., "synonyms": [...]}."""
+        def terms():
+            for canonical, entry in (source.get("conditions") or {}).items():
+                synonyms = entry.get("synonyms", []) if isinstance(entry, dict) else entry
+                for phrase in [canonical, *synonyms]:
+                    yield phrase, CONDITION, canonical
+            for canonical, entry in (source.get("medications") or {}).items():
+                for phrase in [canonical, *entry.get("synonyms", [])]:
+                    yield phrase, MEDICATION, canonical
+
+        matcher = cls(terms())
+        matcher.categories = {
+            canonical: entry["category"]
+            for canonical, entry in (source.get("medications") or {}).items() if entry.get("category")
+        }
+        matcher.groups = {
+            canonical: entry["group"]
+            for canonical, entry in (source.get("conditions") or {}).items()
+            if isinstance(entry, dict) and entry.get("group")
+        }
+        return matcher
+
+    def group(self, condition: str) -> str:
+        """Knowledge-base condition for a canonical one; itself if it has no group"""
+        return self.groups.get(condition, condition)
+
+    def _matches(self, words: List[str]) -> Iterator[TermMatch]:
+        goto, fail, terms, output_link = self._goto, self._fail, self._terms, self._output_link
+        state = 0
+        for position, word in enumerate(words):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            node = state if terms[state] else output_link[state]
+            while node:
+                length, kind, canonical = terms[node]
+                yield TermMatch(position + 1 - length, position + 1, kind, canonical)
+                node = output_link[node]
+
+    def find(self, words: List[str], sentence_starts: Optional[List[int]] = None) -> List[TermMatch]:
+        """Non-overlapping, non-negated matches in tokenized text, in order.
+        With `sentence_starts` (see `tokenize_sentences`), a negation only
+        covers the rest of its own sentence."""
+        found, end = [], 0
+        for match in sorted(self._matches(words), key=lambda match: (match.start, -match.end)):
+            if match.start < end:
+                continue
+            end = match.end
+            window_start = max(0, match.start - NEGATION_WINDOW)
+            if sentence_starts:
+                window_start = max(window_start, sentence_starts[match.start])
+            if not _NEGATIONS.intersection(words[window_start:match.start]):
+                found.append(match)
+        return found
+
+    def extract(self, texts: Iterable[str]) -> Dict[str, List[str]]:
+        """Canonical conditions and medications mentioned in the texts, each
+        once, in order of first mention"""
+        found = {CONDITION: [], MEDICATION: []}
+        for text in texts:
+            for match in self.find(*tokenize_sentences(text)):
+                names = found.setdefault(match.kind, [])
+                if match.canonical not in names:
+                    names.append(match.canonical)
+        return found
+
+    def canonical_tokens(self, text) -> List[str]:
+        """`tokenize(text)` with every matched phrase replaced by one
+        "kind:canonical" token, so synonyms compare equal"""
+        words, sentence_starts = tokenize_sentences(text)
+        tokens, position = [], 0
+        for match in self.find(words, sentence_starts):
+            tokens.extend(words[position:match.start])
+            tokens.append(f"{match.kind}:{match.canonical.lower()}")
+            position = match.end
+        tokens.extend(words[position:])
+        return tokens
+
+
+def extract_consultation_terms(matcher: TermMatcher, data: Dict) -> Dict[str, List[str]]:
+    """Conditions and medications mentioned in the consultation's free-text fields"""
+    return matcher.extract(
+        (data.get(section) or {}).get(field) for section, field in FREE_TEXT_FIELDS
+    )
+
+
+_term_matcher = None
+_term_matcher_lock = threading.Lock()
+
+
+def get_term_matcher() -> TermMatcher:
+    """Process-wide matcher over the medical terms dictionary; an empty one
+    if the dictionary cannot be loaded"""
+    global _term_matcher
+    if _term_matcher is None:
+        with _term_matcher_lock:
+            if _term_matcher is None:
+                path = get_medical_terms_path()
+                try:
+                    _term_matcher = TermMatcher.from_dictionary(json.loads(Path(path).read_text(encoding="utf-8")))
+                    logger.info(f"Loaded {_term_matcher.term_count} medical terms from {path}")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Error loading medical terms from {path}: {str(e)}")
+                    _term_matcher = TermMatcher([])
+    return _term_matcher
@@ -0,0 +1,249 @@
+"""Microbenchmark the CPU work around each LLM call.
+
+Usage:
+    python scripts/benchmark_cpu_paths.py [--corpus scripts/data/llm_outputs] [--min-seconds 0.2] [--check]
+
+Covers prompt building (`_create_consultation_prompt`, `_get_dosha_context`,
+`_get_conditions_context` of both services), extraction of conditions and
+medications from free text (the shipped dictionary and a synthetic one of
+50,000 terms), both
+`_parse_consultation_response` implementations and the report formatter
+`_format_recommendations_for_download` from app.py, over realistic and
+pathological inputs: very long free-text concerns, every known condition
+plus hundreds of unknown ones, huge LLM outputs, bullet lines with no
+headers, a single line without newlines and header-only output.
+
+It first shows the estimated input tokens of each consultation prompt
+before and after the input budget (LLM_INPUT_TOKEN_BUDGET). For every
+function and input it then reports ops/sec and the peak memory
+allocated by one call (tracemalloc). Finally it grows each input 1x to 64x
+and fits the exponent of time against size; anything above 1.25 is
+flagged as superlinear, and --check exits non-zero in that case.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "data" / "llm_outputs"
+SCALE_FACTORS = (1, 4, 16, 64)
+MAX_LINEAR_EXPONENT = 1.25
+
+CONCERN = "I have bloating and heaviness after meals, and my sleep is light and interrupted most nights. "
+ITEM = "Follow this specific practice daily for several weeks while noting how the body responds to it"
+
+
+def consultation(concerns: str = CONCERN, conditions=("Digestive Issues", "Sleep Disorders")) -> dict:
+    return {
+        "personal_info": {"age": 42, "gender": "Female", "weight": 64, "height": 168, "bmi": 22.68},
+        "dosha_profile": {"primary_dosha": "vata", "secondary_dosha": "pitta",
+                          "vata_percentage": 48.0, "pitta_percentage": 32.0, "kapha_percentage": 20.0},
+        "medical_history": {"conditions": list(conditions), "medications": "Metformin 500mg twice daily"},
+        "lifestyle": {"diet_type": "Vegetarian", "physical_activity": "Light", "sleep_hours": 6, "stress_level": "High"},
+        "concerns": {"primary_concerns": concerns, "previous_treatments": "Probiotics for three months"},
+    }
+
+
+def all_conditions(unknown: int):
+    # The options of the consultation form, plus free-form ones the services have no context for
+    known = ["Diabetes", "Hypertension", "Arthritis", "Digestive Issues", "Respiratory Problems",
+             "Skin Conditions", "Sleep Disorders", "Stress/Anxiety"]
+    return known + [f"Rare condition {i}" for i in range(unknown)]
+
+
+def synthetic_terms(count: int):
+    # Made-up one- to three-word phrases over a fixed vocabulary, like a large synonym dictionary
+    rng = random.Random(count)
+    vocabulary = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))) for _ in range(5000)]
+    return [(" ".join(rng.sample(vocabulary, rng.randint(1, 3))), "condition", f"Term {i}") for i in range(count)]
+
+
+def parsed_result(items: int) -> dict:
+    section = [f"{ITEM} ({i})" for i in range(items)]
+    return {
+        "overview": {"condition_analysis": list(section), "dosha_impact": list(section)},
+        "recommendations": {key: list(section) for key in ("dietary", "lifestyle", "exercise", "herbal", "therapeutic")},
+        "warnings": list(section),
+    }
+
+
+def pathological_outputs(corpus: dict) -> dict:
+    text = "\n".join(corpus.values())
+    bullets = "\n".join(f"- {ITEM} {i}" for i in range(2000))
+    return {
+        "huge output (corpus x50)": "\n".join([text] * 50),
+        "2000 bullets, no headers": bullets,
+        "one 200 KB line": (ITEM + " ") * 2000,
+        "2000 header lines": "\n".join(["DIETARY RECOMMENDATIONS:", "HERBAL REMEDIES:"] * 1000),
+    }
+
+
+def measure(function, min_seconds: float):
+    """(ops/sec, peak KB of one call)"""
+    function()
+    # Double the loop until it runs long enough to time, then take the best of three
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= min_seconds / 3:
+            break
+        loops *= 2
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        best = min(best, (time.perf_counter() - start) / loops)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return 1 / best, peak / 1024
+
+
+def exponent(timings) -> float:
+    """Slope of log(time) against log(size) between the smallest and largest input"""
+    (size_a, time_a), (size_b, time_b) = timings[0], timings[-1]
+    return math.log(time_b / time_a) / math.log(size_b / size_a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="timing budget per measurement")
+    parser.add_argument("--check", action="store_true", help="exit non-zero if anything scales superlinearly")
+    args = parser.parse_args()
+
+    corpus = {path.name: path.read_text(encoding="utf-8") for path in sorted(args.corpus.glob("*.txt"))}
+    if not corpus:
+        parser.error(f"No .txt responses found in {args.corpus}")
+
+    # The services need a key to construct but make no calls here
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ["LLM_PREWARM_CONNECTIONS"] = "0"
+    logging.disable(logging.WARNING)
+    from backend.app.services.consultation_service import ConsultationService
+    from backend.app.services.recommendation_engine import RecommendationEngine
+    from backend.app.services.term_extractor import TermMatcher, extract_consultation_terms, get_term_matcher
+    from app import _format_recommendations_for_download
+
+    services = {"consultation": ConsultationService(), "recommendation": RecommendationEngine()}
+    prompts = {
+        "typical": consultation(),
+        "50 KB concerns": consultation(concerns=CONCERN * 550),
+        "all + 500 unknown conditions": consultation(conditions=all_conditions(500)),
+        "empty request": {},
+    }
+    dosha_profiles = {"typical": prompts["typical"]["dosha_profile"], "missing": None}
+    condition_lists = {
+        "typical": prompts["typical"]["medical_history"]["conditions"],
+        "all + 500 unknown conditions": all_conditions(500),
+        "none": [],
+    }
+    outputs = {**corpus, **pathological_outputs(corpus)}
+    reports = {"typical (4 items/section)": parsed_result(4), "1000 items/section": parsed_result(1000)}
+
+    benchmarks = []
+    for name, service in services.items():
+        for label, data in prompts.items():
+            benchmarks.append((f"{name}._create_consultation_prompt", label,
+                               lambda s=service, d=data: s._create_consultation_prompt(d)))
+        for label, profile in dosha_profiles.items():
+            benchmarks.append((f"{name}._get_dosha_context", label,
+                               lambda s=service, p=profile: s._get_dosha_context(p)))
+        for label, conditions in condition_lists.items():
+            benchmarks.append((f"{name}._get_conditions_context", label,
+                               lambda s=service, c=conditions: s._get_conditions_context(c)))
+        for label, text in outputs.items():
+            benchmarks.append((f"{name}._parse_consultation_response", f"{label} ({len(text) // 1024} KB)",
+                               lambda s=service, t=text: s._parse_consultation_response(t, prompts["typical"])))
+    matchers = {"shipped dictionary": get_term_matcher(), "50,000 synthetic terms": TermMatcher(synthetic_terms(50000))}
+    for name, matcher in matchers.items():
+        for label in ("typical", "50 KB concerns"):
+            benchmarks.append((f"extract_consultation_terms ({name})", label,
+                               lambda m=matcher, d=prompts[label]: extract_consultation_terms(m, d)))
+    for label, result in reports.items():
+        benchmarks.append(("_format_recommendations_for_download", label,
+                           lambda r=result: _format_recommendations_for_download(r)))
+
+    print("\nInput tokens per consultation prompt (estimated; budget from LLM_INPUT_TOKEN_BUDGET)")
+    from backend.app.services.prompt_builder import estimate_tokens
+
+    for label, data in prompts.items():
+        untrimmed = estimate_tokens(services["consultation"]._create_consultation_prompt(data))
+        sent = estimate_tokens(services["consultation"]._build_prompt(data))
+        print(f"  {label:38} {untrimmed:8} before budget   {sent:8} sent")
+
+    current = None
+    for function_name, label, function in benchmarks:
+        if function_name != current:
+            current = function_name
+            print(f"\n{function_name}")
+        ops, peak_kb = measure(function, args.min_seconds)
+        print(f"  {label:38} {ops:12,.0f} ops/s   peak {peak_kb:9.1f} KB")
+
+    # Inputs grown 1x..64x; each entry builds the input for a factor and the call to time
+    text = "\n".join(corpus.values())
+    scaling = {
+        "prompt vs concerns length": lambda f: (
+            lambda d=consultation(concerns=CONCERN * 10 * f): services["consultation"]._create_consultation_prompt(d)
+        ),
+        "conditions context vs conditions": lambda f: (
+            lambda c=all_conditions(25 * f): services["consultation"]._get_conditions_context(c)
+        ),
+        "consultation parse vs output size": lambda f: (
+            lambda t="\n".join([text] * f): services["consultation"]._parse_consultation_response(t, {})
+        ),
+        "recommendation parse vs output size": lambda f: (
+            lambda t="\n".join([text] * f): services["recommendation"]._parse_consultation_response(t, {})
+        ),
+        "parse vs header-less bullets": lambda f: (
+            lambda t="\n".join(f"- {ITEM} {i}" for i in range(100 * f)): services["consultation"]._parse_consultation_response(t, {})
+        ),
+        "parse vs single line length": lambda f: (
+            lambda t=(ITEM + " ") * 100 * f: services["consultation"]._parse_consultation_response(t, {})
+        ),
+        "term extraction vs concerns length": lambda f: (
+            lambda d=consultation(concerns=CONCERN * 10 * f): extract_consultation_terms(get_term_matcher(), d)
+        ),
+        "term extraction vs dictionary terms": lambda f: (
+            lambda m=TermMatcher(synthetic_terms(1000 * f)), d=consultation(concerns=CONCERN * 10): extract_consultation_terms(m, d)
+        ),
+        "report vs items": lambda f: (
+            lambda r=parsed_result(10 * f): _format_recommendations_for_download(r)
+        ),
+    }
+
+    print(f"\nScaling (inputs x{', x'.join(map(str, SCALE_FACTORS))}; exponent 1.0 is linear)")
+    superlinear = []
+    for label, build in scaling.items():
+        timings = []
+        for factor in SCALE_FACTORS:
+            ops, _ = measure(build(factor), args.min_seconds / 2)
+            timings.append((factor, 1 / ops))
+        slope = exponent(timings)
+        flag = "" if slope <= MAX_LINEAR_EXPONENT else "   SUPERLINEAR"
+        if flag:
+            superlinear.append(label)
+        steps = "  ".join(f"{seconds * 1e6:10.1f}" for _, seconds in timings)
+        print(f"  {label:38} {steps} us   exponent {slope:4.2f}{flag}")
+
+    if args.check and superlinear:
+        print(f"\nFAIL: superlinear scaling in {', '.join(superlinear)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare DoshaAnalyzer.analyze_dosha with analyze_dosha_batch.
+
+Usage:
+    python scripts/benchmark_dosha_batch.py [--sizes 1000 100000 1000000] [--scalar-limit 100000]
+
+The scalar path is timed on at most --scalar-limit rows and extrapolated
+linearly beyond that, so the 1M row case finishes in reasonable time. Every
+row that goes through the scalar path is also checked against the batch
+result for exact equality.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.services.dosha_analyzer import DOSHAS, DoshaAnalyzer  # noqa: E402
+
+
+def make_responses(scores: np.ndarray, traits):
+    return [
+        {
+            trait: {
+                "trait_name": trait,
+                **{f"{dosha}_score": int(scores[row, index, d]) for d, dosha in enumerate(DOSHAS)}
+            }
+            for index, trait in enumerate(traits)
+        }
+        for row in range(scores.shape[0])
+    ]
+
+
+def check_equal(scalar_results, batch_results):
+    for row, expected in enumerate(scalar_results):
+        for key, value in expected.items():
+            if batch_results[key][row] != value:
+                raise AssertionError(f"Row {row} differs on {key}: {value!r} != {batch_results[key][row]!r}")
+
+
+def run(size: int, scalar_limit: int, seed: int):
+    analyzer = DoshaAnalyzer()
+    traits = list(analyzer.characteristic_weights)
+    rng = np.random.default_rng(seed)
+    scores = rng.integers(0, 4, size=(size, len(traits), len(DOSHAS)))
+    scores[:, 0, 0] += 1  # keep every row's total above zero
+
+    start = time.perf_counter()
+    batch_results = analyzer.analyze_dosha_batch(scores, traits)
+    batch_time = time.perf_counter() - start
+
+    scalar_rows = min(size, scalar_limit)
+    responses = make_responses(scores[:scalar_rows], traits)
+    start = time.perf_counter()
+    scalar_results = [analyzer.analyze_dosha(user_responses) for user_responses in responses]
+    scalar_time = (time.perf_counter() - start) * size / scalar_rows
+
+    check_equal(scalar_results, batch_results)
+
+    estimated = "" if scalar_rows == size else " (extrapolated)"
+    print(
+        f"{size:>9} rows | scalar {scalar_time:9.3f}s{estimated:15} | "
+        f"batch {batch_time:8.4f}s | speedup {scalar_time / batch_time:8.1f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--scalar-limit", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.scalar_limit, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""End-to-end benchmark of the route functions against a local Groq stand-in.
+
+Usage:
+    python scripts/benchmark_end_to_end.py [--route consultation] [--concurrency 1,4,16]
+        [--requests 32] [--first-token-ms 250] [--tokens-per-second 300]
+        [--error-rate 0] [--rate-limit-rate 0] [--stream] [--cache]
+        [--record FILE | --replay FILE] [--output FILE]
+
+Starts a local OpenAI-compatible chat-completions server, points the
+services at it through GROQ_API_URL and drives the sync route functions
+(`get_personal_consultation` or `get_recommendations`, or their streaming
+variants with --stream) from a thread pool at each concurrency level. The
+server simulates a hosted model: a time to first token, then output at
+--tokens-per-second, with --error-rate of the calls answered 500 and
+--rate-limit-rate answered 429. Output longer than the request's
+max_tokens is cut there and finished with finish_reason "length".
+
+Responses are synthetic (a few items for every section the prompt asks
+for, as JSON when LLM_STRUCTURED_OUTPUT is set) unless recorded ones are
+given:
+
+  --record FILE   forward every call to the real GROQ_API_URL with the
+                  configured GROQ_API_KEY and save the completions to FILE
+  --replay FILE   answer from FILE offline, with the simulated latency;
+                  prompts missing from it get synthetic content
+
+Per level it reports p50/p95/p99 latency (and time to the first section
+when streaming), throughput, the fallback rate and upstream calls. Groq
+rate limits and the LLM response cache are disabled so every request
+reaches the server; --cache keeps the cache to measure a warm workload.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.config import get_groq_api_key, get_llm_settings  # noqa: E402
+
+SECTION_HEADERS = (
+    "CONDITION OVERVIEW", "DOSHA IMPACT", "DIETARY RECOMMENDATIONS", "LIFESTYLE MODIFICATIONS",
+    "EXERCISE RECOMMENDATIONS", "HERBAL REMEDIES", "THERAPEUTIC TREATMENTS", "WARNINGS AND PRECAUTIONS",
+)
+STRUCTURED_KEY_PATTERN = re.compile(r"^\[([a-z_.]+)\] ", re.MULTILINE)
+ITEM = "- Follow this specific practice daily for several weeks while noting how the body responds to it"
+DOSHAS = ("vata", "pitta", "kapha")
+
+
+class Recordings:
+    """Completions keyed on the prompt messages, loaded from and saved to a JSON file"""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.completions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.completions = json.load(f)
+
+    @staticmethod
+    def key(body: dict) -> str:
+        return hashlib.sha256(json.dumps(body["messages"], sort_keys=True).encode()).hexdigest()
+
+    def get(self, body: dict):
+        with self.lock:
+            content = self.completions.get(self.key(body))
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return content
+
+    def add(self, body: dict, content: str):
+        with self.lock:
+            self.completions[self.key(body)] = content
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.completions, f, indent=1, sort_keys=True)
+
+
+class MockGroq(BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions with simulated latency and failures"""
+
+    protocol_version = "HTTP/1.1"
+    first_token_seconds = 0.25
+    tokens_per_second = 300.0
+    error_rate = 0.0
+    rate_limit_rate = 0.0
+    recordings = Recordings()
+    # Set in record mode: (url, api key) of the real API
+    upstream = None
+    random = random.Random(0)
+    counters = {"calls": 0, "errors": 0, "rate_limited": 0, "truncated": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # Connection warm-up requests hit the models endpoint
+        self._send(200, b'{"data":[]}')
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.counters["calls"] += 1
+            roll = self.random.random()
+        if self.upstream is None:
+            if roll < self.error_rate:
+                with self.lock:
+                    self.counters["errors"] += 1
+                self._send(500, b'{"error":{"message":"simulated server error"}}')
+                return
+            if roll < self.error_rate + self.rate_limit_rate:
+                with self.lock:
+                    self.counters["rate_limited"] += 1
+                self._send(429, b'{"error":{"message":"simulated rate limit"}}', {"Retry-After": "1"})
+                return
+
+        if self.upstream is not None:
+            status, content = self._forward(body)
+            if status != 200:
+                self._send(status, json.dumps({"error": {"message": content}}).encode())
+                return
+            self.recordings.add(body, content)
+        else:
+            content = self.recordings.get(body)
+            if content is None:
+                content = _synthetic_completion(body)
+        finish_reason = "stop"
+        if self.upstream is None and body.get("max_tokens") and _tokens(content) > body["max_tokens"]:
+            content, finish_reason = _cut(content, body["max_tokens"]), "length"
+            with self.lock:
+                self.counters["truncated"] += 1
+
+        prompt_tokens = sum(_tokens(message["content"]) for message in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": _tokens(content),
+            "total_tokens": prompt_tokens + _tokens(content)
+        }
+        if body.get("stream"):
+            self._stream(content, finish_reason, usage)
+            return
+        if self.upstream is None:
+            time.sleep(self.first_token_seconds + _tokens(content) / self.tokens_per_second)
+        out = json.dumps({
+            "choices": [{"message": {"content": content}, "finish_reason": finish_reason}], "usage": usage
+        }).encode()
+        self._send(200, out, {"Content-Type": "application/json"})
+
+    def _forward(self, body: dict):
+        import requests
+
+        url, api_key = self.upstream
+        response = requests.post(
+            url, json={**body, "stream": False}, timeout=120,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        )
+        if response.status_code != 200:
+            return response.status_code, response.text
+        return 200, response.json()["choices"][0]["message"]["content"]
+
+    def _stream(self, content: str, finish_reason: str, usage: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        simulate = self.upstream is None
+        if simulate:
+            time.sleep(self.first_token_seconds)
+        for line in content.splitlines(True):
+            if simulate:
+                time.sleep(_tokens(line) / self.tokens_per_second)
+            self._chunk({"choices": [{"delta": {"content": line}}]})
+        # Groq reports usage on the last chunk, under x_groq
+        self._chunk({"choices": [{"delta": {}, "finish_reason": finish_reason}], "x_groq": {"usage": usage}})
+        self._chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, payload):
+        event = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+        self.wfile.flush()
+
+    def _send(self, status: int, out: bytes, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def _synthetic_completion(body: dict) -> str:
+    instructions = body["messages"][0]["content"].split("in the following format:", 1)[-1]
+    # Structured mode (LLM_STRUCTURED_OUTPUT) labels each section with its JSON key
+    keys = STRUCTURED_KEY_PATTERN.findall(instructions)
+    if keys:
+        answer = {}
+        for key in keys:
+            group, _, name = key.partition(".")
+            items = [ITEM[2:]] * 4
+            if name:
+                answer.setdefault(group, {})[name] = items
+            else:
+                answer[group] = items
+        return json.dumps(answer, indent=1) + "\n"
+    lines = []
+    for header in SECTION_HEADERS:
+        if header in instructions:
+            lines.append(f"{header}:")
+            lines.extend([ITEM] * 4)
+    return "\n".join(lines) + "\n"
+
+
+def _tokens(text: str) -> int:
+    # Rough English ratio, good enough to pace the simulated output
+    return int(len(text.split()) * 1.3)
+
+
+def _cut(text: str, max_tokens: int) -> str:
+    # Keep whole words up to max_tokens, like a completion stopped mid-sentence
+    words_left = int(max_tokens / 1.3)
+    kept = []
+    for line in text.splitlines(True):
+        words = line.split()
+        if len(words) > words_left:
+            kept.append(" ".join(words[:words_left]))
+            break
+        words_left -= len(words)
+        kept.append(line)
+    return "".join(kept)
+
+
+def start_mock_server() -> ThreadingHTTPServer:
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockGroq)
+    server.daemon_threads = True
+    # Clients closing pooled keep-alive connections at exit is expected
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def consultation(i: int) -> dict:
+    # A distinct patient per request so neither the cache nor coalescing answers
+    return {
+        "personal_info": {"age": 20 + i % 60, "gender": ("Female", "Male")[i % 2], "weight": 60, "height": 170, "bmi": 20.8},
+        "dosha_profile": {"primary_dosha": DOSHAS[i % 3], "vata_percentage": 50, "pitta_percentage": 30, "kapha_percentage": 20},
+        "medical_history": {"conditions": ["Digestive Issues"], "medications": "None"},
+        "lifestyle": {"diet_type": "Vegetarian", "physical_activity": "Light", "stress_level": "High", "sleep_hours": 6},
+        "concerns": {"primary_concerns": f"Bloating after meals, case {i}", "previous_treatments": ""},
+    }
+
+
+def run_one(routes, route: str, i: int, stream: bool):
+    """(latency, time to first section or None, result or None if the route raised)"""
+    from backend.app.services.knowledge_base import INSTANT_EVENT
+    from backend.app.services.llm_scheduler import QUEUE_EVENT
+
+    session_id = f"bench-{i}"
+    start = time.perf_counter()
+    first = None
+    try:
+        if route == "consultation" and stream:
+            events = routes.stream_personal_consultation(consultation(i), session_id=session_id)
+        elif stream:
+            events = routes.stream_recommendations(DOSHAS[i % 3], session_id=session_id)
+        elif route == "consultation":
+            result = routes.get_personal_consultation(consultation(i), session_id=session_id)
+            return time.perf_counter() - start, None, result
+        else:
+            result = routes.get_recommendations(DOSHAS[i % 3], session_id=session_id)
+            return time.perf_counter() - start, None, result
+        result = None
+        for key, data in events:
+            if first is None and key not in (None, QUEUE_EVENT, INSTANT_EVENT):
+                first = time.perf_counter() - start
+            if key is None:
+                result = data
+        return time.perf_counter() - start, first, result
+    except Exception as e:
+        print(f"  request {i} failed: {str(e)}", file=sys.stderr)
+        return time.perf_counter() - start, None, None
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_level(routes, route: str, concurrency: int, requests: int, stream: bool, offset: int) -> dict:
+    from backend.app.services.response_parser import is_fallback
+
+    calls_before = MockGroq.counters["calls"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(lambda i: run_one(routes, route, offset + i, stream), range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies = [latency for latency, _, _ in runs]
+    firsts = [first for _, first, _ in runs if first is not None]
+    results = [result for _, _, result in runs]
+    fallbacks = sum(1 for result in results if result is not None and is_fallback(result))
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": wall,
+        "throughput": requests / wall,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "first_section_p50": percentile(firsts, 0.5) if firsts else None,
+        "first_section_p95": percentile(firsts, 0.95) if firsts else None,
+        "fallback_rate": fallbacks / requests,
+        "failures": sum(1 for result in results if result is None),
+        "upstream_calls": MockGroq.counters["calls"] - calls_before,
+    }
+
+
+def print_stages():
+    """Mean time per stage and tokens per call over the whole run, from the services' metrics"""
+    from backend.app.services.metrics import STAGES, get_metrics
+
+    metrics = get_metrics()
+    stages = {}
+    for (_, stage), (buckets, total) in metrics.stage_seconds.snapshot().items():
+        count, seconds = stages.get(stage, (0, 0.0))
+        stages[stage] = (count + buckets[-1], seconds + total)
+    print("stages: " + ", ".join(
+        f"{stage} {stages[stage][1] / stages[stage][0] * 1000:.1f}ms x{stages[stage][0]}"
+        for stage in STAGES if stage in stages
+    ))
+    tokens = {kind: (buckets[-1], total) for (_, kind), (buckets, total) in metrics.tokens.snapshot().items()}
+    if tokens:
+        print("tokens per call: " + ", ".join(
+            f"{kind} {total / count:.0f}" for kind, (count, total) in sorted(tokens.items())
+        ))
+    fallbacks = metrics.fallbacks.values()
+    if fallbacks:
+        print("fallbacks: " + ", ".join(f"{cause} {int(count)}" for (_, cause), count in sorted(fallbacks.items())))
+
+
+def print_level(level: dict):
+    print(f"\nconcurrency {level['concurrency']} ({level['requests']} requests, {level['seconds']:.2f} s)")
+    print(f"  latency        p50 {level['p50'] * 1e3:8.1f} ms   p95 {level['p95'] * 1e3:8.1f} ms"
+          f"   p99 {level['p99'] * 1e3:8.1f} ms")
+    if level["first_section_p50"] is not None:
+        print(f"  first section  p50 {level['first_section_p50'] * 1e3:8.1f} ms"
+              f"   p95 {level['first_section_p95'] * 1e3:8.1f} ms")
+    print(f"  throughput     {level['throughput']:8.2f} req/s")
+    print(f"  fallback rate  {level['fallback_rate'] * 100:7.1f} %   failures {level['failures']}"
+          f"   upstream calls {level['upstream_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--route", choices=("consultation", "recommendations"), default="consultation")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--first-token-ms", type=float, default=250.0)
+    parser.add_argument("--tokens-per-second", type=float, default=300.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered 429")
+    parser.add_argument("--stream", action="store_true", help="use the streaming route functions")
+    parser.add_argument("--fan-out", action="store_true", help="request every section separately")
+    parser.add_argument("--cache", action="store_true", help="keep the LLM response cache enabled")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the simulated failures")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--record", metavar="FILE", help="call the real API and save its completions")
+    group.add_argument("--replay", metavar="FILE", help="answer from recorded completions")
+    parser.add_argument("--output", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    MockGroq.first_token_seconds = args.first_token_ms / 1000
+    MockGroq.tokens_per_second = args.tokens_per_second
+    MockGroq.error_rate = args.error_rate
+    MockGroq.rate_limit_rate = args.rate_limit_rate
+    MockGroq.random = random.Random(args.seed)
+    if args.record:
+        MockGroq.upstream = (get_llm_settings()["api_url"], get_groq_api_key())
+        MockGroq.recordings = Recordings(args.record)
+    elif args.replay:
+        if not os.path.exists(args.replay):
+            parser.error(f"{args.replay} does not exist; create it with --record")
+        MockGroq.recordings = Recordings(args.replay)
+
+    server = start_mock_server()
+    os.environ.update({
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY") or "benchmark",
+        "GROQ_API_URL": f"http://127.0.0.1:{server.server_port}/openai/v1/chat/completions",
+        "LLM_CACHE_PATH": "",
+        "LLM_PREWARM_CONNECTIONS": "0",
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_TOKENS_PER_MINUTE": "0",
+        "LLM_FAN_OUT_ROUTES": args.route if args.fan_out else "",
+        # No pre-generated answers for the recommendations route
+        "RECOMMENDATION_ARTIFACT_PATH": os.devnull,
+    })
+    if not args.cache:
+        os.environ["LLM_CACHE_MAX_ENTRIES"] = "0"
+    from backend.app.api import routes
+
+    mode = ("recording" if args.record else "replaying") if (args.record or args.replay) else "synthetic"
+    print(f"{args.route}{' (stream)' if args.stream else ''}{' (fan-out)' if args.fan_out else ''}, "
+          f"{mode} responses, error rate {args.error_rate:.0%}, 429 rate {args.rate_limit_rate:.0%}")
+    # Imports, service construction and the first connection are not measured
+    run_one(routes, args.route, -1, args.stream)
+
+    levels = []
+    for index, concurrency in enumerate(int(level) for level in args.concurrency.split(",")):
+        level = run_level(routes, args.route, concurrency, args.requests, args.stream, index * args.requests)
+        print_level(level)
+        levels.append(level)
+
+    print(f"\nupstream: {MockGroq.counters['calls']} calls, {MockGroq.counters['errors']} simulated errors, "
+          f"{MockGroq.counters['rate_limited']} simulated 429s, {MockGroq.counters['truncated']} cut at max_tokens")
+    if args.replay:
+        print(f"replay: {MockGroq.recordings.hits} recorded, {MockGroq.recordings.misses} synthetic")
+    print(f"circuit breaker: {routes.get_circuit_stats()}")
+    print_stages()
+    if args.record:
+        MockGroq.recordings.save()
+        print(f"recorded {len(MockGroq.recordings.completions)} completions to {args.record}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"route": args.route, "stream": args.stream, "mode": mode, "levels": levels}, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark single-prompt against fan-out (one request per section) generation.
+
+Usage:
+    python scripts/benchmark_fan_out.py [--requests 20] [--concurrency 4] [--token-ms 8]
+
+Runs ConsultationService against a local mock of the chat-completions API
+whose latency is a fixed time to first token plus a per-token delay, which
+is how hosted models behave. Single-prompt requests pay for every section's
+tokens in sequence; fan-out requests pay roughly for the longest section.
+For each mode it reports total and time-to-first-section latency
+percentiles and the number of upstream calls.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.services.llm_scheduler import QUEUE_EVENT  # noqa: E402
+
+SECTION_HEADERS = (
+    "CONDITION OVERVIEW", "DOSHA IMPACT", "DIETARY RECOMMENDATIONS", "LIFESTYLE MODIFICATIONS",
+    "EXERCISE RECOMMENDATIONS", "HERBAL REMEDIES", "THERAPEUTIC TREATMENTS", "WARNINGS AND PRECAUTIONS",
+)
+ITEM = "- Follow this specific practice daily for several weeks while noting how the body responds to it"
+
+
+class MockCompletions(BaseHTTPRequestHandler):
+    """Answers every requested section with a few items after a simulated generation delay"""
+
+    protocol_version = "HTTP/1.1"
+    first_token_seconds = 0.2
+    token_seconds = 0.008
+    items_per_section = 4
+    calls = 0
+    calls_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.calls_lock:
+            type(self).calls += 1
+        instructions = body["messages"][0]["content"].split("in the following format:", 1)[-1]
+        lines = []
+        for header in SECTION_HEADERS:
+            if header in instructions:
+                lines.append(f"{header}:")
+                lines.extend([ITEM] * self.items_per_section)
+        if body.get("stream"):
+            self._stream(lines)
+            return
+        content = "\n".join(lines)
+        time.sleep(self.first_token_seconds + _tokens(content) * self.token_seconds)
+        out = json.dumps({"choices": [{"message": {"content": content}, "finish_reason": "stop"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _stream(self, lines):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.first_token_seconds)
+        for line in lines:
+            time.sleep(_tokens(line) * self.token_seconds)
+            self._chunk({"choices": [{"delta": {"content": line + "\n"}}]})
+        self._chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, payload):
+        event = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+        self.wfile.flush()
+
+
+def _tokens(text: str) -> int:
+    # Rough English ratio; only the relative cost between modes matters here
+    return int(len(text.split()) * 1.3)
+
+
+def start_mock_server() -> ThreadingHTTPServer:
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockCompletions)
+    server.daemon_threads = True
+    # Clients closing pooled keep-alive connections at exit is expected
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def consultation(i: int) -> dict:
+    # A distinct patient per request so the response cache never answers
+    return {
+        "personal_info": {"age": 20 + i, "gender": "Female"},
+        "dosha_profile": {"primary_dosha": "vata", "vata_percentage": 50, "pitta_percentage": 30, "kapha_percentage": 20},
+        "medical_history": {"conditions": ["Digestive Issues"], "medications": "None"},
+        "lifestyle": {"diet_type": "Vegetarian", "stress_level": "High", "sleep_hours": 6},
+        "concerns": {"primary_concerns": "Bloating after meals"},
+    }
+
+
+def run_one(service, data: dict, fan_out: bool):
+    start = time.perf_counter()
+    first = None
+    for key, result in service.stream_personalized_recommendations(data, fan_out):
+        if first is None and key not in (None, QUEUE_EVENT):
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start, result
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--token-ms", type=float, default=8.0, help="simulated generation time per output token")
+    parser.add_argument("--first-token-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    MockCompletions.token_seconds = args.token_ms / 1000
+    MockCompletions.first_token_seconds = args.first_token_ms / 1000
+    server = start_mock_server()
+    os.environ.update({
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "benchmark"),
+        "GROQ_API_URL": f"http://127.0.0.1:{server.server_port}/openai/v1/chat/completions",
+        "LLM_CACHE_PATH": "",
+        "LLM_PREWARM_CONNECTIONS": "0",
+        # Measure generation latency only, not Groq account rate limits
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_TOKENS_PER_MINUTE": "0",
+    })
+    from backend.app.services.consultation_service import ConsultationService
+
+    service = ConsultationService()
+    for offset, (label, fan_out) in enumerate((("single prompt", False), ("fan-out", True))):
+        service.cache.clear()
+        MockCompletions.calls = 0
+        base = offset * args.requests
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            runs = list(executor.map(
+                lambda i: run_one(service, consultation(base + i), fan_out), range(args.requests)
+            ))
+        firsts = [first for first, _, _ in runs if first is not None]
+        totals = [total for _, total, _ in runs]
+        items = statistics.mean(
+            sum(len(v) for v in result["recommendations"].values()) for _, _, result in runs
+        )
+        print(f"\n{label} ({args.requests} requests, concurrency {args.concurrency})")
+        print(f"  total latency   p50 {percentile(totals, 0.5) * 1e3:8.1f} ms   p95 {percentile(totals, 0.95) * 1e3:8.1f} ms"
+              f"   max {max(totals) * 1e3:8.1f} ms")
+        if firsts:
+            print(f"  first section   p50 {percentile(firsts, 0.5) * 1e3:8.1f} ms   p95 {percentile(firsts, 0.95) * 1e3:8.1f} ms")
+        print(f"  upstream calls  {MockCompletions.calls}   recommendation items per response {items:.1f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
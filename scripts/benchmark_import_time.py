@@ -0,0 +1,119 @@
+"""Benchmark cold-start import time of the backend.
+
+Usage:
+    python scripts/benchmark_import_time.py [--repeats 10] [--top 10] [--max-ms 0]
+
+Every run is a fresh interpreter with GROQ_API_KEY unset, measuring:
+
+  cold start       importing backend.app.api.routes, what app.py pays before
+                   the first page renders
+  first analysis   cold start plus one questionnaire analysis, which must
+                   work without an API key
+
+For each it reports median and max wall time, the slowest top-level
+packages by cumulative import time (python -X importtime) and whether any heavy module
+that the path should not need (NumPy, the HTTP clients) was loaded. Exits
+non-zero when such a module is loaded at cold start or, with --max-ms, when
+the median cold start exceeds it, so it can guard against regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules the cold start must not import; they belong to batch scoring and LLM calls
+HEAVY_MODULES = ("numpy", "httpx", "requests")
+
+COLD_START = """
+import time, sys
+start = time.perf_counter()
+import backend.app.api.routes
+elapsed = time.perf_counter() - start
+"""
+
+FIRST_ANALYSIS = """
+import time, sys
+start = time.perf_counter()
+from backend.app.api.routes import analyze_dosha_answers
+from backend.app.models.questionnaire import QUESTIONNAIRE
+result = analyze_dosha_answers({trait.trait_name: trait.options[0].label for trait in QUESTIONNAIRE.traits})
+assert result["primary_dosha"]
+elapsed = time.perf_counter() - start
+"""
+
+REPORT = """
+import json
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once(snippet: str):
+    env = {key: value for key, value in os.environ.items() if key != "GROQ_API_KEY"}
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    # No warm-up requests if an API key does get loaded from .env
+    env["LLM_PREWARM_CONNECTIONS"] = "0"
+    completed = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", snippet + REPORT],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    return report["seconds"], report["loaded"], parse_importtime(completed.stderr)
+
+
+def parse_importtime(stderr: str):
+    """{top-level package: cumulative microseconds} from -X importtime output"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        # Submodules are included in their package's cumulative time
+        if "." in name or name == "backend":
+            continue
+        cumulative[name] = max(cumulative.get(name, 0), int(cumulative_us))
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level packages to list")
+    parser.add_argument("--max-ms", type=float, default=0, help="fail when the median cold start exceeds this")
+    args = parser.parse_args()
+
+    failed = False
+    for label, snippet in (("cold start", COLD_START), ("first analysis", FIRST_ANALYSIS)):
+        times, loaded, modules = [], set(), {}
+        for _ in range(args.repeats):
+            seconds, heavy, cumulative = run_once(snippet)
+            times.append(seconds)
+            loaded.update(heavy)
+            for name, us in cumulative.items():
+                modules.setdefault(name, []).append(us)
+
+        median = statistics.median(times)
+        print(f"\n{label} ({args.repeats} fresh interpreters)")
+        print(f"  wall time   median {median * 1e3:7.1f} ms   max {max(times) * 1e3:7.1f} ms")
+        print(f"  heavy modules loaded: {', '.join(sorted(loaded)) or 'none'}")
+        slowest = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+        for name, values in slowest:
+            print(f"  {statistics.median(values) / 1e3:7.1f} ms  {name.strip()}")
+
+        if label == "cold start":
+            if loaded:
+                print(f"  FAIL: cold start imported {', '.join(sorted(loaded))}")
+                failed = True
+            if args.max_ms and median * 1e3 > args.max_ms:
+                print(f"  FAIL: median cold start above {args.max_ms:.0f} ms")
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Benchmark the shared response parser against the two parsers it replaced.
+
+Usage:
+    python scripts/benchmark_response_parser.py [--corpus scripts/data/llm_outputs] [--repeat 2000]
+
+For every response in the corpus this reports parse time for the legacy
+ConsultationService and RecommendationEngine parsers and for
+ConsultationResponseParser, both on the full text and fed in small
+streaming chunks, plus the number of items each one extracted, and for
+parse_structured_response on the same items encoded as the JSON the
+structured mode (LLM_STRUCTURED_OUTPUT) asks for. It then
+repeats the corpus up to 64x to confirm the new parser scales linearly.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.services.response_parser import (  # noqa: E402
+    ConsultationResponseParser, parse_consultation_response, parse_structured_response
+)
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "data" / "llm_outputs"
+STREAM_CHUNK_CHARS = 16
+
+
+def legacy_consultation_parse(response: str) -> dict:
+    """ConsultationService._parse_consultation_response before the shared parser"""
+    sections = {
+        "overview": {"condition_analysis": [], "dosha_impact": []},
+        "recommendations": {"dietary": [], "lifestyle": [], "herbal": [], "therapeutic": [], "exercise": []},
+        "warnings": []
+    }
+    current_section = None
+    current_subsection = None
+    for line in response.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        lower_line = line.lower()
+        if 'condition overview' in lower_line:
+            current_section, current_subsection = 'overview', 'condition_analysis'
+            continue
+        elif 'dosha impact' in lower_line:
+            current_section, current_subsection = 'overview', 'dosha_impact'
+            continue
+        elif 'dietary' in lower_line:
+            current_section, current_subsection = 'recommendations', 'dietary'
+            continue
+        elif 'lifestyle' in lower_line:
+            current_section, current_subsection = 'recommendations', 'lifestyle'
+            continue
+        elif 'exercise' in lower_line:
+            current_section, current_subsection = 'recommendations', 'exercise'
+            continue
+        elif 'herbal' in lower_line:
+            current_section, current_subsection = 'recommendations', 'herbal'
+            continue
+        elif 'therapeutic' in lower_line:
+            current_section, current_subsection = 'recommendations', 'therapeutic'
+            continue
+        elif any(word in lower_line for word in ['warning', 'precaution', 'caution']):
+            current_section, current_subsection = 'warnings', None
+            continue
+        if current_section and line.startswith(('-', '•', '*')) or line[0].isdigit():
+            cleaned_line = line.lstrip('•-*123456789. ')
+            if cleaned_line and len(cleaned_line) > 10:
+                if current_section in ('recommendations', 'overview'):
+                    sections[current_section][current_subsection].append(cleaned_line)
+                else:
+                    sections[current_section].append(cleaned_line)
+    for section in sections['recommendations']:
+        sections['recommendations'][section] = [
+            rec for rec in sections['recommendations'][section]
+            if len(rec.split()) > 3
+            and not any(header in rec.lower() for header in ['recommendation', 'guidelines', 'suggested'])
+        ]
+    return sections
+
+
+def legacy_recommendation_parse(response: str) -> dict:
+    """RecommendationEngine._parse_consultation_response before the shared parser"""
+    sections = {
+        "overview": {"condition_analysis": [], "dosha_impact": []},
+        "recommendations": {"dietary": [], "lifestyle": [], "herbal": [], "therapeutic": [], "exercise": []},
+        "warnings": []
+    }
+    current_section = None
+    current_subsection = None
+    for line in response.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        lower_line = line.lower()
+        if 'dosha impact' in lower_line:
+            current_section, current_subsection = 'overview', 'dosha_impact'
+        elif 'dietary' in lower_line:
+            current_section, current_subsection = 'recommendations', 'dietary'
+        elif 'lifestyle' in lower_line:
+            current_section, current_subsection = 'recommendations', 'lifestyle'
+        elif 'exercise' in lower_line:
+            current_section, current_subsection = 'recommendations', 'exercise'
+        elif 'herbal' in lower_line:
+            current_section, current_subsection = 'recommendations', 'herbal'
+        elif 'therapeutic' in lower_line:
+            current_section, current_subsection = 'recommendations', 'therapeutic'
+        elif any(word in lower_line for word in ['warning', 'caution', 'consideration']):
+            current_section, current_subsection = 'warnings', None
+        if current_section and (line.startswith(('•', '-', '*')) or line[0].isdigit()):
+            cleaned_line = line.lstrip('•-*123456789. ')
+            if cleaned_line and len(cleaned_line) > 10:
+                if current_section in ('recommendations', 'overview'):
+                    sections[current_section][current_subsection].append(cleaned_line)
+                else:
+                    sections[current_section].append(cleaned_line)
+    return sections
+
+
+def parse_streamed(response: str) -> dict:
+    parser = ConsultationResponseParser()
+    for start in range(0, len(response), STREAM_CHUNK_CHARS):
+        parser.feed(response[start:start + STREAM_CHUNK_CHARS])
+    return parser.close()[-1][1]
+
+
+PARSERS = {
+    "legacy consultation": legacy_consultation_parse,
+    "legacy recommendation": legacy_recommendation_parse,
+    "shared parser": parse_consultation_response,
+    "shared parser (streamed)": parse_streamed,
+}
+
+
+def count_items(sections: dict) -> int:
+    return (
+        sum(len(items) for items in sections["overview"].values())
+        + sum(len(items) for items in sections["recommendations"].values())
+        + len(sections["warnings"])
+    )
+
+
+def time_parser(parse, text: str, repeat: int) -> float:
+    """Best-of-three mean seconds per parse"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(text)
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def safe_count(parse, text: str) -> str:
+    try:
+        return str(count_items(parse(text)))
+    except Exception as e:  # the legacy consultation parser crashes on some inputs
+        return f"error: {type(e).__name__}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = {path.name: path.read_text(encoding="utf-8") for path in sorted(args.corpus.glob("*.txt"))}
+    if not corpus:
+        parser.error(f"No .txt responses found in {args.corpus}")
+
+    for name, text in corpus.items():
+        print(f"\n{name} ({len(text)} chars)")
+        for label, parse in PARSERS.items():
+            items = safe_count(parse, text)
+            if items.startswith("error"):
+                print(f"  {label:26} {'-':>10}        items: {items}")
+                continue
+            seconds = time_parser(parse, text, args.repeat)
+            print(f"  {label:26} {seconds * 1e6:10.1f} us   items: {items}")
+        structured = json.dumps(parse_consultation_response(text))
+        seconds = time_parser(parse_structured_response, structured, args.repeat)
+        items = safe_count(parse_structured_response, structured)
+        print(f"  {'structured (JSON)':26} {seconds * 1e6:10.1f} us   items: {items}")
+
+    print("\nScaling of the shared parser (whole corpus repeated)")
+    text = "\n".join(corpus.values())
+    base = None
+    for factor in (1, 4, 16, 64):
+        scaled = "\n".join([text] * factor)
+        seconds = time_parser(parse_consultation_response, scaled, max(1, args.repeat // (factor * 10)))
+        per_kb = seconds / (len(scaled) / 1024) * 1e6
+        base = base or per_kb
+        print(f"  x{factor:<3} {len(scaled):>9} chars {seconds * 1e3:9.3f} ms   {per_kb:6.2f} us/KB ({per_kb / base:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Pre-generate recommendations for dosha-only requests.
+
+Usage:
+    python scripts/build_recommendation_artifacts.py [--bucket-size 10] [--output PATH] [--rebuild]
+
+Generates recommendations for every vata/pitta/kapha percentage bucket
+(the three pure doshas are the 100/0/0 corners of the grid) and writes
+them to the versioned artifact served by routes.get_recommendations and
+routes.analyze_dosha. By default buckets already present in a compatible
+artifact are kept, so an interrupted build can be resumed.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.config import get_artifact_path  # noqa: E402
+from backend.app.services.recommendation_artifacts import (  # noqa: E402
+    RecommendationArtifactStore,
+    bucket_key,
+    iter_bucket_profiles,
+    write_artifact,
+)
+from backend.app.services.recommendation_engine import RecommendationEngine  # noqa: E402
+from backend.app.services.response_parser import is_fallback  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def build(bucket_size: int, output, rebuild: bool) -> bool:
+    engine = RecommendationEngine()
+
+    entries = {}
+    if not rebuild:
+        existing = RecommendationArtifactStore(output, RecommendationEngine.prompt_template_version, engine.model)
+        if existing.bucket_size == bucket_size:
+            entries = existing.entries
+
+    profiles = list(iter_bucket_profiles(bucket_size))
+    missing = 0
+    for profile in profiles:
+        key = bucket_key(profile, bucket_size)
+        if key in entries:
+            continue
+        recommendations = engine.get_recommendations({"dosha_profile": profile})
+        if is_fallback(recommendations):
+            logger.error(f"LLM call failed for bucket {key}; it will be served live")
+            missing += 1
+            continue
+        entries[key] = recommendations
+        logger.info(f"Generated bucket {key} ({len(entries)}/{len(profiles)})")
+        # Write after every bucket so an interrupted build keeps its progress
+        write_artifact(output, entries, bucket_size, RecommendationEngine.prompt_template_version, engine.model)
+
+    write_artifact(output, entries, bucket_size, RecommendationEngine.prompt_template_version, engine.model)
+    logger.info(f"Wrote {len(entries)} buckets to {output} ({missing} missing)")
+    return missing == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bucket-size", type=int, default=10, help="Percentage step of the bucket grid")
+    parser.add_argument("--output", default=str(get_artifact_path()))
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate buckets already in the artifact")
+    args = parser.parse_args()
+
+    if 100 % args.bucket_size:
+        parser.error("--bucket-size must divide 100")
+    sys.exit(0 if build(args.bucket_size, args.output, args.rebuild) else 1)
+
+
+if __name__ == "__main__":
+    main()
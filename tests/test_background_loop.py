@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+from backend.app.services.background_loop import iterate_async
+
+
+def test_items_and_errors_reach_the_sync_consumer():
+    async def numbers():
+        yield 1
+        yield 2
+        raise ValueError("upstream failed")
+
+    received = []
+    try:
+        for item in iterate_async(numbers()):
+            received.append(item)
+    except ValueError:
+        received.append("error")
+    assert received == [1, 2, "error"]
+
+
+def test_closing_the_sync_iterator_stops_the_async_generator():
+    produced = []
+    cleaned_up = threading.Event()
+
+    async def endless():
+        try:
+            while True:
+                produced.append(len(produced))
+                yield produced[-1]
+                await asyncio.sleep(0.01)
+        finally:
+            cleaned_up.set()
+
+    stream = iterate_async(endless())
+    assert [next(stream), next(stream)] == [0, 1]
+    stream.close()
+
+    assert cleaned_up.wait(5)
+    stopped_at = len(produced)
+    threading.Event().wait(0.1)
+    assert len(produced) == stopped_at
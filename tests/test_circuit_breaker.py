@@ -0,0 +1,129 @@
+import pytest
+
+from backend.app.services import circuit_breaker
+from backend.app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def _breaker(**settings):
+    return CircuitBreaker(**{
+        "failure_rate": 0.5, "slow_call_seconds": 10.0, "slow_call_rate": 0.8, "min_calls": 4,
+        "window_seconds": 60.0, "open_seconds": 30.0, "half_open_probes": 1, **settings
+    })
+
+
+def _call(breaker, failed=False, latency=0.1):
+    breaker.before_call()
+    if failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success(latency)
+
+
+def _open(breaker):
+    for failed in (True, True, False, False):
+        _call(breaker, failed)
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_until_min_calls(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        _call(breaker, failed=True)
+    assert breaker.state == CLOSED
+
+    _call(breaker, failed=True)
+    assert breaker.state == OPEN
+
+
+def test_opens_at_failure_rate_and_refuses_calls(clock):
+    breaker = _breaker()
+    _open(breaker)
+
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["opened"] == 1
+
+
+def test_opens_at_slow_call_rate(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _call(breaker, latency=12.0)
+    assert breaker.state == OPEN
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        _call(breaker, failed=True)
+    clock.advance(61)
+    _call(breaker, failed=True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 1
+
+
+def test_half_open_after_open_seconds_admits_only_the_probes(clock):
+    breaker = _breaker()
+    _open(breaker)
+
+    clock.advance(30)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.is_open()
+    breaker.before_call()
+    # The single probe is out; everyone else is still refused
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_healthy_probe_closes_the_circuit(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(30)
+
+    _call(breaker)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+@pytest.mark.parametrize("failed, latency", [(True, 0.1), (False, 12.0)])
+def test_failed_or_slow_probe_opens_the_circuit_again(clock, failed, latency):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(30)
+
+    _call(breaker, failed=failed, latency=latency)
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 2
+    clock.advance(29)
+    assert breaker.state == OPEN
+
+
+def test_released_probe_lets_another_one_through(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(30)
+
+    breaker.before_call()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
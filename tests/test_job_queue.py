@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.app.services.job_queue import (
+    DONE, QUEUED, RUNNING, JobQueue, JobQueueFullError, JobStore
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the job queue"
+        time.sleep(0.01)
+
+
+def _age_heartbeat(store, job_id, seconds):
+    store._connection().execute(
+        "UPDATE jobs SET heartbeat_at = heartbeat_at - ? WHERE id = ?", (seconds, job_id)
+    )
+
+
+def test_running_job_is_not_claimed_again_within_its_lease(store):
+    job_id = store.add({"n": 1}, None, "a")
+    assert store.claim(lease_seconds=60)["id"] == job_id
+
+    assert store.claim(lease_seconds=60) is None
+    _age_heartbeat(store, job_id, 30)
+    assert store.claim(lease_seconds=60) is None
+
+
+def test_job_with_expired_lease_is_reclaimed_and_starts_over(store):
+    job_id = store.add({"n": 1}, True, "a")
+    store.claim(lease_seconds=60)
+    store.add_event(job_id, "diet", ["rice"])
+
+    _age_heartbeat(store, job_id, 120)
+    job = store.claim(lease_seconds=60)
+
+    assert job == {"id": job_id, "payload": {"n": 1}, "fan_out": True, "session": "a"}
+    assert store.get(job_id)["status"] == RUNNING
+    # Events of the orphaned run are dropped; the new run produces its own
+    assert store.events_after(job_id, 0) == []
+
+
+def test_heartbeat_keeps_the_lease(store):
+    job_id = store.add({"n": 1}, None, "a")
+    store.claim(lease_seconds=60)
+    _age_heartbeat(store, job_id, 120)
+
+    store.heartbeat(job_id)
+    assert store.claim(lease_seconds=60) is None
+
+
+def test_concurrent_submissions_do_not_exceed_max_queued(store):
+    # Each thread has its own connection, like separate API workers
+    barrier = threading.Barrier(20)
+    outcomes = []
+
+    def submit():
+        barrier.wait()
+        outcomes.append(store.add({"n": 1}, None, None, max_queued=5))
+
+    threads = [threading.Thread(target=submit) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len([job_id for job_id in outcomes if job_id]) == 5
+    assert outcomes.count(None) == 15
+    assert store.count(QUEUED) == 5
+
+
+def test_shutdown_requeues_jobs_still_running_after_the_drain(store):
+    async def hanging_runner(payload, fan_out, session):
+        yield "diet", ["rice"]
+        # Never finishes on its own
+        await asyncio.Event().wait()
+        yield None, {"diet": ["rice"]}
+
+    queue = JobQueue(store, hanging_runner, workers=1, drain_seconds=0.2, poll_interval=0.01)
+    queue.start()
+    job_id = queue.submit({"n": 1})
+    _wait_until(lambda: store.events_after(job_id, 0))
+
+    queue.shutdown()
+
+    job = store.get(job_id)
+    assert job["status"] == QUEUED
+    assert job["started_at"] is None
+    assert store.events_after(job_id, 0) == []
+    assert queue.stats()["requeued"] == 1
+    with pytest.raises(JobQueueFullError):
+        queue.submit({"n": 2})
+
+
+def test_requeued_job_runs_on_the_next_start(store):
+    async def runner(payload, fan_out, session):
+        yield "diet", ["rice"]
+        yield None, {"diet": ["rice"], "n": payload["n"]}
+
+    job_id = store.add({"n": 7}, None, "a")
+    store.claim(lease_seconds=60)
+    store.requeue(job_id)
+    assert store.get(job_id)["status"] == QUEUED
+
+    queue = JobQueue(store, runner, workers=1, poll_interval=0.01)
+    queue.start()
+    try:
+        _wait_until(lambda: store.get(job_id)["status"] == DONE)
+    finally:
+        queue.shutdown(timeout=1)
+
+    assert store.get(job_id)["result"] == {"diet": ["rice"], "n": 7}
+    assert [section for _, section, _ in store.events_after(job_id, 0)] == ["diet"]
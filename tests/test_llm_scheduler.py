@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from backend.app.services.deadline import DeadlineExceededError, set_deadline
+from backend.app.services.llm_scheduler import (
+    PRIORITY_CONSULTATION, PRIORITY_RECOMMENDATION, LLMQueueFullError, LLMScheduler
+)
+
+
+class RecordingScheduler(LLMScheduler):
+    """Scheduler that remembers the order tickets were granted in"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.granted = []
+
+    def _grant(self, ticket):
+        self.granted.append(ticket)
+        super()._grant(ticket)
+
+
+def _resume(scheduler):
+    # Lift a pause() early, as if its Retry-After had passed
+    with scheduler._cond:
+        scheduler._paused_until = 0.0
+        scheduler._cond.notify()
+
+
+def _held(scheduler, requests):
+    """Submit (priority, session) requests while dispatching is paused, so
+    they all queue; returns their tickets"""
+    scheduler.pause(60)
+    return [scheduler.submit(priority, 10, session) for priority, session in requests]
+
+
+def test_sessions_take_turns_within_a_priority():
+    scheduler = RecordingScheduler(0, 0, max_wait_seconds=0)
+    tickets = _held(scheduler, [
+        (PRIORITY_CONSULTATION, "a"), (PRIORITY_CONSULTATION, "a"), (PRIORITY_CONSULTATION, "a"),
+        (PRIORITY_CONSULTATION, "b"), (PRIORITY_CONSULTATION, "c"), (PRIORITY_CONSULTATION, "b"),
+    ])
+    a1, a2, a3, b1, c1, b2 = tickets
+
+    # Queue positions already reflect the round-robin order
+    assert [scheduler.status(ticket)["position"] for ticket in (a1, b1, c1, a2, b2, a3)] == [1, 2, 3, 4, 5, 6]
+
+    _resume(scheduler)
+    for ticket in tickets:
+        assert ticket.granted.wait(5)
+    assert scheduler.granted == [a1, b1, c1, a2, b2, a3]
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_consultations_are_served_before_recommendations():
+    scheduler = RecordingScheduler(0, 0, max_wait_seconds=0)
+    recommendation, consultation, second_recommendation = _held(scheduler, [
+        (PRIORITY_RECOMMENDATION, "a"), (PRIORITY_CONSULTATION, "b"), (PRIORITY_RECOMMENDATION, "c"),
+    ])
+
+    _resume(scheduler)
+    for ticket in (recommendation, consultation, second_recommendation):
+        assert ticket.granted.wait(5)
+    assert scheduler.granted == [consultation, recommendation, second_recommendation]
+
+
+def test_request_whose_estimated_wait_is_too_long_is_refused_up_front():
+    # 600 tokens a minute: the first call spends them all, the second would wait a minute
+    scheduler = LLMScheduler(0, 600, max_wait_seconds=5)
+    first = scheduler.submit(PRIORITY_CONSULTATION, 600, "a")
+    assert first.granted.is_set()
+
+    with pytest.raises(LLMQueueFullError):
+        scheduler.submit(PRIORITY_CONSULTATION, 600, "b")
+    stats = scheduler.stats()
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
+
+
+def test_request_whose_estimated_wait_exceeds_its_deadline_is_refused():
+    scheduler = LLMScheduler(0, 600, max_wait_seconds=0)
+    scheduler.submit(PRIORITY_CONSULTATION, 600, "a")
+
+    def submit_with_deadline():
+        set_deadline(5)
+        return scheduler.submit(PRIORITY_CONSULTATION, 600, "b")
+
+    with pytest.raises(DeadlineExceededError):
+        contextvars.copy_context().run(submit_with_deadline)
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_full_queue_refuses_new_requests():
+    scheduler = LLMScheduler(0, 0, max_queue=2, max_wait_seconds=0)
+    _held(scheduler, [(PRIORITY_CONSULTATION, "a"), (PRIORITY_CONSULTATION, "b")])
+
+    with pytest.raises(LLMQueueFullError):
+        scheduler.submit(PRIORITY_CONSULTATION, 10, "c")
+    assert scheduler.stats()["queued"] == 2
+
+
+def test_async_waiter_is_granted_once_the_pause_ends():
+    scheduler = LLMScheduler(0, 0, max_wait_seconds=0)
+    ticket, = _held(scheduler, [(PRIORITY_CONSULTATION, "a")])
+
+    async def wait():
+        statuses = []
+        async for status in scheduler.await_turn(ticket, interval=0.05):
+            statuses.append(status)
+            _resume(scheduler)
+        return statuses
+
+    statuses = asyncio.run(asyncio.wait_for(wait(), 5))
+    assert ticket.granted.is_set()
+    assert statuses[0]["position"] == 1
@@ -0,0 +1,26 @@
+import pytest
+
+from backend.app.services.recommendation_artifacts import RecommendationArtifactStore, write_artifact
+
+ENTRIES = {"vata:60:30:10": {"warnings": ["Avoid cold, dry foods."]}}
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = tmp_path / "artifact.json"
+    write_artifact(path, ENTRIES, 10, prompt_template_version=3, model="model-a")
+    return path
+
+
+def test_matching_artifact_is_loaded(artifact):
+    store = RecommendationArtifactStore(artifact, prompt_template_version=3, model="model-a")
+    assert store.entries == ENTRIES
+    assert store.bucket_size == 10
+
+
+@pytest.mark.parametrize("settings", [
+    {"prompt_template_version": 4, "model": "model-a"},
+    {"prompt_template_version": 3, "model": "model-b"},
+], ids=["other template", "other model"])
+def test_stale_artifact_is_ignored(artifact, settings):
+    assert RecommendationArtifactStore(artifact, **settings).entries == {}
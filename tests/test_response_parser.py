@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import pytest
+
+from backend.app.services.response_parser import (
+    ConsultationResponseParser, empty_sections, parse_consultation_response, parse_section_response
+)
+
+CORPUS = sorted((Path(__file__).resolve().parent.parent / "scripts" / "data" / "llm_outputs").glob("*.txt"))
+
+PLAIN = """Condition Overview
+- Kapha imbalance shows as heaviness and slow digestion.
+
+Dietary Recommendations
+- Favour warm, light and freshly cooked meals.
+- Avoid cold drinks and heavy dairy in the evening.
+- Recommendations for each season:
+
+Herbal Support
+* Triphala at bedtime to support digestion.
+
+Precautions
+• Consult your physician before starting new herbs.
+"""
+
+
+def _sections(**items):
+    sections = empty_sections()
+    for group in ("overview", "recommendations"):
+        for name in sections[group]:
+            sections[group][name] = items.get(name, [])
+    sections["warnings"] = items.get("warnings", [])
+    return sections
+
+
+def test_plain_headers_and_bullets_parse_as_before():
+    # Same result the old ConsultationService parser gave, sub-heading filter included
+    assert parse_consultation_response(PLAIN) == _sections(
+        condition_analysis=["Kapha imbalance shows as heaviness and slow digestion."],
+        dietary=["Favour warm, light and freshly cooked meals.", "Avoid cold drinks and heavy dairy in the evening."],
+        herbal=["Triphala at bedtime to support digestion."],
+        warnings=["Consult your physician before starting new herbs."],
+    )
+
+
+def test_numbered_headers_do_not_swallow_numbered_items():
+    response = """**1. Exercise Recommendations:**
+1. Do vigorous exercise such as jogging for 45 minutes daily.
+2. Exercise between 6 and 10 am to counter sluggishness.
+
+**2. Therapeutic Treatments:**
+1. Udvartana twice a week to reduce Kapha.
+2. Nasya with Anu taila each morning to clear the sinuses.
+"""
+    # The old consultation parser took both exercise items for headers and lost
+    # them; the old recommendation parser kept the headers as items
+    assert parse_consultation_response(response) == _sections(
+        exercise=[
+            "Do vigorous exercise such as jogging for 45 minutes daily.",
+            "Exercise between 6 and 10 am to counter sluggishness.",
+        ],
+        therapeutic=["Udvartana twice a week to reduce Kapha.", "Nasya with Anu taila each morning to clear the sinuses."],
+    )
+
+
+def test_text_before_the_first_header_is_ignored():
+    response = "Based on your profile, here are my suggestions.\n1. A numbered line before any header\n" + PLAIN
+    assert parse_consultation_response(response) == parse_consultation_response(PLAIN)
+
+
+def test_response_without_headers_gives_empty_sections():
+    # The old ConsultationService parser raised KeyError on numbered lines here
+    response = "1. Drink warm water through the day.\n2. Walk for twenty minutes after meals.\n"
+    assert parse_consultation_response(response) == empty_sections()
+
+
+def test_condition_analysis_is_kept_and_emitted_first():
+    parser = ConsultationResponseParser(["Diabetes: a Kapha disorder"])
+    events = parser.feed(PLAIN)
+    assert events[0] == ("overview.condition_analysis", ["Diabetes: a Kapha disorder"])
+
+
+def test_single_section_response_files_every_item_under_it():
+    response = "Dietary Recommendations\n- Favour warm, light and freshly cooked meals.\n" \
+               "Lifestyle\n- Go to bed before ten every night."
+    assert parse_section_response(response, "dietary") == [
+        "Favour warm, light and freshly cooked meals.", "Go to bed before ten every night."
+    ]
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=[path.name for path in CORPUS])
+@pytest.mark.parametrize("chunk_chars", [1, 7, 64])
+def test_chunked_feed_matches_one_shot_parsing(path, chunk_chars):
+    response = path.read_text(encoding="utf-8")
+    parser = ConsultationResponseParser()
+    events = []
+    for start in range(0, len(response), chunk_chars):
+        events.extend(parser.feed(response[start:start + chunk_chars]))
+    events.extend(parser.close())
+
+    result = events[-1]
+    assert result == (None, parse_consultation_response(response))
+    # Each section is emitted once, complete
+    keys = [key for key, _ in events[:-1]]
+    assert len(keys) == len(set(keys))
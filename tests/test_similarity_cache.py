@@ -0,0 +1,72 @@
+import copy
+
+import pytest
+
+from backend.app.services.similarity_cache import SimilarConsultationCache, jaccard, medication_set, text_features
+from backend.app.services.term_extractor import CONDITION, get_term_matcher
+
+CONSULTATION = {
+    "personal_info": {"age": 40},
+    "medical_history": {
+        "conditions": ["Hypertension"],
+        "medications": "Metformin 500mg, amlodipine, atorvastatin, aspirin, levothyroxine",
+    },
+    "concerns": {
+        "primary_concerns": "joint pain in knees and poor sleep at night",
+        "previous_treatments": "yoga, massage with sesame oil, turmeric milk and warm compresses",
+    },
+}
+
+
+def _lookup(change):
+    cache = SimilarConsultationCache()
+    cache.set(CONSULTATION, "consultation", "cached")
+    data = copy.deepcopy(CONSULTATION)
+    change(data)
+    return cache.get(data, "consultation")
+
+
+def test_reworded_concerns_reuse_the_answer():
+    assert _lookup(lambda data: data["concerns"].update(
+        primary_concerns="knee joint pains and poor sleep at night"
+    )) == "cached"
+
+
+def test_medications_match_in_any_order_and_under_any_synonym():
+    assert _lookup(lambda data: data["medical_history"].update(
+        medications="aspirin and Glucophage 500mg; Amlodipine, atorvastatin, levothyroxine"
+    )) == "cached"
+
+
+@pytest.mark.parametrize("change", [
+    lambda data: data["medical_history"].update(medications=data["medical_history"]["medications"] + ", warfarin"),
+    lambda data: data["medical_history"].update(medications="Metformin 1000mg, amlodipine, atorvastatin, aspirin, levothyroxine"),
+    lambda data: data["concerns"].update(primary_concerns="joint pain in knees and poor sleep at night, pregnant"),
+    lambda data: data["concerns"].update(previous_treatments=data["concerns"]["previous_treatments"] + ", ibuprofen"),
+], ids=["added drug", "changed dose", "added condition", "drug in treatments"])
+def test_any_other_condition_or_medication_is_a_miss(change):
+    assert _lookup(change) is None
+
+
+def test_medication_set():
+    assert medication_set("None reported") == []
+    assert medication_set("Glucophage 500mg, no blood thinners") == ["medication:metformin 500mg", "no blood thinner"]
+
+
+@pytest.mark.parametrize("left, right", [
+    ("type 1 diabetes", "type 2 diabetes"),
+    ("gout", "rheumatoid arthritis"),
+    ("hypothyroidism", "hyperthyroidism"),
+    ("sleep apnea", "insomnia"),
+    ("constipation", "diarrhea"),
+])
+def test_diagnoses_filed_under_one_condition_stay_distinct(left, right):
+    assert jaccard(text_features(left), text_features(right)) == 0.0
+    matcher = get_term_matcher()
+    (left_name,), (right_name,) = matcher.extract([left])[CONDITION], matcher.extract([right])[CONDITION]
+    assert left_name != right_name
+    assert matcher.group(left_name) == matcher.group(right_name)
+
+
+def test_synonyms_still_match():
+    assert text_features("high BP") == text_features("hypertension")
@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.app.services.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def _followers(flight, key, count):
+    """Start `count` threads that join the leader's call for `key`; returns the
+    threads and a dict collecting what each one got"""
+    outcomes = {}
+
+    def follow(index):
+        try:
+            outcomes[index] = ("result", flight.do(key, lambda: "follower ran", timeout=5))
+        except Exception as e:
+            outcomes[index] = ("error", e)
+
+    threads = [threading.Thread(target=follow, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the other threads"
+        time.sleep(0.005)
+
+
+def test_followers_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5) and "done"))
+    leader.start()
+    _wait_until(lambda: flight.stats()["in_flight"])
+
+    threads, outcomes = _followers(flight, "key", 3)
+    _wait_until(lambda: flight.stats()["waiters"] == 3)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join(5)
+
+    assert outcomes == {index: ("result", "done") for index in range(3)}
+    assert flight.stats() == {"leaders": 1, "waiters": 3, "in_flight": 0}
+
+
+def test_leader_failure_propagates_to_every_follower():
+    flight = SingleFlight()
+    release = threading.Event()
+    error = ValueError("upstream failed")
+
+    def fail():
+        release.wait(5)
+        raise error
+
+    leader_outcome = []
+
+    def lead():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            leader_outcome.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    _wait_until(lambda: flight.stats()["in_flight"])
+    threads, outcomes = _followers(flight, "key", 3)
+    _wait_until(lambda: flight.stats()["waiters"] == 3)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join(5)
+
+    assert leader_outcome == [error]
+    assert outcomes == {index: ("error", error) for index in range(3)}
+    # The failed call is forgotten; the next caller leads a fresh one
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_leader_interrupt_reaches_followers_as_an_ordinary_error():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def interrupted():
+        release.wait(5)
+        raise KeyboardInterrupt
+
+    leader_outcome = []
+
+    def lead():
+        try:
+            flight.do("key", interrupted)
+        except KeyboardInterrupt as e:
+            leader_outcome.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    _wait_until(lambda: flight.stats()["in_flight"])
+    threads, outcomes = _followers(flight, "key", 2)
+    _wait_until(lambda: flight.stats()["waiters"] == 2)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join(5)
+
+    # Only the leader is interrupted; followers can fall back like on any failure
+    assert len(leader_outcome) == 1
+    assert [(kind, type(error)) for kind, error in outcomes.values()] == [("error", RuntimeError)] * 2
+
+
+def test_follower_timeout_leaves_the_leader_running():
+    flight = SingleFlight()
+    call, leader = flight.claim("key")
+    assert leader
+
+    follower, is_leader = flight.claim("key")
+    assert not is_leader
+    with pytest.raises(TimeoutError):
+        flight.wait(follower, timeout=0.01)
+
+    flight.resolve("key", call, "late")
+    assert flight.wait(follower, timeout=0) == "late"
+
+
+def test_async_leader_failure_propagates_to_every_follower():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def fail():
+            started.set()
+            await release.wait()
+            raise ValueError("upstream failed")
+
+        async def follow():
+            return await flight.do("key", _unexpected, timeout=5)
+
+        leader = asyncio.ensure_future(flight.do("key", fail))
+        await started.wait()
+        followers = [asyncio.ensure_future(follow()) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        outcomes = await asyncio.gather(leader, *followers, return_exceptions=True)
+        return flight, outcomes
+
+    flight, outcomes = asyncio.run(scenario())
+    assert [type(outcome) for outcome in outcomes] == [ValueError] * 4
+    assert len({id(outcome) for outcome in outcomes}) == 1
+    assert flight.stats() == {"leaders": 1, "waiters": 3, "in_flight": 0}
+
+
+def test_async_cancelled_leader_does_not_cancel_its_followers():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.Event().wait()
+
+        async def follow():
+            try:
+                return await flight.do("key", _unexpected, timeout=5)
+            except Exception as e:
+                return e
+
+        leader = asyncio.ensure_future(flight.do("key", hang))
+        await started.wait()
+        followers = [asyncio.ensure_future(follow()) for _ in range(3)]
+        await asyncio.sleep(0)
+        # As when the leader's client disconnects
+        leader.cancel()
+        outcomes = await asyncio.gather(*followers)
+        return flight, leader, outcomes
+
+    flight, leader, outcomes = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert [type(outcome) for outcome in outcomes] == [RuntimeError] * 3
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_async_cancelled_follower_does_not_cancel_the_leader():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def lead():
+            await release.wait()
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("key", lead))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", _unexpected))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await leader, follower.cancelled()
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+async def _unexpected():
+    raise AssertionError("a follower must not run the call")
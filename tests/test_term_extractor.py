@@ -0,0 +1,52 @@
+import pytest
+
+from backend.app.services.term_extractor import CONDITION, MEDICATION, TermMatcher, get_term_matcher
+
+TERMS = [
+    ("asthma", CONDITION, "Asthma"),
+    ("high blood pressure", CONDITION, "Hypertension"),
+    ("blood pressure", CONDITION, "Blood Pressure"),
+    ("metformin", MEDICATION, "Metformin"),
+    ("glucophage", MEDICATION, "Metformin"),
+]
+
+
+@pytest.fixture
+def matcher():
+    return TermMatcher(TERMS)
+
+
+def test_longest_match_wins_and_synonyms_share_a_name(matcher):
+    found = matcher.extract(["High blood pressure; takes Glucophage and metformin"])
+    assert found == {CONDITION: ["Hypertension"], MEDICATION: ["Metformin"]}
+
+
+@pytest.mark.parametrize("text", [
+    "no history of asthma",
+    "Patient denies asthma",
+    "never had asthma",
+])
+def test_negated_terms_are_not_reported(matcher, text):
+    assert matcher.extract([text])[CONDITION] == []
+
+
+@pytest.mark.parametrize("text, kind, name", [
+    ("No alcohol. Takes metformin daily", MEDICATION, "Metformin"),
+    ("No smoking. Has asthma", CONDITION, "Asthma"),
+    ("Not a smoker!\nAsthma since childhood", CONDITION, "Asthma"),
+])
+def test_negation_ends_with_its_sentence(matcher, text, kind, name):
+    assert matcher.extract([text])[kind] == [name]
+
+
+def test_canonical_tokens_replace_matched_phrases(matcher):
+    assert matcher.canonical_tokens("Knee pains. High blood pressure") == [
+        "knee", "pain", "condition:hypertension"
+    ]
+
+
+def test_shipped_dictionary_groups_specific_conditions():
+    matcher = get_term_matcher()
+    assert matcher.extract(["type 2 diabetes"])[CONDITION] == ["Type 2 Diabetes"]
+    assert matcher.group("Type 2 Diabetes") == "Diabetes"
+    assert matcher.group("Hypertension") == "Hypertension"